@@ -0,0 +1,467 @@
+"""ASGI entry point exposing the same routes as main.py with async handlers.
+
+Run with:  uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+LLM and GitHub I/O go through a pooled httpx.AsyncClient (pipeline/async_clients.py)
+under bounded semaphores, so a slow completion waits on the event loop instead of
+pinning a worker thread; /edit providers and chat-memo summaries are awaited the same
+way. Only CPU-bound or local work (git clone, static analysis, TF-IDF retrieval, SMTP,
+applying edits, state-backend reads and writes) runs in a bounded thread pool.
+State (repo files, chat sessions, analysis cache) is shared with the Flask app.
+"""
+import asyncio
+import json
+import threading
+import traceback
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+from starlette.datastructures import Headers, QueryParams
+
+import main
+from async_clients import (
+    LLM_SEMAPHORE,
+    afetch_github_file,
+    bounded_llm,
+    close_client,
+    run_blocking,
+)
+from analysis_cache import get_analysis_cache
+from llm_batcher import get_batcher
+from file_analyzer import FileAnalyzer
+from llm_cache import ainvoke_cached, record_llm_usage
+from model_providers import get_provider_registry
+from profiling import PROFILE_ID_HEADER, finish_profile, get_profile_store, profile_allowed, profiling_flag, start_profile
+from tracing import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics_enabled, render_metrics
+from usage import begin_request_scope, get_usage_ledger
+
+MODEL = "llama-3.3-70b-versatile"
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    await close_client()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+class UsageScopeMiddleware:
+    """Attribute model calls made while serving a request to its endpoint.
+
+    Plain ASGI rather than @app.middleware("http"), which would relay every response
+    (SSE included) through an extra task and memory stream.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            begin_request_scope(scope["path"])
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(UsageScopeMiddleware)
+
+
+class ProfileMiddleware:
+    """Opt-in request profiling (X-Profile: 1 or ?profile=1), gated like the Flask hooks.
+
+    The sampler follows the event-loop thread plus every thread inside one of the
+    request's spans; the loop thread is shared, so concurrent requests show up in it too.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if not profiling_flag(headers, QueryParams(scope.get("query_string", b""))):
+            await self.app(scope, receive, send)
+            return
+        client = scope.get("client")
+        if not (profile_allowed(client[0] if client else None) or main._admin_authorized(headers) is None):
+            await self.app(scope, receive, send)
+            return
+
+        profile = start_profile(scope["path"])
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER.lower().encode("latin-1"), profile.id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            # Returns after the last body chunk, so streamed responses are covered end to end
+            await self.app(scope, receive, send_with_id)
+        except Exception:
+            finish_profile(profile, status=500)
+            raise
+        finish_profile(profile)
+
+
+app.add_middleware(ProfileMiddleware)
+
+
+async def _json_body(request: Request) -> Any:
+    """Lenient body parsing, like Flask's get_json(force=True, silent=True)."""
+    try:
+        return json.loads(await request.body() or b"null")
+    except Exception:
+        return None
+
+
+def _sse_stream(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/")
+async def home():
+    return PlainTextResponse("Hello! FastAPI (ASGI) is running!")
+
+
+@app.get("/metrics")
+async def metrics():
+    if not metrics_enabled():
+        return JSONResponse({"error": "Metrics are disabled; set METRICS_ENABLED=1."}, status_code=404)
+    return PlainTextResponse(render_metrics(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+@app.get("/admin/usage")
+async def admin_usage(request: Request):
+    denied = main._admin_authorized(request.headers)
+    if denied:
+        return JSONResponse(denied[0], status_code=denied[1])
+    return JSONResponse(get_usage_ledger().report())
+
+
+@app.get("/admin/profiles")
+async def admin_profiles(request: Request):
+    denied = main._admin_authorized(request.headers)
+    if denied:
+        return JSONResponse(denied[0], status_code=denied[1])
+    return JSONResponse({"profiles": get_profile_store().list()})
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def admin_profile(profile_id: str, request: Request):
+    denied = main._admin_authorized(request.headers)
+    if denied:
+        return JSONResponse(denied[0], status_code=denied[1])
+    profile = get_profile_store().get(profile_id)
+    if profile is None:
+        return JSONResponse({"error": "Unknown profile id (profiles are kept per worker process)."}, status_code=404)
+    if request.query_params.get("format") == "folded":
+        return PlainTextResponse(profile.folded())
+    return JSONResponse(profile.summary())
+
+
+@app.post("/generate-wiki")
+async def generate_wiki(request: Request):
+    try:
+        prepared, error = await run_blocking(main._prepare_generate_wiki, await _json_body(request))
+        if error:
+            return JSONResponse(error[0], status_code=error[1])
+        pipeline, repo_url = prepared
+
+        # Module summaries fan out on the shared wiki loop; if the client goes away we
+        # cancel what is still outstanding instead of spending LLM quota on nobody.
+        cancel_event = threading.Event()
+
+        async def watch_disconnect() -> None:
+            while not await request.is_disconnected():
+                await asyncio.sleep(1.0)
+            cancel_event.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            wiki_result = await pipeline.agenerate_wiki(repo_url, cancel_event)
+        finally:
+            watcher.cancel()
+        body, status = await run_blocking(main._wiki_response, repo_url, wiki_result)
+        return JSONResponse(body, status_code=status)
+    except Exception as e:
+        print(f"Wiki generation failed: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.post("/analyze-file")
+async def analyze_file(request: Request):
+    try:
+        data = await _json_body(request)
+        if not data:
+            return JSONResponse({"error": "Invalid or missing JSON body"}, status_code=400)
+
+        file_path = data.get("file_path")
+        root_path = data.get("root_path", "/")
+        main._tag_repo(root_path)
+        code_content = data.get("file_content")
+        if not code_content and file_path and root_path and "/" in root_path:
+            owner, repo = root_path.split("/", 1)
+            try:
+                code_content = await afetch_github_file(owner, repo, file_path.lstrip("/"))
+            except Exception as e:
+                return JSONResponse({"error": str(e)}, status_code=400)
+        if not code_content:
+            return JSONResponse({"error": "No file content provided and unable to fetch from GitHub. Please provide file_content or valid file_path with root_path."}, status_code=400)
+
+        cache = get_analysis_cache()
+        max_content_chars = 4000
+        analyzer = FileAnalyzer()
+
+        static_key = cache.static_key(code_content)
+        analysis = cache.get(static_key)
+        static_cached = analysis is not None
+        if not static_cached:
+            analysis = await run_blocking(analyzer.analyze_code_string, code_content)
+            if "error" in analysis:
+                return JSONResponse({"error": analysis["error"]}, status_code=400)
+            cache.put(static_key, analysis)
+
+        review_key = cache.review_key(code_content, MODEL, max_content_chars)
+        ai_analysis = cache.get(review_key)
+        review_cached = ai_analysis is not None
+        if not review_cached:
+            llm_prompt = analyzer.generate_llm_prompt(analysis, file_content=code_content, max_content_chars=max_content_chars)
+            result = await get_batcher(MODEL).asubmit(llm_prompt)
+            if not result["ok"]:
+                return JSONResponse({"error": result["error"], "static_analysis": analysis}, status_code=500)
+            ai_analysis = result["output"]
+            cache.put(review_key, ai_analysis)
+
+        return JSONResponse({
+            "success": True,
+            "model_used": MODEL,
+            "static_analysis": analysis,
+            "ai_analysis": ai_analysis,
+            "cached": {"static": static_cached, "review": review_cached},
+            "fetched_file_content_preview": code_content[:2000],
+        })
+    except Exception as e:
+        print(f"⚠️ Unexpected failure: {str(e)}")
+        return JSONResponse({"error": f"Unexpected failure: {str(e)}"}, status_code=500)
+
+
+@app.post("/analyze-batch")
+async def analyze_batch(request: Request):
+    lines, error = main._analyze_batch_lines(await _json_body(request))
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+    # The batch pipeline manages its own thread/process pools; iterate it off the loop
+    return StreamingResponse(iterate_in_threadpool(lines), media_type="application/x-ndjson")
+
+
+async def _prepare_ask_anything(data: Any):
+    error = await run_blocking(main._resolve_file_session, data, "file_content")
+    if error:
+        return None, error
+    fields, error = main._validate_ask_anything(data)
+    if error:
+        return None, error
+    file_content = fields["file_content"]
+    if not file_content:
+        owner, repo = fields["root_path"].split("/", 1)
+        file_content = await afetch_github_file(owner, repo, fields["file_path"])
+    # Session lookup may hit the SQLite backend; keep it off the loop
+    return await run_blocking(main._ask_anything_context, fields, file_content), None
+
+
+@app.api_route("/ask-anything", methods=["POST", "OPTIONS"])
+async def ask_anything(request: Request):
+    if request.method == "OPTIONS":
+        return JSONResponse({})
+    try:
+        ctx, error = await _prepare_ask_anything(await _json_body(request))
+        if error:
+            return JSONResponse(error[0], status_code=error[1])
+
+        answer = await bounded_llm(lambda: ainvoke_cached(ctx["llm"], ctx["messages"]))
+        await main.file_history_store.acommit_turn(ctx["session_id"], ctx["user_message"], answer)
+
+        return JSONResponse({
+            "success": True,
+            "answer": answer,
+            "model_used": "Groq + LangChain",
+            "session_id": ctx["session_id"],
+            "file_path": ctx["file_path"],
+        })
+    except Exception as e:
+        traceback.print_exc()
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.api_route("/ask-anything/stream", methods=["POST", "OPTIONS"])
+async def ask_anything_stream(request: Request):
+    if request.method == "OPTIONS":
+        return JSONResponse({})
+    try:
+        ctx, error = await _prepare_ask_anything(await _json_body(request))
+        if error:
+            return JSONResponse(error[0], status_code=error[1])
+    except Exception as e:
+        traceback.print_exc()
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    async def events():
+        yield main._sse("sources", {"sources": [ctx["file_path"]], "session_id": ctx["session_id"]})
+        parts: List[str] = []
+        last_usage = None
+        try:
+            async for chunk in ctx["runnable"].astream(ctx["inputs"]):
+                if getattr(chunk, "usage_metadata", None):
+                    last_usage = chunk
+                text = chunk.content if hasattr(chunk, "content") else str(chunk)
+                if text:
+                    parts.append(text)
+                    yield main._sse("token", {"text": text})
+        except Exception as e:
+            traceback.print_exc()
+            yield main._sse("error", {"error": str(e)})
+            return
+        if last_usage is not None:
+            record_llm_usage(ctx["llm"], last_usage)
+        answer = "".join(parts)
+        await main.file_history_store.acommit_turn(ctx["session_id"], ctx["user_message"], answer)
+        yield main._sse("done", {"success": True, "answer": answer, "model_used": "Groq + LangChain"})
+
+    return _sse_stream(events())
+
+
+async def _wiki_answer(args: Dict[str, Any]) -> str:
+    # Same provider order as the Flask route: Groq, then Gemini on failure (or when hedging)
+    result = await bounded_llm(lambda: get_provider_registry().acomplete(**args))
+    return result.get("output", "I'm sorry, I couldn't generate an answer.")
+
+
+@app.api_route("/wiki-chat", methods=["POST", "OPTIONS"])
+async def wiki_chat(request: Request):
+    if request.method == "OPTIONS":
+        return JSONResponse({})
+    try:
+        # Retrieval is CPU-bound TF-IDF; run it off the loop
+        ctx, error = await run_blocking(main._prepare_wiki_chat, await _json_body(request))
+        if error:
+            return JSONResponse(error[0], status_code=error[1])
+        args = main._wiki_chat_request(ctx["prompt"])
+        if args is None:
+            return JSONResponse({"error": "No LLM API keys configured"}, status_code=500)
+
+        answer = await _wiki_answer(args)
+        return JSONResponse({"success": True, "answer": answer, "sources": ctx["sources"]})
+    except Exception as e:
+        print(f"Wiki chat failed: {e}")
+        traceback.print_exc()
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.api_route("/wiki-chat/stream", methods=["POST", "OPTIONS"])
+async def wiki_chat_stream(request: Request):
+    if request.method == "OPTIONS":
+        return JSONResponse({})
+    try:
+        ctx, error = await run_blocking(main._prepare_wiki_chat, await _json_body(request))
+        if error:
+            return JSONResponse(error[0], status_code=error[1])
+        args = main._wiki_chat_request(ctx["prompt"])
+        if args is None:
+            return JSONResponse({"error": "No LLM API keys configured"}, status_code=500)
+    except Exception as e:
+        print(f"Wiki chat failed: {e}")
+        traceback.print_exc()
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    async def events():
+        yield main._sse("sources", {"sources": ctx["sources"]})
+        parts: List[str] = []
+        try:
+            async with LLM_SEMAPHORE:
+                async for text in get_provider_registry().astream(**args):
+                    if text:
+                        parts.append(text)
+                        yield main._sse("token", {"text": text})
+        except Exception as e:
+            print(f"Wiki chat stream failed: {e}")
+            yield main._sse("error", {"error": str(e)})
+            return
+        yield main._sse("done", {"success": True, "answer": "".join(parts)})
+
+    return _sse_stream(events())
+
+
+@app.api_route("/share-wiki", methods=["POST", "OPTIONS"])
+async def share_wiki(request: Request):
+    if request.method == "OPTIONS":
+        return JSONResponse({})
+    try:
+        body, status = await run_blocking(main._share_wiki_result, await _json_body(request))
+        return JSONResponse(body, status_code=status)
+    except Exception as e:
+        print(f"Failed to send email: {e}")
+        traceback.print_exc()
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.post("/edit")
+async def edit(request: Request):
+    try:
+        payload: Dict[str, Any] = json.loads(await request.body())
+        if not isinstance(payload, dict):
+            return JSONResponse({"error": "request body must be a JSON object"}, status_code=400)
+    except Exception as exc:
+        return JSONResponse({"error": f"invalid JSON body: {type(exc).__name__}: {exc}"}, status_code=400)
+
+    body, status = await _edit_result(payload)
+    return JSONResponse(body, status_code=status)
+
+
+async def _edit_result(payload: Dict[str, Any]):
+    # Same steps as main._edit_result; only the parse/apply work between model calls is threaded
+    steps = main._edit_steps(payload)
+    prompt, result = await run_blocking(main._advance_edit, steps, None)
+    while result is None:
+        raw_text = await bounded_llm(lambda: main.acallModelAPI(prompt))
+        prompt, result = await run_blocking(main._advance_edit, steps, raw_text)
+    return result
+
+
+@app.post("/edit/stream")
+async def edit_stream(request: Request):
+    try:
+        payload: Dict[str, Any] = json.loads(await request.body())
+        if not isinstance(payload, dict):
+            return JSONResponse({"error": "request body must be a JSON object"}, status_code=400)
+    except Exception as exc:
+        return JSONResponse({"error": f"invalid JSON body: {type(exc).__name__}: {exc}"}, status_code=400)
+
+    error = await run_blocking(main._resolve_file_session, payload, "current")
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+    ok, err = main._validate_request_payload(payload)
+    if not ok:
+        return JSONResponse({"error": err}, status_code=400)
+    # Provider streams are blocking iterators; drain them in the thread pool
+    return _sse_stream(iterate_in_threadpool(main._edit_stream_events(payload)))
+
+
+@app.post("/edit/session")
+async def edit_session(request: Request):
+    body, status = await run_blocking(main._create_file_session, await _json_body(request))
+    return JSONResponse(body, status_code=status)
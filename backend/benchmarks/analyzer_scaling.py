@@ -0,0 +1,260 @@
+# benchmarks/analyzer_scaling.py
+"""Scaling micro-benchmarks for the static analyzers, core-logic ranking, comment stripping, JSON extraction and retrieval.
+
+Each case is timed on synthetic inputs of growing size (source files from 1 KB to
+10 MB, corpora from 10 to 50k files). A log-log least-squares fit of time against
+size then gives the scaling exponent: ~1 is linear, ~2 is quadratic. Any case whose
+exponent exceeds its limit fails the run (exit code 1), so a regression into
+quadratic behavior cannot slip through quietly.
+
+    python benchmarks/analyzer_scaling.py                 # all cases
+    python benchmarks/analyzer_scaling.py --case retrieval --max-files 10000
+    python benchmarks/analyzer_scaling.py --quick         # up to 1 MB / 5k files
+    python benchmarks/analyzer_scaling.py --json scaling.json
+
+A case stops growing once a single measurement exceeds --budget-s / 4 or the case
+has used --budget-s in total; the exponent is fitted on what was measured.
+"""
+import argparse
+import atexit
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(os.path.join(BACKEND_DIR, 'pipeline'))
+sys.path.append(BACKEND_DIR)
+
+from fixtures import generate_source
+
+FILE_SIZES = [1_000, 4_000, 16_000, 64_000, 256_000, 1_000_000, 4_000_000, 10_000_000]
+CORPUS_SIZES = [10, 100, 1_000, 5_000, 10_000, 50_000]
+
+# Fits only use points at least this slow; below it fixed overhead flattens the slope
+MIN_FIT_SECONDS = 0.002
+
+# Linear code still fits at ~1.1-1.3 once multi-MB inputs fall out of cache and fresh
+# allocations page-fault; 1.5 leaves room for that while n^2 (and n^1.5) still fail.
+DEFAULT_MAX_EXPONENT = 1.5
+
+
+def _analyze_code_string() -> Callable[[int], Callable[[], Any]]:
+    from file_analyzer import FileAnalyzer
+
+    analyzer = FileAnalyzer()
+
+    def setup(n: int) -> Callable[[], Any]:
+        code = generate_source("py", n)
+        return lambda: analyzer.analyze_code_string(code)
+
+    return setup
+
+
+def _testing_analyze_file() -> Callable[[int], Callable[[], Any]]:
+    import testing_file_analyze
+
+    workdir = tempfile.mkdtemp(prefix="analyzer-scaling-")
+    atexit.register(shutil.rmtree, workdir, True)
+    analyzer = testing_file_analyze.FileAnalyzer(workdir)
+
+    def setup(n: int) -> Callable[[], Any]:
+        path = os.path.join(workdir, f"sample_{n}.py")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(generate_source("py", n))
+        return lambda: analyzer.analyze_file(path)
+
+    return setup
+
+
+def _identify_core_logic() -> Callable[[int], Callable[[], Any]]:
+    from wiki_generator import WikiPipeline
+
+    # The ranking needs no providers; skip __init__ so no API keys are required
+    pipeline = WikiPipeline.__new__(WikiPipeline)
+
+    def setup(n: int) -> Callable[[], Any]:
+        code = generate_source("ts", n)
+        return lambda: pipeline._identify_core_logic(code)
+
+    return setup
+
+
+def _compress_code() -> Callable[[int], Callable[[], Any]]:
+    from code_compress import compress_code
+
+    def setup(n: int) -> Callable[[], Any]:
+        code = generate_source("py", n)
+        return lambda: compress_code(code, "python")
+
+    return setup
+
+
+def _extract_json_fenced() -> Callable[[int], Callable[[], Any]]:
+    from main import _extract_json_from_text
+
+    def setup(n: int) -> Callable[[], Any]:
+        code = generate_source("py", n)
+        body = json.dumps({"edits": [{"start_line": 1, "start_col": 1, "end_line": 1, "end_col": 1, "replacement": code}]})
+        text = f"Here is the edit you asked for.\n```json\n{body}\n```\nLet me know if anything else is needed."
+        found = _extract_json_from_text(text)
+        if found != body:
+            raise AssertionError(f"extract_json_fenced at {n:,} bytes returned {found!r:.80}")
+        return lambda: _extract_json_from_text(text)
+
+    return setup
+
+
+def _extract_json_after_code() -> Callable[[int], Callable[[], Any]]:
+    from main import _extract_json_from_text
+
+    def setup(n: int) -> Callable[[], Any]:
+        # Brace-heavy prose before the object: the worst case for the `{` scan
+        code = generate_source("ts", n)
+        text = f"Changes below.\n{code}\nResult: " + json.dumps({"edits": []})
+        # A scaling result only counts if the answer is right (a bail-out is fast, too)
+        found = _extract_json_from_text(text)
+        if found != '{"edits": []}':
+            raise AssertionError(f"extract_json_after_code at {n:,} bytes returned {found!r:.80}")
+        return lambda: _extract_json_from_text(text)
+
+    return setup
+
+
+def _retrieval() -> Callable[[int], Callable[[], Any]]:
+    from query_analysis import QueryAnalyzer
+
+    sources = [generate_source(lang, 1_200, seed=i) for i, lang in enumerate(("py", "ts", "go", "java", "js") * 4)]
+
+    def setup(n: int) -> Callable[[], Any]:
+        corpus = {f"src/mod_{i // 100}/file_{i}.x": sources[i % len(sources)] + f"\nunique_token_{i}\n" for i in range(n)}
+        analyzer = QueryAnalyzer(corpus)
+        return lambda: analyzer.find_relevant_files("where is the session cache token refreshed", top_k=5)
+
+    return setup
+
+
+# name -> (setup factory, sizes, unit, allowed exponent)
+CASES: Dict[str, Tuple[Callable[[], Callable[[int], Callable[[], Any]]], List[int], str, float]] = {
+    "analyze_code_string": (_analyze_code_string, FILE_SIZES, "bytes", DEFAULT_MAX_EXPONENT),
+    "testing_analyze_file": (_testing_analyze_file, FILE_SIZES, "bytes", DEFAULT_MAX_EXPONENT),
+    "identify_core_logic": (_identify_core_logic, FILE_SIZES, "bytes", DEFAULT_MAX_EXPONENT),
+    "compress_code": (_compress_code, FILE_SIZES, "bytes", DEFAULT_MAX_EXPONENT),
+    "extract_json_fenced": (_extract_json_fenced, FILE_SIZES, "bytes", DEFAULT_MAX_EXPONENT),
+    "extract_json_after_code": (_extract_json_after_code, FILE_SIZES, "bytes", DEFAULT_MAX_EXPONENT),
+    "retrieval": (_retrieval, CORPUS_SIZES, "files", DEFAULT_MAX_EXPONENT),
+}
+
+
+def measure(fn: Callable[[], Any], min_total: float = 0.2, max_repeats: int = 5) -> float:
+    """Best-of-N wall time; N shrinks to 1 when a single call already takes long."""
+    best = math.inf
+    spent = 0.0
+    for _ in range(max_repeats):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = min(best, elapsed)
+        spent += elapsed
+        if spent >= min_total:
+            break
+    return best
+
+
+def fit_exponent(points: List[Tuple[int, float]]) -> Optional[float]:
+    """Slope of log(time) against log(size) over the large end, where the asymptotic term dominates."""
+    usable = [(n, t) for n, t in points if t >= MIN_FIT_SECONDS]
+    if len(usable) < 3:
+        usable = points[-3:]
+    usable = usable[-max(3, len(usable) // 2):]
+    if len(usable) < 2:
+        return None
+    xs = [math.log(n) for n, _ in usable]
+    ys = [math.log(max(t, 1e-9)) for _, t in usable]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    var = sum((x - mean_x) ** 2 for x in xs)
+    if var == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var
+
+
+def run_case(name: str, sizes: List[int], factory: Callable, unit: str, budget: float) -> Dict[str, Any]:
+    setup = factory()
+    points: List[Tuple[int, float]] = []
+    stopped_at = None
+    spent = 0.0
+    for n in sizes:
+        fn = setup(n)
+        seconds = measure(fn)
+        points.append((n, seconds))
+        spent += seconds
+        print(f"  {name:<24} {n:>12,} {unit:<5} {seconds * 1000:>12.2f} ms", flush=True)
+        if seconds > budget / 4 or spent > budget:
+            stopped_at = n if n != sizes[-1] else None
+            break
+    return {
+        "case": name,
+        "unit": unit,
+        "points": [{"size": n, "seconds": round(t, 6)} for n, t in points],
+        "exponent": fit_exponent(points),
+        "stopped_at": stopped_at,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--case", action="append", choices=sorted(CASES), help="case to run (repeatable; default: all)")
+    parser.add_argument("--max-bytes", type=int, default=FILE_SIZES[-1])
+    parser.add_argument("--max-files", type=int, default=CORPUS_SIZES[-1])
+    parser.add_argument("--quick", action="store_true", help="cap at 1 MB files and 5k-file corpora")
+    parser.add_argument("--budget-s", type=float, default=60.0, help="time budget per case")
+    parser.add_argument("--max-exponent", type=float, help="override every case's allowed exponent")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    max_bytes = min(args.max_bytes, 1_000_000) if args.quick else args.max_bytes
+    max_files = min(args.max_files, 5_000) if args.quick else args.max_files
+
+    results: List[Dict[str, Any]] = []
+    failures: List[str] = []
+    for name in args.case or list(CASES):
+        factory, sizes, unit, limit = CASES[name]
+        cap = max_files if unit == "files" else max_bytes
+        sizes = [n for n in sizes if n <= cap] or sizes[:1]
+        if args.max_exponent is not None:
+            limit = args.max_exponent
+        result = run_case(name, sizes, factory, unit, args.budget_s)
+        result["max_exponent"] = limit
+        exponent = result["exponent"]
+        if exponent is not None and exponent > limit:
+            failures.append(f"{name}: time grows as size^{exponent:.2f} (limit {limit:.2f})")
+        results.append(result)
+
+    print(f"\n{'case':<26} {'exponent':>9} {'limit':>7}  note")
+    for r in results:
+        exponent = f"{r['exponent']:.2f}" if r["exponent"] is not None else "-"
+        note = f"stopped at {r['stopped_at']:,} {r['unit']} (budget)" if r["stopped_at"] else ""
+        print(f"{r['case']:<26} {exponent:>9} {r['max_exponent']:>7.2f}  {note}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"results": results}, f, indent=2)
+
+    if failures:
+        print("\n" + "!" * 72)
+        print("SUPERLINEAR SCALING DETECTED")
+        for line in failures:
+            print(f"  - {line}")
+        print("!" * 72)
+        return 1
+    print("\nAll cases scale within their limits.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+# benchmarks/fixtures.py
+"""Synthetic fixture repositories of varied size and language mix, generated deterministically."""
+import os
+import random
+from typing import Dict, List
+
+# name -> layout. `dirs` empty means every file sits in the repo root.
+PROFILES: Dict[str, Dict] = {
+    "small-python": {"files": 12, "lines": 80, "langs": {"py": 1.0}, "dirs": ["app", "app/api", "lib"]},
+    "mixed-medium": {
+        "files": 30,
+        "lines": 220,
+        "langs": {"py": 0.4, "ts": 0.3, "go": 0.2, "java": 0.1},
+        "dirs": ["services/auth", "services/billing", "web/src", "web/src/components", "pkg/store", "tools"],
+    },
+    "flat-js": {"files": 25, "lines": 150, "langs": {"js": 0.7, "ts": 0.3}, "dirs": []},
+    "large-files": {
+        "files": 40,
+        "lines": 900,
+        "langs": {"py": 0.3, "ts": 0.3, "go": 0.2, "java": 0.2},
+        "dirs": ["core", "core/engine", "api", "api/handlers", "storage", "workers", "cli"],
+    },
+}
+
+_WORDS = [
+    "user", "order", "cache", "token", "session", "index", "record", "batch", "event", "queue",
+    "payload", "config", "client", "result", "schema", "worker", "route", "item", "buffer", "state",
+]
+
+
+def _name(rng: random.Random, parts: int = 2) -> str:
+    return "_".join(rng.choice(_WORDS) for _ in range(parts))
+
+
+def _camel(rng: random.Random) -> str:
+    return "".join(w.capitalize() for w in _name(rng).split("_"))
+
+
+def _python(rng: random.Random, lines: int) -> str:
+    out = ["import os", "import json", "from typing import Dict, List", ""]
+    while len(out) < lines:
+        cls = _camel(rng)
+        out += [f"class {cls}:", f'    """Handles {_name(rng, 3).replace("_", " ")}."""', ""]
+        for _ in range(rng.randint(2, 4)):
+            fn, arg = _name(rng), _name(rng, 1)
+            out += [
+                f"    def {fn}(self, {arg}: Dict[str, int]) -> List[int]:",
+                f"        # Walk every {arg} entry and keep the valid ones",
+                "        result = []",
+                f"        for key, value in {arg}.items():",
+                "            if value > 0 and key.startswith('x'):",
+                "                result.append(value * 2)",
+                "            elif value < 0:",
+                "                raise ValueError(key)",
+                "        return result",
+                "",
+            ]
+    return "\n".join(out[:lines]) + "\n"
+
+
+def _typescript(rng: random.Random, lines: int, typed: bool = True) -> str:
+    t = (lambda s: s) if typed else (lambda s: "")
+    out = ["import { readFile } from 'fs';", "import axios from 'axios';", ""]
+    while len(out) < lines:
+        fn, arg = _camel(rng), _name(rng, 1)
+        out += [
+            f"// {_name(rng, 3).replace('_', ' ')}",
+            f"export async function load{fn}({arg}{t(': string[]')}){t(': Promise<number>')} {{",
+            "  let total = 0;",
+            f"  for (const entry of {arg}) {{",
+            "    if (entry.length > 3 && entry !== 'skip') {",
+            "      const res = await axios.get(`/api/${entry}`);",
+            "      total += res.data.count;",
+            "    }",
+            "  }",
+            "  return total;",
+            "}",
+            "",
+        ]
+    return "\n".join(out[:lines]) + "\n"
+
+
+def _go(rng: random.Random, lines: int) -> str:
+    out = ["package main", "", 'import "fmt"', ""]
+    while len(out) < lines:
+        fn, arg = _camel(rng), _name(rng, 1)
+        out += [
+            f"// {fn} sums the positive {arg} values",
+            f"func {fn}({arg} []int) (int, error) {{",
+            "\ttotal := 0",
+            f"\tfor _, v := range {arg} {{",
+            "\t\tif v > 0 {",
+            "\t\t\ttotal += v",
+            "\t\t} else if v < -100 {",
+            '\t\t\treturn 0, fmt.Errorf("bad value %d", v)',
+            "\t\t}",
+            "\t}",
+            "\treturn total, nil",
+            "}",
+            "",
+        ]
+    return "\n".join(out[:lines]) + "\n"
+
+
+def _java(rng: random.Random, lines: int) -> str:
+    cls = _camel(rng)
+    out = ["package com.example;", "", "import java.util.List;", "", f"public class {cls} {{"]
+    while len(out) < lines - 1:
+        fn, arg = _camel(rng), _name(rng, 1)
+        out += [
+            f"    /** Counts matching {arg} entries. */",
+            f"    public int count{fn}(List<String> {arg}) {{",
+            "        int n = 0;",
+            f"        for (String s : {arg}) {{",
+            "            if (s != null && s.length() > 2) {",
+            "                n++;",
+            "            }",
+            "        }",
+            "        return n;",
+            "    }",
+            "",
+        ]
+    return "\n".join(out[:lines - 1] + ["}"]) + "\n"
+
+
+_GENERATORS = {
+    "py": _python,
+    "ts": _typescript,
+    "js": lambda rng, lines: _typescript(rng, lines, typed=False),
+    "go": _go,
+    "java": _java,
+}
+
+
+def write_fixture(profile: str, root: str, seed: int = 1) -> str:
+    """Write the `profile` fixture repo under `root`; returns its directory."""
+    spec = PROFILES[profile]
+    rng = random.Random(f"{profile}:{seed}")
+    repo_dir = os.path.join(root, profile)
+    langs: List[str] = list(spec["langs"])
+    weights: List[float] = [spec["langs"][l] for l in langs]
+    for i in range(spec["files"]):
+        lang = rng.choices(langs, weights)[0]
+        directory = rng.choice(spec["dirs"]) if spec["dirs"] else ""
+        lines = max(20, int(spec["lines"] * rng.uniform(0.5, 1.5)))
+        path = os.path.join(repo_dir, directory, f"{_name(rng)}_{i}.{lang}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(_GENERATORS[lang](rng, lines))
+    return repo_dir
+
+
+def generate_source(lang: str, n_bytes: int, seed: int = 1) -> str:
+    """One synthetic `lang` source file of about `n_bytes` (cut at a line boundary)."""
+    rng = random.Random(f"{lang}:{n_bytes}:{seed}")
+    generate = _GENERATORS[lang]
+    text = generate(rng, max(20, n_bytes // 30))
+    while len(text) < n_bytes:
+        text += generate(rng, max(20, (n_bytes - len(text)) // 30))
+    cut = text.rfind("\n", 0, n_bytes)
+    return text[:cut + 1] if cut > 0 else text[:n_bytes]
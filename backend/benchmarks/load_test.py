@@ -0,0 +1,382 @@
+# benchmarks/load_test.py
+"""Load test of the HTTP endpoints under each serving mode, against stubbed upstreams.
+
+Starts benchmarks/stub_upstreams.py (GitHub, git clone, Groq, Gemini, Ollama), then for
+each serving mode starts the backend pointed at the stub, warms it with one
+/generate-wiki and drives /analyze-file, /ask-anything, /wiki-chat, /edit and
+/generate-wiki at a fixed arrival rate (open loop: a slow server does not slow the
+arrivals down, so queueing shows up as latency instead of being hidden).
+
+    python benchmarks/load_test.py --rps 5 --duration 30
+    python benchmarks/load_test.py --mode gunicorn --workers 4 --threads 8 --rps 20
+    python benchmarks/load_test.py --mode waitress --groq-latency-ms 1500 --groq-rpm 120
+
+Per mode and endpoint it reports p50/p90/p99/max latency, error rate by status and
+achieved throughput. Worker saturation is the mean number of requests in the server
+(Little's law: completed request-seconds / wall time) divided by the mode's worker
+slots; near or above 1.0 requests are queueing for a worker. Dispatch lag (arrival to
+send) shows when the load generator itself could not keep up.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fixtures import PROFILES, generate_source
+from stub_upstreams import add_arguments as add_stub_arguments
+
+MODES = ("dev", "waitress", "gunicorn", "uvicorn")
+ENDPOINTS = ("analyze-file", "ask-anything", "wiki-chat", "edit", "generate-wiki")
+# Relative share of arrivals; generate-wiki is rare and heavy, as in real traffic
+DEFAULT_MIX = "analyze-file=3,ask-anything=3,wiki-chat=2,edit=2,generate-wiki=0.2"
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {proc.returncode} before becoming ready")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.25)
+    raise RuntimeError(f"{url} not ready after {timeout:.0f}s")
+
+
+def _stop(proc: subprocess.Popen) -> None:
+    if proc.poll() is None:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+
+
+def _process_tree(pid: int) -> List[int]:
+    """pid and all its descendants (gunicorn workers), from /proc."""
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        try:
+            for tid in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{tid}/children") as f:
+                    stack.extend(int(c) for c in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def _cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time of the process tree, or None where /proc is unavailable."""
+    total, seen = 0.0, False
+    for p in _process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / _CLK_TCK
+            seen = True
+        except (OSError, IndexError, ValueError):
+            continue
+    return total if seen else None
+
+
+def server_command(mode: str, port: int, args: argparse.Namespace) -> List[str]:
+    """Command line of the backend under `mode`, listening on 127.0.0.1:port."""
+    if mode == "dev":
+        return [sys.executable, "main.py"]
+    if mode == "waitress":
+        return [sys.executable, "-m", "waitress", f"--listen=127.0.0.1:{port}", f"--threads={args.threads}", "main:app"]
+    if mode == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "--threads", str(args.threads),
+                "-b", f"127.0.0.1:{port}", "--timeout", "300", "--log-level", "warning", "main:app"]
+    if mode == "uvicorn":
+        return [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(args.workers), "--log-level", "warning"]
+    raise ValueError(mode)
+
+
+def worker_slots(mode: str, args: argparse.Namespace) -> Optional[int]:
+    """Requests the mode can serve at once; None when it spawns a thread per request."""
+    if mode == "waitress":
+        return args.threads
+    if mode == "gunicorn":
+        return args.workers * args.threads
+    if mode == "uvicorn":
+        # Blocking handlers run on anyio's default 40-thread pool in each worker
+        return args.workers * 40
+    return None
+
+
+def server_env(stub_url: str, port: int, state_db: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "GITHUB_API_BASE": stub_url,
+        "GITHUB_CLONE_BASE": stub_url,
+        "GROQ_API_BASE": stub_url,
+        "GEMINI_API_BASE": stub_url,
+        "OLLAMA_BASE_URL": stub_url,
+        "GROQ_API_KEY": "stub-groq-key",
+        "GROQ_API_KEYS": "stub-groq-key-1,stub-groq-key-2,stub-groq-key-3",
+        "GOOGLE_API_KEY": "stub-google-key",
+        "GITHUB_TOKEN": "",
+        "MODEL_PROVIDER": "groq",
+        # Measure the serving path, not cache hits
+        "LLM_CACHE_ENABLED": "0",
+        "ANALYSIS_CACHE_SIZE": "0",
+        # Shared across gunicorn/uvicorn workers so /wiki-chat finds the warmed repo
+        "STATE_BACKEND": "sqlite",
+        "STATE_DB_PATH": state_db,
+        "WIKI_RATE_LIMIT_COOLDOWN": "2",
+        "PYTHONUNBUFFERED": "1",
+    })
+    return env
+
+
+class LoadGenerator:
+    """Open-loop request driver; payload builders cycle paths and sessions so caches stay cold."""
+
+    def __init__(self, base_url: str, repo_url: str, args: argparse.Namespace):
+        self.base_url = base_url
+        self.repo_url = repo_url
+        self.args = args
+        self.counter = 0
+        self._lock = threading.Lock()
+        self._edit_source = generate_source("py", 3000, seed=args.seed)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=args.concurrency)
+        self.session.mount("http://", adapter)
+
+    def _next(self) -> int:
+        with self._lock:
+            self.counter += 1
+            return self.counter
+
+    def payload(self, endpoint: str) -> Dict[str, Any]:
+        n = self._next()
+        if endpoint == "analyze-file":
+            return {"file_path": f"src/pkg_{n % 50}/module_{n}.py", "root_path": "bench/load"}
+        if endpoint == "ask-anything":
+            return {"file_path": f"src/pkg_{n % 50}/module_{n}.py", "root_path": "bench/load",
+                    "message": "What does this file do and where could it fail?", "session_id": f"load-{n}"}
+        if endpoint == "wiki-chat":
+            return {"repo_url": self.repo_url, "message": f"Where is the session cache token refreshed? ({n})"}
+        if endpoint == "edit":
+            return {"current": self._edit_source, "file_path": f"load_{n}.py", "user": "Add a comment above the first class.",
+                    "mode": "inline", "selection": {"start_line": 5, "start_col": 1, "end_line": 5, "end_col": 1}}
+        if endpoint == "generate-wiki":
+            return {"repo_url": self.repo_url}
+        raise ValueError(endpoint)
+
+    def call(self, endpoint: str, scheduled: float) -> Dict[str, Any]:
+        sent = time.monotonic()
+        try:
+            resp = self.session.post(f"{self.base_url}/{endpoint}", json=self.payload(endpoint), timeout=self.args.timeout)
+            status = resp.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        done = time.monotonic()
+        return {"endpoint": endpoint, "status": status, "latency": done - scheduled, "service": done - sent, "lag": sent - scheduled}
+
+    def run(self, mix: Dict[str, float], rps: float, duration: float) -> List[Dict[str, Any]]:
+        rng = random.Random(self.args.seed)
+        names, weights = list(mix), list(mix.values())
+        arrivals: List[float] = []
+        t = 0.0
+        while t < duration:
+            arrivals.append(t)
+            t += rng.expovariate(rps) if self.args.poisson else 1.0 / rps
+        results: List[Dict[str, Any]] = []
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            start = time.monotonic()
+            for offset in arrivals:
+                scheduled = start + offset
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(pool.submit(self.call, rng.choices(names, weights)[0], scheduled))
+            for future in futures:
+                results.append(future.result())
+        return results
+
+
+def summarize(results: List[Dict[str, Any]], wall: float, slots: Optional[int], cpu: Optional[float]) -> Dict[str, Any]:
+    def stats(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        latencies = [r["latency"] for r in rows]
+        statuses: Dict[str, int] = {}
+        for r in rows:
+            statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+        errors = sum(1 for r in rows if not (isinstance(r["status"], int) and r["status"] < 400))
+        return {
+            "requests": len(rows),
+            "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+            "statuses": statuses,
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+            "p90_ms": round(percentile(latencies, 0.9) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "max_ms": round(max(latencies, default=0) * 1000, 1),
+            "achieved_rps": round(len(rows) / wall, 2) if wall else 0.0,
+        }
+
+    in_flight = sum(r["service"] for r in results) / wall if wall else 0.0
+    return {
+        "overall": stats(results),
+        "endpoints": {e: stats([r for r in results if r["endpoint"] == e]) for e in ENDPOINTS if any(r["endpoint"] == e for r in results)},
+        "mean_in_flight": round(in_flight, 2),
+        "worker_slots": slots,
+        "saturation": round(in_flight / slots, 3) if slots else None,
+        "dispatch_lag_p99_ms": round(percentile([r["lag"] for r in results], 0.99) * 1000, 1),
+        "server_cpu_pct": round(cpu / wall * 100, 1) if cpu is not None and wall else None,
+    }
+
+
+def run_mode(mode: str, stub_url: str, mix: Dict[str, float], args: argparse.Namespace) -> Dict[str, Any]:
+    port = _free_port()
+    state_dir = tempfile.mkdtemp(prefix="load-test-state-")
+    log = open(os.path.join(state_dir, "server.log"), "w")
+    proc = subprocess.Popen(
+        server_command(mode, port, args), cwd=BACKEND_DIR, env=server_env(stub_url, port, os.path.join(state_dir, "state.db")),
+        stdout=log if args.quiet else None, stderr=subprocess.STDOUT if args.quiet else None, start_new_session=True,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_ready(base_url + "/", proc, args.startup_timeout)
+        gen = LoadGenerator(base_url, f"https://github.com/bench/{args.profile}", args)
+        warm = gen.call("generate-wiki", time.monotonic())
+        if warm["status"] != 200:
+            print(f"[{mode}] warm-up /generate-wiki returned {warm['status']}; /wiki-chat will fail")
+        cpu_before = _cpu_seconds(proc.pid)
+        started = time.monotonic()
+        results = gen.run(mix, args.rps, args.duration)
+        wall = time.monotonic() - started
+        cpu_after = _cpu_seconds(proc.pid)
+        cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+        report = summarize(results, wall, worker_slots(mode, args), cpu)
+        report["mode"] = mode
+        report["warmup_ms"] = round(warm["latency"] * 1000, 1)
+        return report
+    finally:
+        _stop(proc)
+        log.close()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+def start_stub(args: argparse.Namespace) -> subprocess.Popen:
+    forwarded: List[str] = []
+    for key, value in vars(args).items():
+        if key in args.stub_options:
+            forwarded += [f"--{key.replace('_', '-')}", str(value)]
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "stub_upstreams.py"), "--port", str(port)] + forwarded,
+        stdout=subprocess.DEVNULL, start_new_session=True,
+    )
+    proc.url = f"http://127.0.0.1:{port}"  # type: ignore[attr-defined]
+    _wait_ready(proc.url + "/_stub/stats", proc, 60)  # type: ignore[attr-defined]
+    return proc
+
+
+def parse_mix(text: str, only: Optional[List[str]]) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint in --mix: {name}")
+        if only and name not in only:
+            continue
+        if float(weight or 1) > 0:
+            mix[name] = float(weight or 1)
+    if not mix:
+        raise SystemExit("--mix selects no endpoints")
+    return mix
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    sat = f"{report['saturation']:.2f}" if report["saturation"] is not None else "n/a (thread per request)"
+    print(f"\n== {report['mode']}: {report['overall']['achieved_rps']} req/s, {report['mean_in_flight']} in flight, "
+          f"saturation {sat}, server CPU {report['server_cpu_pct']}%, dispatch lag p99 {report['dispatch_lag_p99_ms']} ms")
+    print(f"  {'endpoint':<15} {'reqs':>6} {'err%':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuses")
+    for name, row in list(report["endpoints"].items()) + [("ALL", report["overall"])]:
+        print(f"  {name:<15} {row['requests']:>6} {row['error_rate'] * 100:>6.1f} {row['p50_ms']:>9.1f} {row['p90_ms']:>9.1f} "
+              f"{row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}  {row['statuses']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", action="append", choices=MODES, help="serving mode (repeatable; default: dev, waitress, gunicorn)")
+    parser.add_argument("--rps", type=float, default=5.0, help="target arrival rate")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load per mode")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. 'edit=1,wiki-chat=2'")
+    parser.add_argument("--endpoint", action="append", choices=ENDPOINTS, help="restrict the mix to these endpoints (repeatable)")
+    parser.add_argument("--poisson", action="store_true", help="exponential inter-arrival times instead of a fixed interval")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn/uvicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="waitress threads / gunicorn threads per worker")
+    parser.add_argument("--concurrency", type=int, default=256, help="client-side cap on requests in flight")
+    parser.add_argument("--timeout", type=float, default=120.0, help="client timeout per request")
+    parser.add_argument("--profile", default="mixed-medium", choices=sorted(PROFILES), help="fixture repo for the wiki endpoints")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="also write the reports to this file")
+    parser.add_argument("--quiet", action="store_true", help="send server output to a log file instead of the terminal")
+    before = {a.dest for a in parser._actions}
+    add_stub_arguments(parser)
+    stub_options = {a.dest for a in parser._actions} - before
+    args = parser.parse_args()
+    args.stub_options = stub_options
+
+    mix = parse_mix(args.mix, args.endpoint)
+    stub = start_stub(args)
+    reports: List[Dict[str, Any]] = []
+    try:
+        for mode in args.mode or ["dev", "waitress", "gunicorn"]:
+            print(f"\n[{mode}] {args.rps} req/s for {args.duration:.0f}s, mix {mix}", flush=True)
+            report = run_mode(mode, stub.url, mix, args)  # type: ignore[attr-defined]
+            reports.append(report)
+            print_report(report)
+        upstream = requests.get(stub.url + "/_stub/stats", timeout=5).json()  # type: ignore[attr-defined]
+        print(f"\nstub upstream calls: {upstream}")
+    finally:
+        _stop(stub)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"rps": args.rps, "duration": args.duration, "mix": mix, "reports": reports}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
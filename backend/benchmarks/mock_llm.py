@@ -0,0 +1,139 @@
+# benchmarks/mock_llm.py
+"""Deterministic stand-ins for the LLM providers, so benchmarks never spend API quota."""
+import asyncio
+import os
+import random
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pipeline'))
+
+from model_providers import ModelProvider
+
+_SECTION_MARKER = re.compile(r"^=== ([\w-]+): (.+?) ===$", re.MULTILINE)
+
+
+class MockBehavior:
+    """Latency and failure profile shared by every mock call of one benchmark run.
+
+    Latency is `latency_ms` plus uniform jitter of +/- `jitter_ms`; each call fails with
+    a generic error with probability `error_rate`, or with a 429 with probability
+    `rate_limit_rate`. A seeded RNG keeps runs comparable.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 200,
+        jitter_ms: float = 50,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        output_tokens: int = 400,
+        seed: int = 7,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.output_tokens = output_tokens
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self) -> Dict[str, Any]:
+        """Outcome of the next call: {"delay": seconds, "fail": None | "error" | "rate_limit"}."""
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+            roll = self._rng.random()
+            fail = None
+            if roll < self.rate_limit_rate:
+                fail = "rate_limit"
+                self.rate_limited += 1
+            elif roll < self.rate_limit_rate + self.error_rate:
+                fail = "error"
+                self.errors += 1
+        return {"delay": delay, "fail": fail}
+
+    def answer(self, prompt: str) -> str:
+        """Text of roughly `output_tokens` tokens; packed prompts get one section per marker."""
+        filler = " ".join(["lorem"] * max(1, self.output_tokens))
+        markers = _SECTION_MARKER.findall(prompt)
+        if not markers:
+            return f"MODULE: Mock\n{filler}"
+        per_section = " ".join(["lorem"] * max(1, self.output_tokens // len(markers)))
+        return "\n\n".join(f"=== {label}: {name} ===\nMODULE: {name}\n{per_section}" for label, name in markers)
+
+    @staticmethod
+    def raise_for(fail: Optional[str]) -> None:
+        if fail == "rate_limit":
+            raise Exception("Error code: 429 - rate limit reached (mock)")
+        if fail == "error":
+            raise Exception("Error code: 500 - internal error (mock)")
+
+
+class MockMessage:
+    """The parts of a LangChain AIMessage the pipeline reads."""
+
+    def __init__(self, content: str, prompt_tokens: int, completion_tokens: int):
+        self.content = content
+        self.usage_metadata = {"input_tokens": prompt_tokens, "output_tokens": completion_tokens}
+
+
+def _prompt_text(messages: Any) -> str:
+    if isinstance(messages, str):
+        return messages
+    return "\n".join(str(getattr(m, "content", m.get("content", "") if isinstance(m, dict) else m)) for m in messages)
+
+
+class MockChatModel:
+    """Minimal LangChain-style chat model (`invoke` / `ainvoke`) driven by a MockBehavior."""
+
+    def __init__(self, behavior: MockBehavior, api_key: str, model: str = "mock-llm"):
+        self.behavior = behavior
+        self.api_key = api_key
+        self.model_name = model
+        self.temperature = 0.2
+
+    def _respond(self, prompt: str) -> MockMessage:
+        text = self.behavior.answer(prompt)
+        return MockMessage(text, len(prompt) // 4, len(text) // 4)
+
+    def invoke(self, messages: Any) -> MockMessage:
+        outcome = self.behavior.draw()
+        time.sleep(outcome["delay"])
+        self.behavior.raise_for(outcome["fail"])
+        return self._respond(_prompt_text(messages))
+
+    async def ainvoke(self, messages: Any) -> MockMessage:
+        outcome = self.behavior.draw()
+        await asyncio.sleep(outcome["delay"])
+        self.behavior.raise_for(outcome["fail"])
+        return self._respond(_prompt_text(messages))
+
+
+class MockProvider(ModelProvider):
+    """Registry-compatible provider backed by MockChatModel (one instance per fake API key)."""
+
+    kind = "mock"
+
+    def __init__(self, name: str, behavior: MockBehavior, api_key: str = ""):
+        super().__init__(name, "mock-llm", api_key or f"mock-{name}")
+        self.behavior = behavior
+
+    def complete(self, messages, temperature, max_tokens, timeout, json_mode=False) -> str:
+        return MockChatModel(self.behavior, self.api_key).invoke(messages).content
+
+    async def acomplete(self, messages, temperature, max_tokens, timeout, json_mode=False) -> str:
+        return (await MockChatModel(self.behavior, self.api_key).ainvoke(messages)).content
+
+    def chat_model(self, temperature: float):
+        return MockChatModel(self.behavior, self.api_key)
+
+
+def mock_providers(count: int, behavior: MockBehavior) -> List[MockProvider]:
+    return [MockProvider(f"mock{i}", behavior) for i in range(count)]
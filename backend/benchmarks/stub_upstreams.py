@@ -0,0 +1,373 @@
+# benchmarks/stub_upstreams.py
+"""Local stand-ins for api.github.com, github.com (git clone), Groq, Gemini and Ollama.
+
+One threaded HTTP server answers every upstream the backend talks to, with
+configurable latency, error rate and rate limits per upstream, so load tests can
+run without network access or API quota. Point the backend at it with:
+
+    GITHUB_API_BASE=http://127.0.0.1:PORT    GITHUB_CLONE_BASE=http://127.0.0.1:PORT
+    GROQ_API_BASE=http://127.0.0.1:PORT      GEMINI_API_BASE=http://127.0.0.1:PORT
+    OLLAMA_BASE_URL=http://127.0.0.1:PORT
+
+Clonable repos are the fixture profiles, as https://github.com/bench/<profile>.
+GET /_stub/stats returns per-upstream call, 429 and error counts.
+
+    python benchmarks/stub_upstreams.py --port 9300 --groq-latency-ms 400 --groq-rpm 300
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fixtures import PROFILES, generate_source, write_fixture
+from mock_llm import MockBehavior
+
+UPSTREAMS = ("github", "groq", "gemini", "ollama")
+# Smart-HTTP endpoints; like github.com, the repo path may omit the ".git" suffix
+_GIT_PATH = re.compile(r"^/([^/]+)/([^/]+?)(?:\.git)?(/info/refs|/git-upload-pack)$")
+_EXT_LANG = {".py": "py", ".ts": "ts", ".tsx": "ts", ".js": "js", ".jsx": "js", ".go": "go", ".java": "java"}
+
+
+class RateLimiter:
+    """Token bucket: `per_minute` requests (or tokens) per minute, bursting up to one second's worth."""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount: float = 1.0) -> Tuple[bool, float, float]:
+        """(allowed, tokens left, seconds until `amount` is available)."""
+        if not self.per_minute:
+            return True, float("inf"), 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            amount = min(amount, self.capacity)
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True, self.tokens, 0.0
+            return False, self.tokens, (amount - self.tokens) / self.rate
+
+
+class Upstream:
+    """Latency/failure profile, limits and counters of one stubbed service."""
+
+    def __init__(self, name: str, behavior: MockBehavior, rpm: float = 0, tpm: float = 0):
+        self.name = name
+        self.behavior = behavior
+        self.requests = RateLimiter(rpm)
+        self.tokens = RateLimiter(tpm)
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def admit(self, token_estimate: int = 0) -> Tuple[bool, Dict[str, str]]:
+        """Apply rate limits; returns (allowed, extra response headers)."""
+        ok_req, _, wait_req = self.requests.take()
+        ok_tok, left_tok, wait_tok = self.tokens.take(token_estimate) if token_estimate else (True, float("inf"), 0.0)
+        headers: Dict[str, str] = {}
+        if self.tokens.per_minute:
+            headers["x-ratelimit-limit-tokens"] = str(int(self.tokens.per_minute))
+            headers["x-ratelimit-remaining-tokens"] = str(max(0, int(left_tok)))
+            headers["x-ratelimit-reset-tokens"] = f"{max(wait_tok, 60.0 / self.tokens.per_minute * token_estimate if not ok_tok else 0):.2f}s"
+        if ok_req and ok_tok:
+            return True, headers
+        with self._lock:
+            self.rate_limited += 1
+        headers["retry-after"] = str(max(1, int(max(wait_req, wait_tok) + 0.999)))
+        return False, headers
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.behavior.calls,
+            "errors": self.behavior.errors,
+            "rate_limited": self.rate_limited + self.behavior.rate_limited,
+        }
+
+
+def _build_git_root(root: str) -> str:
+    """Bare repos of every fixture profile under root/bench/<profile>.git, for `git http-backend`."""
+    work = os.path.join(root, "work")
+    env = {**os.environ, "GIT_AUTHOR_NAME": "bench", "GIT_AUTHOR_EMAIL": "bench@example.com",
+           "GIT_COMMITTER_NAME": "bench", "GIT_COMMITTER_EMAIL": "bench@example.com"}
+    for profile in PROFILES:
+        repo_dir = write_fixture(profile, work)
+        for cmd in (["git", "init", "-q", "-b", "main"], ["git", "add", "-A"], ["git", "commit", "-q", "-m", "fixture"]):
+            subprocess.run(cmd, cwd=repo_dir, check=True, env=env, capture_output=True)
+        bare = os.path.join(root, "git", "bench", f"{profile}.git")
+        subprocess.run(["git", "clone", "-q", "--bare", repo_dir, bare], check=True, capture_output=True)
+    return os.path.join(root, "git")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "stub-upstreams/1.0"
+
+    # set on the class by serve()
+    upstreams: Dict[str, Upstream] = {}
+    git_root = ""
+    github_file_bytes = 6000
+
+    def log_message(self, format, *args):  # keep load tests quiet
+        pass
+
+    # --- plumbing -------------------------------------------------------------------
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status: int, body: Any, content_type: str = "application/json", headers: Optional[Dict[str, str]] = None) -> None:
+        data = body if isinstance(body, bytes) else (json.dumps(body) if content_type == "application/json" else str(body)).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        # No length: the body ends when we close the connection
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Connection", "close")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.close_connection = True
+
+    def _simulate(self, upstream: Upstream, token_estimate: int = 0) -> Optional[Dict[str, str]]:
+        """Rate limit, latency and injected failures; None when a response was already sent."""
+        allowed, headers = upstream.admit(token_estimate)
+        if not allowed:
+            self._send(429, {"error": {"message": f"Rate limit reached for {upstream.name} (stub)", "type": "rate_limit_exceeded"}}, headers=headers)
+            return None
+        outcome = upstream.behavior.draw()
+        time.sleep(outcome["delay"])
+        if outcome["fail"] == "rate_limit":
+            self._send(429, {"error": {"message": "Rate limit reached (stub)"}}, headers={**headers, "retry-after": "1"})
+            return None
+        if outcome["fail"] == "error":
+            self._send(500, {"error": {"message": "Internal error (stub)"}})
+            return None
+        return headers
+
+    # --- routes ---------------------------------------------------------------------
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/_stub/stats":
+            return self._send(200, {name: u.stats() for name, u in self.upstreams.items()})
+        if path.startswith("/repos/") and "/contents/" in path:
+            return self._github_contents(path)
+        if _GIT_PATH.match(path):
+            return self._git_http_backend(b"")
+        return self._send(404, {"message": "Not Found"})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self._body()
+        if path.endswith("/chat/completions"):
+            return self._groq(body)
+        if ":generateContent" in path or ":streamGenerateContent" in path:
+            return self._gemini(path, body)
+        if path == "/api/generate":
+            return self._ollama(body)
+        if _GIT_PATH.match(path):
+            return self._git_http_backend(body)
+        return self._send(404, {"message": "Not Found"})
+
+    def _github_contents(self, path: str) -> None:
+        if self._simulate(self.upstreams["github"]) is None:
+            return
+        file_path = path.split("/contents/", 1)[1]
+        lang = _EXT_LANG.get(os.path.splitext(file_path)[1].lower(), "py")
+        seed = sum(file_path.encode("utf-8"))
+        self._send(200, generate_source(lang, self.github_file_bytes, seed=seed), content_type="text/plain; charset=utf-8")
+
+    def _git_http_backend(self, body: bytes) -> None:
+        """Smart-HTTP git via `git http-backend` (CGI), so shallow clones work like on github.com."""
+        parts = urlsplit(self.path)
+        owner, repo, service = _GIT_PATH.match(parts.path).groups()
+        env = {
+            **os.environ,
+            "GIT_PROJECT_ROOT": self.git_root,
+            "GIT_HTTP_EXPORT_ALL": "1",
+            "PATH_INFO": f"/{owner}/{repo}.git{service}",
+            "QUERY_STRING": parts.query,
+            "REQUEST_METHOD": self.command,
+            "CONTENT_TYPE": self.headers.get("Content-Type", ""),
+            "CONTENT_LENGTH": str(len(body)),
+            "REMOTE_ADDR": "127.0.0.1",
+        }
+        if self.headers.get("Git-Protocol"):
+            env["GIT_PROTOCOL"] = self.headers["Git-Protocol"]
+        proc = subprocess.run(["git", "http-backend"], input=body, env=env, capture_output=True)
+        raw_headers, _, payload = proc.stdout.partition(b"\r\n\r\n")
+        status, headers = 200, {}
+        for line in raw_headers.decode("latin-1").split("\r\n"):
+            if ":" not in line:
+                continue
+            key, value = line.split(":", 1)
+            if key.lower() == "status":
+                status = int(value.strip().split()[0])
+            else:
+                headers[key.strip()] = value.strip()
+        content_type = headers.pop("Content-Type", "application/octet-stream")
+        self._send(status, payload, content_type=content_type, headers=headers)
+
+    def _groq(self, body: bytes) -> None:
+        request = json.loads(body or b"{}")
+        prompt = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+        upstream = self.upstreams["groq"]
+        headers = self._simulate(upstream, token_estimate=len(prompt) // 4 + upstream.behavior.output_tokens)
+        if headers is None:
+            return
+        json_mode = (request.get("response_format") or {}).get("type") == "json_object"
+        text = _edit_json(prompt) if json_mode else upstream.behavior.answer(prompt)
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4, "total_tokens": (len(prompt) + len(text)) // 4}
+        model = request.get("model", "stub")
+        if not request.get("stream"):
+            return self._send(200, {
+                "id": "stub", "object": "chat.completion", "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            }, headers=headers)
+        self._start_stream("text/event-stream", headers)
+        for piece in _pieces(text):
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        final = {"id": "stub", "object": "chat.completion.chunk", "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}}
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+
+    def _gemini(self, path: str, body: bytes) -> None:
+        request = json.loads(body or b"{}")
+        prompt = "\n".join(
+            str(part.get("text", "")) for content in request.get("contents", []) for part in content.get("parts", [])
+        )
+        upstream = self.upstreams["gemini"]
+        if self._simulate(upstream, token_estimate=len(prompt) // 4) is None:
+            return
+        json_mode = (request.get("generationConfig") or {}).get("responseMimeType") == "application/json"
+        text = _edit_json(prompt) if json_mode else upstream.behavior.answer(prompt)
+        usage = {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4, "totalTokenCount": (len(prompt) + len(text)) // 4}
+
+        def response(piece: str, final: bool) -> Dict[str, Any]:
+            candidate: Dict[str, Any] = {"content": {"role": "model", "parts": [{"text": piece}]}, "index": 0}
+            if final:
+                candidate["finishReason"] = "STOP"
+            return {"candidates": [candidate], "usageMetadata": usage, "modelVersion": "stub"}
+
+        if ":streamGenerateContent" not in path:
+            return self._send(200, response(text, True))
+        self._start_stream("text/event-stream")
+        pieces = _pieces(text)
+        for i, piece in enumerate(pieces):
+            self.wfile.write(f"data: {json.dumps(response(piece, i == len(pieces) - 1))}\r\n\r\n".encode("utf-8"))
+
+    def _ollama(self, body: bytes) -> None:
+        request = json.loads(body or b"{}")
+        prompt = str(request.get("prompt", ""))
+        upstream = self.upstreams["ollama"]
+        if self._simulate(upstream) is None:
+            return
+        text = _edit_json(prompt) if request.get("format") == "json" else upstream.behavior.answer(prompt)
+        done = {"model": request.get("model", "stub"), "done": True, "prompt_eval_count": len(prompt) // 4, "eval_count": len(text) // 4}
+        if not request.get("stream", True):
+            return self._send(200, {**done, "response": text})
+        self._start_stream("application/x-ndjson")
+        for piece in _pieces(text):
+            self.wfile.write((json.dumps({"model": done["model"], "response": piece, "done": False}) + "\n").encode("utf-8"))
+        self.wfile.write((json.dumps({**done, "response": ""}) + "\n").encode("utf-8"))
+
+
+def _pieces(text: str, size: int = 64):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+_SELECTION = re.compile(r"start_line=(\d+)\s+start_col=(\d+)")
+
+
+def _edit_json(prompt: str) -> str:
+    """A valid /edit answer: one comment inserted at the selection start (or at 1:1)."""
+    match = _SELECTION.search(prompt.split("<<SELECTION>>", 1)[1]) if "<<SELECTION>>" in prompt else None
+    line, col = (int(match.group(1)), int(match.group(2))) if match else (1, 1)
+    return json.dumps({"edits": [{
+        "start_line": line, "start_col": col, "end_line": line, "end_col": col,
+        "replacement": "# edited by stub\n", "explanation": "stub edit",
+    }]})
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve(args: argparse.Namespace) -> None:
+    def behavior(name: str) -> MockBehavior:
+        return MockBehavior(
+            latency_ms=getattr(args, f"{name}_latency_ms"),
+            jitter_ms=getattr(args, f"{name}_latency_ms") * args.jitter,
+            error_rate=getattr(args, f"{name}_error_rate"),
+            output_tokens=args.output_tokens,
+            seed=args.seed,
+        )
+
+    StubHandler.upstreams = {
+        name: Upstream(name, behavior(name), rpm=getattr(args, f"{name}_rpm"), tpm=args.groq_tpm if name == "groq" else 0)
+        for name in UPSTREAMS
+    }
+    StubHandler.github_file_bytes = args.github_file_bytes
+    root = tempfile.mkdtemp(prefix="stub-upstreams-")
+    try:
+        StubHandler.git_root = _build_git_root(root)
+        server = _Server((args.host, args.port), StubHandler)
+        print(f"stub upstreams listening on http://{args.host}:{server.server_address[1]}", flush=True)
+        server.serve_forever()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Stub options; shared with load_test.py, which forwards them to the stub process."""
+    defaults = {"github": 80, "groq": 600, "gemini": 900, "ollama": 1500}
+    for name in UPSTREAMS:
+        parser.add_argument(f"--{name}-latency-ms", type=float, default=defaults[name])
+        parser.add_argument(f"--{name}-rpm", type=float, default=0, help=f"{name} requests per minute before 429s (0 = unlimited)")
+        parser.add_argument(f"--{name}-error-rate", type=float, default=0.0)
+    parser.add_argument("--groq-tpm", type=float, default=0, help="Groq tokens per minute before 429s (0 = unlimited)")
+    parser.add_argument("--jitter", type=float, default=0.25, help="latency jitter as a fraction of the latency")
+    parser.add_argument("--output-tokens", type=int, default=300)
+    parser.add_argument("--github-file-bytes", type=int, default=6000)
+    parser.add_argument("--seed", type=int, default=7)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9300)
+    add_arguments(parser)
+    serve(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# benchmarks/wiki_pipeline_bench.py
+"""Offline benchmark of the wiki pipeline: fetch -> aggregate -> extract -> summarize.
+
+Runs against synthetic fixture repos (benchmarks/fixtures.py) and/or local checkouts
+(--repo), with mock providers standing in for Groq/Gemini, so no API quota is used.
+Reports per-stage p50/p95, throughput and peak memory, and compares against a stored
+baseline:
+
+    python benchmarks/wiki_pipeline_bench.py                      # compare with baseline
+    python benchmarks/wiki_pipeline_bench.py --save-baseline      # record a new baseline
+    python benchmarks/wiki_pipeline_bench.py --rate-limit-rate 0.1 --latency-ms 400
+
+Timings depend on the machine; record the baseline on the same host you compare on.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(BENCH_DIR), 'pipeline'))
+
+# Every run must reach the (mock) model; a warm prompt cache would hide the summarize stage
+os.environ["LLM_CACHE_ENABLED"] = "0"
+
+from fixtures import PROFILES, write_fixture
+from mock_llm import MockBehavior, mock_providers
+from wiki_generator import WikiPipeline, _get_wiki_loop
+
+STAGES = ("fetch", "aggregate", "extract", "summarize", "total")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baselines", "wiki_pipeline.json")
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def run_once(pipeline: WikiPipeline, repo_dir: str) -> Tuple[Dict[str, float], Dict[str, int]]:
+    """One full pass; returns (seconds per stage, counts)."""
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+
+    t = time.perf_counter()
+    files_data, meta = pipeline.read_local_repo(repo_dir)
+    timings["fetch"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    modules = pipeline.aggregate_modules(files_data)
+    timings["aggregate"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    module_tasks, repo_info, all_modules_text = pipeline._build_module_tasks(modules, files_data, meta)
+    timings["extract"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    future = asyncio.run_coroutine_threadsafe(
+        pipeline._fan_out(module_tasks, repo_info, all_modules_text), _get_wiki_loop()
+    )
+    sections, _ = future.result()
+    timings["summarize"] = time.perf_counter() - t
+
+    timings["total"] = time.perf_counter() - started
+    failed = sum(1 for s in sections if any(str(c).startswith("Error") for c in s.get("content", [])))
+    return timings, {"files": len(files_data), "modules": len(module_tasks), "sections": len(sections), "failed_sections": failed}
+
+
+def peak_memory_mb(pipeline: WikiPipeline, repo_dir: str) -> float:
+    """Peak traced allocation of one pass (a separate pass, so tracing never skews timings)."""
+    tracemalloc.start()
+    try:
+        run_once(pipeline, repo_dir)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def bench_repo(name: str, repo_dir: str, args: argparse.Namespace) -> Dict[str, Any]:
+    behavior = MockBehavior(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        output_tokens=args.output_tokens,
+        seed=args.seed,
+    )
+    pipeline = WikiPipeline(github_token="", providers=mock_providers(args.keys, behavior))
+    pipeline.rate_limit_cooldown = args.cooldown
+
+    for _ in range(args.warmup):
+        run_once(pipeline, repo_dir)
+
+    samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    counts: Dict[str, int] = {}
+    for _ in range(args.runs):
+        timings, counts = run_once(pipeline, repo_dir)
+        for stage in STAGES:
+            samples[stage].append(timings[stage])
+
+    total_p50 = percentile(samples["total"], 0.5)
+    result: Dict[str, Any] = {
+        "repo": name,
+        "counts": counts,
+        "stages": {
+            stage: {
+                "p50_ms": round(percentile(samples[stage], 0.5) * 1000, 3),
+                "p95_ms": round(percentile(samples[stage], 0.95) * 1000, 3),
+            }
+            for stage in STAGES
+        },
+        "files_per_s": round(counts.get("files", 0) / total_p50, 2) if total_p50 else None,
+        "modules_per_s": round(counts.get("modules", 0) / total_p50, 2) if total_p50 else None,
+        "mock": {"calls": behavior.calls, "errors": behavior.errors, "rate_limited": behavior.rate_limited},
+    }
+    if not args.no_memory:
+        result["peak_mb"] = round(peak_memory_mb(pipeline, repo_dir), 2)
+    return result
+
+
+def settings_of(args: argparse.Namespace) -> Dict[str, Any]:
+    """Parameters that must match for two result sets to be comparable."""
+    return {
+        "keys": args.keys,
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+        "output_tokens": args.output_tokens,
+        "cooldown": args.cooldown,
+        "seed": args.seed,
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float, min_delta_ms: float) -> List[str]:
+    """Regressions against `baseline`: a p50 slower by more than `tolerance` (and `min_delta_ms`), or more memory."""
+    regressions: List[str] = []
+    base_by_repo = {r["repo"]: r for r in baseline.get("results", [])}
+    for result in results:
+        base = base_by_repo.get(result["repo"])
+        if base is None:
+            continue
+        for stage in STAGES:
+            now = result["stages"][stage]["p50_ms"]
+            then = base["stages"].get(stage, {}).get("p50_ms")
+            if then is None:
+                continue
+            if now > then * (1 + tolerance) and now - then > min_delta_ms:
+                regressions.append(f"{result['repo']}/{stage}: p50 {then:.1f}ms -> {now:.1f}ms (+{(now / then - 1) * 100 if then else 0:.0f}%)")
+        if "peak_mb" in result and base.get("peak_mb"):
+            if result["peak_mb"] > base["peak_mb"] * (1 + tolerance) and result["peak_mb"] - base["peak_mb"] > 1:
+                regressions.append(f"{result['repo']}/memory: peak {base['peak_mb']:.1f}MB -> {result['peak_mb']:.1f}MB")
+    return regressions
+
+
+def print_table(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]) -> None:
+    base_by_repo = {r["repo"]: r for r in (baseline or {}).get("results", [])}
+    for result in results:
+        c = result["counts"]
+        print(f"\n{result['repo']}: {c.get('files')} files, {c.get('modules')} modules, {c.get('failed_sections')} failed sections, "
+              f"{result['files_per_s']} files/s, peak {result.get('peak_mb', '-')} MB, mock {result['mock']}")
+        print(f"  {'stage':<10} {'p50 ms':>10} {'p95 ms':>10} {'base p50':>10} {'change':>8}")
+        base = base_by_repo.get(result["repo"], {}).get("stages", {})
+        for stage in STAGES:
+            row = result["stages"][stage]
+            then = base.get(stage, {}).get("p50_ms")
+            change = f"{(row['p50_ms'] / then - 1) * 100:+.0f}%" if then else ""
+            then_text = f"{then:.1f}" if then is not None else "-"
+            print(f"  {stage:<10} {row['p50_ms']:>10.1f} {row['p95_ms']:>10.1f} {then_text:>10} {change:>8}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", action="append", choices=sorted(PROFILES), help="fixture profile (repeatable; default: all)")
+    parser.add_argument("--repo", action="append", default=[], help="local checkout to benchmark as well (repeatable)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--keys", type=int, default=3, help="number of mock API keys")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--output-tokens", type=int, default=400)
+    parser.add_argument("--cooldown", type=float, default=0.5, help="seconds a mock key cools down after a 429")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown before flagging (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="ignore regressions smaller than this")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--quiet", action="store_true", help="silence the pipeline's own progress output")
+    args = parser.parse_args()
+
+    profiles = args.profile or ([] if args.repo else sorted(PROFILES))
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as fixture_root:
+        targets = [(p, write_fixture(p, fixture_root, seed=args.seed)) for p in profiles]
+        targets += [(os.path.basename(os.path.normpath(r)), r) for r in args.repo]
+        for name, repo_dir in targets:
+            if args.quiet:
+                with open(os.devnull, "w") as devnull:
+                    stdout, sys.stdout = sys.stdout, devnull
+                    try:
+                        results.append(bench_repo(name, repo_dir, args))
+                    finally:
+                        sys.stdout = stdout
+            else:
+                results.append(bench_repo(name, repo_dir, args))
+
+    report = {"settings": settings_of(args), "runs": args.runs, "results": results}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != report["settings"]:
+            print(f"Baseline {args.baseline} was recorded with different settings; not comparing.")
+            baseline = None
+
+    print_table(results, baseline)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,21 @@
+import contextvars
+import hmac
 import json
 import os
+import re
 import sys
-from typing import Any, Dict, List, Optional, Tuple
-from flask import Flask, request, jsonify
+import threading
+from typing import Any, Dict, Generator, Iterator, List, Optional, Tuple
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import base64
 import requests
 import traceback
 
 from dotenv import load_dotenv
-from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_groq import ChatGroq
-from langchain_community.chat_message_histories import ChatMessageHistory
 
 # Load environment variables first
 load_dotenv()
@@ -29,11 +30,26 @@ from file_analyzer import FileAnalyzer, call_groq, call_ollama, call_ollama_http
 from wiki_generator import WikiPipeline
 from query_analysis import QueryAnalyzer
 from retriever import CodeRetriever
+from chat_history import BoundedHistoryStore
+from batch_analyzer import BatchAnalyzer, batch_input_error
+from llm_batcher import get_batcher
+from analysis_cache import get_analysis_cache
+from state_backend import get_state_backend, normalize_repo_key
+from llm_cache import ainvoke_cached, invoke_cached, record_llm_usage
+from model_providers import get_provider_registry, provider_order
+from json_stream import IncrementalArrayParser
+from edit_applier import apply_edits
+from file_sessions import FileSessionStore
+from code_graph import symbol_outline
+from tracing import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics_enabled, render_metrics, span
+from usage import begin_request_scope, get_usage_ledger, tag_request
+from profiling import PROFILE_ID_HEADER, finish_profile, get_profile_store, profile_allowed, profiling_flag, start_profile
 
 # Get environment variables after loading .env
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-GITHUB_API_URL = "https://api.github.com/repos"
+# Upstream base URLs are overridable so load tests can point them at local stubs
+GITHUB_API_URL = os.getenv("GITHUB_API_BASE", "https://api.github.com").rstrip("/") + "/repos"
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
 
@@ -41,10 +57,121 @@ app = Flask(__name__)
 CORS(app)
 
 
+@app.before_request
+def _start_usage_scope():
+    # Model calls made while serving this request are attributed to its endpoint
+    begin_request_scope(request.path)
 
-file_history_store = {}  # file_path → ChatMessageHistory
-repo_files_store = {}   # repo_url → files_data (dict)
-STATIC_SESSION_ID = "static-session-1"
+
+@app.before_request
+def _start_request_profile():
+    # Opt-in profiling (X-Profile: 1 or ?profile=1); unflagged requests stop at the flag check
+    if not profiling_flag(request.headers, request.args):
+        return
+    if profile_allowed(request.remote_addr) or _admin_authorized(request.headers) is None:
+        g.profile = start_profile(request.path)
+
+
+@app.after_request
+def _add_profile_header(response):
+    profile = g.get("profile")
+    if profile is not None:
+        profile.status = response.status_code
+        response.headers[PROFILE_ID_HEADER] = profile.id
+    return response
+
+
+@app.teardown_request
+def _finish_request_profile(exc):
+    # Teardown runs after a streamed body is fully sent, so SSE handlers are covered end to end
+    profile = g.pop("profile", None)
+    if profile is not None:
+        finish_profile(profile, status=500 if exc is not None else None)
+
+
+def _tag_repo(repo: Optional[str]) -> None:
+    """Attribute the current request's model usage to `repo` (a URL or owner/repo)."""
+    if not repo or repo == "/":
+        return
+    try:
+        tag_request(repo=normalize_repo_key(repo))
+    except Exception:
+        tag_request(repo=str(repo))
+
+
+
+def _summary_request(memo: str, messages: List[Dict[str, str]]) -> Tuple[Any, List[Any]]:
+    transcript = "\n".join(
+        f"{'User' if m['role'] == 'human' else 'Assistant'}: {m['content']}" for m in messages
+    )
+    llm = ChatGroq(model="llama-3.1-8b-instant", temperature=0, api_key=GROQ_API_KEY)
+    return llm, [
+        SystemMessage(content=(
+            "Summarize this conversation about a source file into a compact memo (max 8 bullet points). "
+            "Keep decisions, identified bugs, and facts the user may refer back to."
+        )),
+        HumanMessage(content=f"Existing memo:\n{memo or '(none)'}\n\nNew turns:\n{transcript}"),
+    ]
+
+
+def _summarize_chat_turns(memo: str, messages: List[Dict[str, str]]) -> str:
+    """Fold older chat turns into a compact memo using a cheap, deterministic LLM call."""
+    return invoke_cached(*_summary_request(memo, messages))
+
+
+async def _asummarize_chat_turns(memo: str, messages: List[Dict[str, str]]) -> str:
+    """Async twin of _summarize_chat_turns, used by the ASGI app via acommit_turn."""
+    return await ainvoke_cached(*_summary_request(memo, messages))
+
+
+# Repo files and chat sessions live in a pluggable backend (STATE_BACKEND=memory|sqlite)
+# so that every gunicorn worker sees the same state.
+state_backend = get_state_backend()
+
+file_history_store = BoundedHistoryStore(
+    max_sessions=int(os.getenv("CHAT_MAX_SESSIONS", "256")),
+    ttl_seconds=int(os.getenv("CHAT_SESSION_TTL", "3600")),
+    max_total_chars=int(os.getenv("CHAT_MAX_TOTAL_CHARS", "4000000")),
+    keep_turns=int(os.getenv("CHAT_KEEP_TURNS", "4")),
+    summarizer=_summarize_chat_turns if GROQ_API_KEY else None,
+    asummarizer=_asummarize_chat_turns if GROQ_API_KEY else None,
+    backend=state_backend if state_backend.shared else None,
+)  # session_id → ChatSession
+
+# Files uploaded once for /edit and /ask-anything; later requests send deltas against a content hash
+file_session_store = FileSessionStore(
+    max_sessions=int(os.getenv("FILE_SESSION_MAX", "512")),
+    ttl_seconds=int(os.getenv("FILE_SESSION_TTL", "3600")),
+    max_total_chars=int(os.getenv("FILE_SESSION_MAX_TOTAL_CHARS", "64000000")),
+    backend=state_backend if state_backend.shared else None,
+)
+
+_FILE_SESSION_STATUS = {"unknown_session": 404, "stale_base": 409, "bad_delta": 400}
+
+
+def _resolve_file_session(payload: Optional[Dict[str, Any]], content_field: str) -> Optional[Tuple[Dict[str, Any], int]]:
+    """Fill `payload[content_field]` from a `file_session` (after applying `deltas`), in place.
+
+    Returns None when the body has no file session or it resolved, otherwise a
+    (body, status) error: 404 unknown session, 409 stale `base_hash`, 400 bad delta.
+    The error body carries the server's current `hash` when there is one.
+    """
+    if not isinstance(payload, dict) or not payload.get("file_session"):
+        return None
+    result = file_session_store.apply_deltas(
+        str(payload["file_session"]), payload.get("base_hash"), payload.get("deltas"), payload.get("expected_hash")
+    )
+    if not result["ok"]:
+        body = {"error": result["error"], "code": result["code"]}
+        if "hash" in result:
+            body["hash"] = result["hash"]
+        return body, _FILE_SESSION_STATUS[result["code"]]
+    session = result["session"]
+    payload[content_field] = session.text()
+    if not payload.get("file_path"):
+        payload["file_path"] = session.file_path
+    payload["file_hash"] = session.hash
+    return None
 
 
 
@@ -55,39 +182,140 @@ def home():
     return "Hello! Flask with Python 3.9 is running!"
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint (METRICS_ENABLED=1). Values are per worker process."""
+    if not metrics_enabled():
+        return jsonify({"error": "Metrics are disabled; set METRICS_ENABLED=1."}), 404
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+def _admin_authorized(headers) -> Optional[Tuple[Dict[str, Any], int]]:
+    """None when the request carries ADMIN_TOKEN (Bearer or X-Admin-Token), else (body, status).
+
+    Admin endpoints are hidden (404) unless ADMIN_TOKEN is set.
+    """
+    token = os.getenv("ADMIN_TOKEN", "")
+    if not token:
+        return {"error": "Not found"}, 404
+    supplied = headers.get("X-Admin-Token") or ""
+    auth = headers.get("Authorization") or ""
+    if auth.lower().startswith("bearer "):
+        supplied = auth[7:].strip()
+    if not hmac.compare_digest(supplied.encode("utf-8"), token.encode("utf-8")):
+        return {"error": "Unauthorized"}, 401
+    return None
+
+
+@app.route('/admin/usage', methods=['GET'])
+def admin_usage():
+    """Token and cost totals by endpoint, repo, API key and model, plus per-key TPM state.
+
+    Totals cover this worker process since start (or the last USAGE_MAX_ROWS calls for `rows`).
+    """
+    denied = _admin_authorized(request.headers)
+    if denied:
+        return jsonify(denied[0]), denied[1]
+    return jsonify(get_usage_ledger().report())
+
+
+@app.route('/admin/profiles', methods=['GET'])
+def admin_profiles():
+    """Profiled requests kept by this worker process, newest first."""
+    denied = _admin_authorized(request.headers)
+    if denied:
+        return jsonify(denied[0]), denied[1]
+    return jsonify({"profiles": get_profile_store().list()})
+
+
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+def admin_profile(profile_id: str):
+    """One profile: JSON stage breakdown and top frames, or `?format=folded` for flamegraph tools."""
+    denied = _admin_authorized(request.headers)
+    if denied:
+        return jsonify(denied[0]), denied[1]
+    profile = get_profile_store().get(profile_id)
+    if profile is None:
+        return jsonify({"error": "Unknown profile id (profiles are kept per worker process)."}), 404
+    if request.args.get("format") == "folded":
+        return Response(profile.folded(), content_type="text/plain; charset=utf-8")
+    return jsonify(profile.summary())
+
+
+def _prepare_generate_wiki(data: Optional[Dict[str, Any]]) -> Tuple[Optional[Tuple[WikiPipeline, str]], Optional[Tuple[Dict[str, Any], int]]]:
+    """Validate a /generate-wiki body; returns ((pipeline, repo_url), None) or (None, (error body, status))."""
+    if not data or 'repo_url' not in data:
+        return None, ({"error": "Missing repo_url"}, 400)
+
+    # Check if we have either Gemini or Groq keys
+    has_gemini = GOOGLE_API_KEY and "REPLACE" not in GOOGLE_API_KEY
+    has_groq = GROQ_API_KEY and "REPLACE" not in GROQ_API_KEY
+
+    if not has_gemini and not has_groq:
+        return None, ({"error": "Neither GOOGLE_API_KEY nor GROQ_API_KEY is set in backend .env"}, 500)
+
+    _tag_repo(data['repo_url'])
+    pipeline = WikiPipeline(github_token=GITHUB_TOKEN, google_api_key=GOOGLE_API_KEY)
+    return (pipeline, data['repo_url']), None
+
+
+def _wiki_response(repo_url: str, wiki_result: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """Store the fetched files for wiki-chat and shape the response body."""
+    # wiki_result: {"meta": {...}, "sections": [...], "files_data": {...}}
+    if repo_url and "files_data" in wiki_result:
+        state_backend.put_repo_files(normalize_repo_key(repo_url), wiki_result["files_data"])
+
+    return {
+        "success": True,
+        "meta": wiki_result.get("meta", {}),
+        "sections": wiki_result.get("sections", []),
+    }, 200
+
+
+def _generate_wiki_body(pipeline: WikiPipeline, repo_url: str) -> Iterator[str]:
+    """Streamed /generate-wiki body: whitespace keep-alives while the wiki is generated, then the JSON.
+
+    Leading whitespace is still one valid JSON document. The keep-alive writes are how the
+    WSGI server notices a client that went away; it then closes this generator and the
+    outstanding module summaries are cancelled.
+    """
+    cancel_event = threading.Event()
+    outcome: Dict[str, Any] = {}
+
+    def run() -> None:
+        try:
+            outcome["body"] = _wiki_response(repo_url, pipeline.generate_wiki(repo_url, cancel_event))[0]
+        except Exception as e:
+            print(f"Wiki generation failed: {e}")
+            outcome["body"] = {"error": str(e)}
+
+    # Copy the context so model usage is still attributed to this request
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+    worker.start()
+    interval = float(os.getenv("WIKI_KEEPALIVE_SECONDS", "5"))
+    try:
+        while worker.is_alive():
+            worker.join(interval)
+            if worker.is_alive():
+                yield " "
+        yield json.dumps(outcome["body"])
+    finally:
+        cancel_event.set()  # GeneratorExit when the client disconnected; a no-op once finished
+
+
 @app.route('/generate-wiki', methods=['POST'])
 def generate_wiki():
+    """Validation errors are returned with their status; once the pipeline starts the response
+    is streamed with status 200 and a failure is reported as an `error` field in the body."""
     try:
-        data = request.get_json(force=True, silent=True)
-        if not data or 'repo_url' not in data:
-            return jsonify({"error": "Missing repo_url"}), 400
-        
-        repo_url = data['repo_url']
-        
-        # Check if we have either Gemini or Groq keys
-        has_gemini = GOOGLE_API_KEY and "REPLACE" not in GOOGLE_API_KEY
-        has_groq = GROQ_API_KEY and "REPLACE" not in GROQ_API_KEY
-        
-        if not has_gemini and not has_groq:
-             return jsonify({"error": "Neither GOOGLE_API_KEY nor GROQ_API_KEY is set in backend .env"}), 500
-
-        pipeline = WikiPipeline(github_token=GITHUB_TOKEN, google_api_key=GOOGLE_API_KEY)
-        wiki_result = pipeline.generate_wiki(repo_url)
-
-        # wiki_result: {"meta": {...}, "sections": [...], "files_data": {...}}
-        if repo_url and "files_data" in wiki_result:
-            repo_files_store[repo_url] = wiki_result["files_data"]
-
-        return jsonify(
-            {
-                "success": True,
-                "meta": wiki_result.get("meta", {}),
-                "sections": wiki_result.get("sections", []),
-            }
-        ), 200
+        prepared, error = _prepare_generate_wiki(request.get_json(force=True, silent=True))
+        if error:
+            return jsonify(error[0]), error[1]
     except Exception as e:
         print(f"Wiki generation failed: {e}")
         return jsonify({"error": str(e)}), 500
+    pipeline, repo_url = prepared
+    return Response(stream_with_context(_generate_wiki_body(pipeline, repo_url)), mimetype="application/json")
 
 
 @app.route('/analyze-file', methods=['POST'])
@@ -102,6 +330,7 @@ def analyze_file():
         file_path = data.get('file_path')
         file_content = data.get('file_content')
         root_path = data.get('root_path', '/')
+        _tag_repo(root_path)
 
         print("file_path:", file_path)
         print("has_file_content:", file_content is not None)
@@ -115,7 +344,7 @@ def analyze_file():
             owner, repo = root_path.split("/", 1)
             encoded_path = file_path.lstrip("/")  # remove leading slash if any
             branch = "main"  # or get dynamically if needed
-            url = f"https://api.github.com/repos/{owner}/{repo}/contents/{encoded_path}?ref={branch}"
+            url = f"{GITHUB_API_URL}/{owner}/{repo}/contents/{encoded_path}?ref={branch}"
 
             headers = {"Accept": "application/vnd.github.v3.raw"}
             if GITHUB_TOKEN:
@@ -142,28 +371,45 @@ def analyze_file():
             return jsonify({"error": "No file content provided and unable to fetch from GitHub. Please provide file_content or valid file_path with root_path."}), 400
 
         # --- Step 3: Run static code analysis (metrics, complexity, etc.) ---
+        # Both the static result and the LLM review are cached by content hash,
+        # so re-opening an unchanged file costs neither CPU nor a Groq call.
+        cache = get_analysis_cache()
+        model = "llama-3.3-70b-versatile"
+        max_content_chars = 4000
         analyzer = FileAnalyzer()
-        analysis = analyzer.analyze_code_string(code_content)
 
-        if "error" in analysis:
-            return jsonify({"error": analysis["error"]}), 400
+        static_key = cache.static_key(code_content)
+        analysis = cache.get(static_key)
+        static_cached = analysis is not None
+        if not static_cached:
+            analysis = analyzer.analyze_code_string(code_content)
+            if "error" in analysis:
+                return jsonify({"error": analysis["error"]}), 400
+            cache.put(static_key, analysis)
 
         # --- Step 4: Generate prompt and call Groq for advanced analysis ---
-        llm_prompt  = analyzer.generate_llm_prompt(analysis, file_content=code_content, max_content_chars=4000)
-        result = call_groq(llm_prompt, model="llama-3.3-70b-versatile") 
-        # result = call_ollama_http(llm_prompt, model= "tinyllama:1.1b")
-        print("result, ,,,,, ", result)
-
-        if not result["ok"]:
-            print("❌ LLM Error:", result["error"])
-            return jsonify({"error": result["error"], "static_analysis": analysis}), 500
+        review_key = cache.review_key(code_content, model, max_content_chars)
+        ai_analysis = cache.get(review_key)
+        review_cached = ai_analysis is not None
+        if not review_cached:
+            llm_prompt = analyzer.generate_llm_prompt(analysis, file_content=code_content, max_content_chars=max_content_chars)
+            # Small prompts arriving within a few ms share one Groq request
+            result = get_batcher(model).submit(llm_prompt)
+            # result = call_ollama_http(llm_prompt, model= "tinyllama:1.1b")
+
+            if not result["ok"]:
+                print("❌ LLM Error:", result["error"])
+                return jsonify({"error": result["error"], "static_analysis": analysis}), 500
+            ai_analysis = result["output"]
+            cache.put(review_key, ai_analysis)
 
         # --- Step 5: Return combined static + AI-based analysis ---
         return jsonify({
             "success": True,
             "model_used": "llama3-70b-8192",
             "static_analysis": analysis,
-            "ai_analysis": result["output"],
+            "ai_analysis": ai_analysis,
+            "cached": {"static": static_cached, "review": review_cached},
             "fetched_file_content_preview": code_content[:2000]
         }), 200
 
@@ -263,108 +509,221 @@ def analyze_file():
 # Helper: Fetch file from GitHub if needed
 # ==========================================
 def fetch_github_file(owner, repo, path, branch="main"):
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}?ref={branch}"
+    url = f"{GITHUB_API_URL}/{owner}/{repo}/contents/{path}?ref={branch}"
     headers = {"Accept": "application/vnd.github.v3.raw"}
     if GITHUB_TOKEN:
         headers["Authorization"] = f"token {GITHUB_TOKEN}"
-    r = requests.get(url, headers=headers, timeout=10)
+    with span("github_fetch"):
+        r = requests.get(url, headers=headers, timeout=10)
     if r.status_code != 200:
         raise Exception(f"GitHub fetch failed: {r.text}")
     return r.text
 
-# ======================================================
-# Route: ask-anything
-# ======================================================
-@app.route("/ask-anything", methods=["POST", "OPTIONS"])
-def ask_anything():
-    if request.method == "OPTIONS":
-        return jsonify({}), 200
+def _analyze_batch_lines(data: Any) -> Tuple[Optional[Iterator[str]], Optional[Tuple[Dict[str, Any], int]]]:
+    """Validate an /analyze-batch body; returns (NDJSON lines, None) or (None, (body, status)).
 
-    try:
-        data = request.get_json(force=True, silent=True)
-        if not data:
-            return jsonify({"error": "Invalid or missing JSON"}), 400
+    Shared by the Flask and ASGI apps. Per-file failures become items with "success": false
+    and an unexpected failure ends the stream with an error line, so the closing
+    {"done": true, "succeeded", "failed"} line is always sent.
+    """
+    if not data or not isinstance(data, dict):
+        return None, ({"error": "Invalid or missing JSON body"}, 400)
+
+    files = data.get("files") or {}
+    file_paths = data.get("file_paths") or (list(files.keys()) if isinstance(files, dict) else [])
+    root_path = data.get("root_path", "")
+    _tag_repo(root_path)
+    branch = data.get("branch", "main")
+    max_files = int(os.getenv("ANALYZE_BATCH_MAX_FILES", "100"))
+
+    if not file_paths:
+        return None, ({"error": "Missing file_paths"}, 400)
+    invalid = batch_input_error(file_paths, files)
+    if invalid:
+        return None, ({"error": invalid}, 400)
+    if len(file_paths) > max_files:
+        return None, ({"error": f"Too many files: {len(file_paths)} (max {max_files})"}, 400)
+    missing_content = [p for p in file_paths if not files.get(p)]
+    if missing_content and "/" not in root_path:
+        return None, ({"error": "Invalid root_path format (expected owner/repo) for files without content."}, 400)
+
+    owner, repo = root_path.split("/", 1) if "/" in root_path else ("", "")
+
+    def fetch(path: str) -> str:
+        return fetch_github_file(owner, repo, path.lstrip("/"), branch=branch)
+
+    def llm(prompt: str, max_tokens: int = 1500) -> Dict[str, Any]:
+        return call_groq(prompt, model="llama-3.3-70b-versatile", max_tokens=max_tokens)
+
+    batch = BatchAnalyzer(fetch_file=fetch, llm_call=llm, model="llama-3.3-70b-versatile", cache=get_analysis_cache())
+
+    def generate():
+        ok = failed = 0
+        try:
+            for item in batch.run(file_paths, contents=files):
+                if item.get("success"):
+                    ok += 1
+                else:
+                    failed += 1
+                yield json.dumps(item) + "\n"
+        except Exception as e:
+            traceback.print_exc()
+            yield json.dumps({"error": f"Unexpected failure: {e}"}) + "\n"
+        yield json.dumps({"done": True, "succeeded": ok, "failed": failed, "model_used": "llama-3.3-70b-versatile"}) + "\n"
 
-        file_path = data.get("file_path")
-        root_path = data.get("root_path", "")
-        user_message = data.get("message")
-        file_content = data.get("file_content")
+    return generate(), None
 
-        if not file_path or not user_message:
-            return jsonify({"error": "Missing file_path or message"}), 400
 
-        # Step 1: Fetch file content if not given
-        if not file_content:
-            if "/" not in root_path:
-                return jsonify({"error": "Invalid root_path format (expected owner/repo)."}), 400
-            owner, repo = root_path.split("/", 1)
-            file_content = fetch_github_file(owner, repo, file_path)
-
-        # Step 2: Load/create chat history
-        if file_path not in file_history_store:
-            file_history_store[file_path] = ChatMessageHistory()
-        chat_history: BaseChatMessageHistory = file_history_store[file_path]
-
-        # Step 3: Define system + prompt
-        system_message = SystemMessage(content=(
-            "You are an expert AI code assistant. "
-            "Analyze the given source code, explain it, detect bugs or improvements, "
-            "and answer naturally like a developer."
-        ))
-
-        prompt = ChatPromptTemplate.from_messages([
-            system_message,
-            MessagesPlaceholder(variable_name="history"),
-            ("human", "{input}")
-        ])
-
-        # Step 4: Create Groq LLM
-        llm = ChatGroq(
-            model="llama-3.3-70b-versatile",
-            temperature=0.3,
-            api_key=GROQ_API_KEY
-        )
+@app.route('/analyze-batch', methods=['POST'])
+def analyze_batch():
+    """Analyze many files in one round trip.
 
-        # Step 5: Connect history with Runnable
-        def get_session_history(session_id: str) -> BaseChatMessageHistory:
-            return file_history_store[file_path]
+    Body: {"root_path": "owner/repo", "file_paths": [...], "files": {path: content}?, "branch": "main"?}
+    Streams one JSON object per line (application/x-ndjson) as each file completes,
+    followed by {"done": true, ...}.
+    """
+    lines, error = _analyze_batch_lines(request.get_json(force=True, silent=True))
+    if error:
+        return jsonify(error[0]), error[1]
+    return Response(stream_with_context(lines), mimetype="application/x-ndjson")
 
-        runnable = RunnableWithMessageHistory(
-            runnable=prompt | llm,  # ✅ Combine prompt and llm properly
-            get_session_history=get_session_history,
-            input_messages_key="input",        # this matches {input}
-            history_messages_key="history"     # matches MessagesPlaceholder
-        )
 
-        # Step 6: Build user input (code + question)
-        user_input = f"""
-                You are an expert software developer and AI assistant. Your goal is to help the user
-                Here is the file content:
+def _sse(event: str, payload: Dict[str, Any]) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
-                -------------------
-                {file_content[:8000]}
-                -------------------
 
-                User question:
-                "{user_message}"
+def _sse_response(events) -> Response:
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-                If more detail is needed, say:
-                "Would you like me to go deeper into any part of this file?"
-        """
 
-        # Step 7: Invoke model (this time passes 'history' correctly)
-        output = runnable.invoke(
-            {"input": user_input},
-            config={"configurable": {"session_id": STATIC_SESSION_ID}}
-        )
+def _validate_ask_anything(data: Optional[Dict[str, Any]]):
+    """Validate an /ask-anything body.
+
+    Returns (fields, error); error is a (body, status) pair when the request is invalid.
+    """
+    if not data:
+        return None, ({"error": "Invalid or missing JSON"}, 400)
+
+    fields = {
+        "file_path": data.get("file_path"),
+        "root_path": data.get("root_path", ""),
+        "user_message": data.get("message"),
+        "file_content": data.get("file_content"),
+        "session_id": data.get("session_id"),
+    }
+    if not fields["file_path"] or not fields["user_message"]:
+        return None, ({"error": "Missing file_path or message"}, 400)
+    _tag_repo(fields["root_path"])
+    if not fields["file_content"] and "/" not in fields["root_path"]:
+        return None, ({"error": "Invalid root_path format (expected owner/repo)."}, 400)
+    return fields, None
+
+
+def _ask_anything_context(fields: Dict[str, Any], file_content: str) -> Dict[str, Any]:
+    """Load the chat session and build the chain + inputs for one /ask-anything turn."""
+    file_path = fields["file_path"]
+
+    # Step 2: Load/create the chat session. The file content is stored once per
+    # session and sent as system context, not repeated inside every human turn.
+    session_id = fields["session_id"] or f"{fields['root_path']}:{file_path}"
+    session = file_history_store.get_session(session_id, context=file_content[:8000])
+
+    # Step 3: Define system + prompt
+    context = (
+        "You are an expert AI code assistant. "
+        "Analyze the given source code, explain it, detect bugs or improvements, "
+        "and answer naturally like a developer.\n"
+        "If more detail is needed, say: \"Would you like me to go deeper into any part of this file?\"\n\n"
+        f"File: {file_path}\n"
+        "-------------------\n"
+        f"{session.context}\n"
+        "-------------------"
+    )
+    if session.memo:
+        context += f"\n\nSummary of the earlier conversation:\n{session.memo}"
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "{context}"),
+        MessagesPlaceholder(variable_name="history"),
+        ("human", "{input}")
+    ])
+
+    # Step 4: Create Groq LLM
+    llm = ChatGroq(
+        model="llama-3.3-70b-versatile",
+        temperature=0.3,
+        api_key=GROQ_API_KEY
+    )
+
+    inputs = {
+        "context": context,
+        "history": session.history_messages(),
+        "input": fields["user_message"],
+    }
+    return {
+        "runnable": prompt | llm,
+        "inputs": inputs,
+        # Formatted messages for the cached (non-streaming) path
+        "llm": llm,
+        "messages": prompt.format_messages(**inputs),
+        "session_id": session_id,
+        "file_path": file_path,
+        "user_message": fields["user_message"],
+    }
+
+
+def _prepare_ask_anything(data: Optional[Dict[str, Any]]):
+    """Validate an /ask-anything body, fetch the file if needed and build the model inputs.
+
+    Returns (context, error); error is a (body, status) pair when the request is invalid.
+    """
+    error = _resolve_file_session(data, "file_content")
+    if error:
+        return None, error
+    fields, error = _validate_ask_anything(data)
+    if error:
+        return None, error
+
+    # Step 1: Fetch file content if not given
+    file_content = fields["file_content"]
+    if not file_content:
+        owner, repo = fields["root_path"].split("/", 1)
+        file_content = fetch_github_file(owner, repo, fields["file_path"])
+
+    return _ask_anything_context(fields, file_content), None
 
-        # Step 8: Return response
+
+# ======================================================
+# Route: ask-anything
+# ======================================================
+@app.route("/ask-anything", methods=["POST", "OPTIONS"])
+def ask_anything():
+    if request.method == "OPTIONS":
+        return jsonify({}), 200
+
+    try:
+        ctx, error = _prepare_ask_anything(request.get_json(force=True, silent=True))
+        if error:
+            return jsonify(error[0]), error[1]
+
+        # Step 5: Invoke model with the bounded history
+        answer = invoke_cached(ctx["llm"], ctx["messages"])
+
+        # Step 6: Commit the turn (older turns get folded into the memo)
+        file_history_store.commit_turn(ctx["session_id"], ctx["user_message"], answer)
+
+        # Step 7: Return response
         return jsonify({
             "success": True,
-            "answer": output.content if hasattr(output, "content") else str(output),
+            "answer": answer,
             "model_used": "Groq + LangChain",
-            "session_id": STATIC_SESSION_ID,
-            "file_path": file_path
+            "session_id": ctx["session_id"],
+            "file_path": ctx["file_path"]
         }), 200
 
     except Exception as e:
@@ -372,43 +731,89 @@ def ask_anything():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/wiki-chat', methods=['POST', 'OPTIONS'])
-def wiki_chat():
+@app.route("/ask-anything/stream", methods=["POST", "OPTIONS"])
+def ask_anything_stream():
+    """Same as /ask-anything, but streams the answer as server-sent events.
+
+    Events: `sources` (session + file first), `token` ({"text": ...}) per delta,
+    then `done` with the full answer, or `error`.
+    """
     if request.method == "OPTIONS":
         return jsonify({}), 200
+
     try:
-        data = request.get_json(force=True, silent=True)
-        if not data or 'repo_url' not in data or 'message' not in data:
-            return jsonify({"error": "Missing repo_url or message"}), 400
-        
-        repo_url = data['repo_url']
-        user_message = data['message']
-        
-        # 1. Check if we have files for this repo
-        files_data = repo_files_store.get(repo_url)
-        if not files_data:
-            return jsonify({"error": "Repository not found in cache. Please generate the wiki first."}), 404
-        
+        ctx, error = _prepare_ask_anything(request.get_json(force=True, silent=True))
+        if error:
+            return jsonify(error[0]), error[1]
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+    def events():
+        yield _sse("sources", {"sources": [ctx["file_path"]], "session_id": ctx["session_id"]})
+        parts: List[str] = []
+        last_usage = None
+        try:
+            for chunk in ctx["runnable"].stream(ctx["inputs"]):
+                if getattr(chunk, "usage_metadata", None):
+                    last_usage = chunk  # providers report usage once, on the final chunk
+                text = chunk.content if hasattr(chunk, "content") else str(chunk)
+                if text:
+                    parts.append(text)
+                    yield _sse("token", {"text": text})
+        except Exception as e:
+            traceback.print_exc()
+            yield _sse("error", {"error": str(e)})
+            return
+        if last_usage is not None:
+            record_llm_usage(ctx["llm"], last_usage)
+
+        answer = "".join(parts)
+        # History is only committed once the whole answer has been produced
+        file_history_store.commit_turn(ctx["session_id"], ctx["user_message"], answer)
+        yield _sse("done", {"success": True, "answer": answer, "model_used": "Groq + LangChain"})
+
+    return _sse_response(events())
+
+
+def _prepare_wiki_chat(data: Optional[Dict[str, Any]]):
+    """Validate a /wiki-chat body, retrieve relevant snippets and build the prompt.
+
+    Returns (context, error); error is a (body, status) pair when the request is invalid.
+    """
+    if not data or 'repo_url' not in data or 'message' not in data:
+        return None, ({"error": "Missing repo_url or message"}, 400)
+
+    repo_url = data['repo_url']
+    user_message = data['message']
+    _tag_repo(repo_url)
+
+    # 1. Check if we have files for this repo
+    files_data = state_backend.get_repo_files(normalize_repo_key(repo_url))
+    if not files_data:
+        return None, ({"error": "Repository not found in cache. Please generate the wiki first."}, 404)
+
+    with span("retrieval"):
         # 2. Retrieve relevant files using QueryAnalyzer (TF-IDF)
         analyzer = QueryAnalyzer(files_data)
         relevant_files = analyzer.find_relevant_files(user_message, top_k=5)
-        
+
         # 3. Get snippets using CodeRetriever
         retriever = CodeRetriever(relevant_files)
         snippets = retriever.get_snippets(max_lines=150) # Use smaller chunks for chat
-        
-        # 4. Prepare prompt for LLM
-        context_text = ""
-        for s in snippets[:8]: # Limit number of snippets
-            context_text += f"\n--- File: {s['file_path']} ---\n{s['code']}\n"
-            
-        system_prompt = """You are an expert software architect and developer. 
+
+    # 4. Prepare prompt for LLM
+    context_text = ""
+    for s in snippets[:8]: # Limit number of snippets
+        context_text += f"\n--- File: {s['file_path']} ---\n{s['code']}\n"
+
+    system_prompt = """You are an expert software architect and developer. 
 You are answering questions about a specific code repository. 
 Below are some relevant code snippets from the repo. 
 Use them to provide a detailed, accurate, and helpful answer. 
 If the information isn't in the snippets, use your general knowledge but clarify what is specific to the snippets vs general knowledge."""
 
-        user_prompt = f"""Repository URL: {repo_url}
+    user_prompt = f"""Repository URL: {repo_url}
 User Question: "{user_message}"
 
 Relevant Code Snippets:
@@ -416,23 +821,53 @@ Relevant Code Snippets:
 
 Answer the user question based on the snippets above:"""
 
-        # 5. Call LLM
-        # We'll use Groq if available, else fallback
-        if GROQ_API_KEY:
-            result = call_groq(f"{system_prompt}\n\n{user_prompt}", model="llama-3.3-70b-versatile")
-            answer = result.get("output", "I'm sorry, I couldn't generate an answer.")
-        elif GOOGLE_API_KEY:
-            from langchain_google_genai import ChatGoogleGenerativeAI
-            llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=GOOGLE_API_KEY)
-            res = llm.invoke(f"{system_prompt}\n\n{user_prompt}")
-            answer = res.content
-        else:
+    return {
+        "prompt": f"{system_prompt}\n\n{user_prompt}",
+        "sources": [f[0] for f in relevant_files],
+    }, None
+
+
+def _wiki_chat_request(prompt: str) -> Optional[Dict[str, Any]]:
+    """Registry arguments for a wiki-chat answer, or None when no chat provider is configured."""
+    registry = get_provider_registry()
+    order = [p.name for p in registry.by_kind("groq")[:1] + registry.by_kind("gemini")[:1]]
+    if not order:
+        return None
+    return {
+        "messages": [
+            {"role": "system", "content": "You are an expert software engineer and code reviewer."},
+            {"role": "user", "content": prompt},
+        ],
+        "order": order,
+        "temperature": 0.3,
+        "max_tokens": 1500,
+    }
+
+
+def _wiki_chat_complete(prompt: str) -> Optional[Dict[str, Any]]:
+    args = _wiki_chat_request(prompt)
+    return get_provider_registry().complete(**args) if args else None
+
+
+@app.route('/wiki-chat', methods=['POST', 'OPTIONS'])
+def wiki_chat():
+    if request.method == "OPTIONS":
+        return jsonify({}), 200
+    try:
+        ctx, error = _prepare_wiki_chat(request.get_json(force=True, silent=True))
+        if error:
+            return jsonify(error[0]), error[1]
+
+        # 5. Call LLM (Groq first, Gemini as failover)
+        result = _wiki_chat_complete(ctx["prompt"])
+        if result is None:
             return jsonify({"error": "No LLM API keys configured"}), 500
+        answer = result.get("output", "I'm sorry, I couldn't generate an answer.")
 
         return jsonify({
             "success": True,
             "answer": answer,
-            "sources": [f[0] for f in relevant_files]
+            "sources": ctx["sources"]
         }), 200
 
     except Exception as e:
@@ -441,80 +876,123 @@ Answer the user question based on the snippets above:"""
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/share-wiki', methods=['POST', 'OPTIONS'])
-def share_wiki():
+@app.route('/wiki-chat/stream', methods=['POST', 'OPTIONS'])
+def wiki_chat_stream():
+    """Same as /wiki-chat, but streams the answer as server-sent events.
+
+    Events: `sources` first, then `token` ({"text": ...}) per delta, then `done` or `error`.
+    """
     if request.method == "OPTIONS":
         return jsonify({}), 200
-    
     try:
-        data = request.get_json(force=True, silent=True)
-        if not data or 'email' not in data or 'sections' not in data:
-            return jsonify({"error": "Missing email or sections data"}), 400
-        
-        target_email = data['email']
-        sections = data['sections']
-        meta = data.get('meta', {})
-        repo_url = meta.get('repo_url', 'Unknown Repository')
-        
-        # Email configuration
-        smtp_server = "smtp.gmail.com"
-        smtp_port = 587
-        sender_email = os.getenv("EMAIL_USER")
-        sender_password = os.getenv("EMAIL_PASS")
-        
-        if not sender_email or not sender_password:
-            return jsonify({"error": "Backend email credentials not configured (EMAIL_USER/EMAIL_PASS)"}), 500
-
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = f"CodeMesher Wiki <{sender_email}>"
-        msg['To'] = target_email
-        msg['Subject'] = f"Code Wiki: {repo_url.split('/')[-1]}"
-        
-        # Build HTML content
-        html_content = f"""
-        <div style="font-family: Arial, sans-serif; max-width: 800px; margin: 0 auto; color: #333;">
-            <h1 style="color: #2563eb; border-bottom: 2px solid #e5e7eb; padding-bottom: 10px;">
-                Code Wiki: {repo_url}
-            </h1>
-            <p style="color: #666; font-size: 0.9em;">Generated on: {meta.get('generated_at', 'N/A')}</p>
-        """
-        
-        for section in sections:
-            html_content += f"""
-            <div style="margin-top: 30px;">
-                <h2 style="color: #1e293b; background: #f8fafc; padding: 10px; border-radius: 5px;">
-                    {section.get('title', 'Untitled')}
-                </h2>
-                <div style="line-height: 1.6; color: #475569;">
-            """
-            for content_item in section.get('content', []):
-                # Basic check for code blocks to wrap them in pre tags
-                if content_item.strip().startswith('```'):
-                    code = content_item.replace('```', '').strip()
-                    html_content += f"<pre style='background: #1e293b; color: #e2e8f0; padding: 15px; border-radius: 8px; overflow-x: auto;'>{code}</pre>"
-                else:
-                    html_content += f"<p>{content_item}</p>"
-            
-            html_content += "</div></div>"
-            
+        ctx, error = _prepare_wiki_chat(request.get_json(force=True, silent=True))
+        if error:
+            return jsonify(error[0]), error[1]
+        args = _wiki_chat_request(ctx["prompt"])
+        if args is None:
+            return jsonify({"error": "No LLM API keys configured"}), 500
+    except Exception as e:
+        print(f"Wiki chat failed: {e}")
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+    def events():
+        yield _sse("sources", {"sources": ctx["sources"]})
+        parts: List[str] = []
+        try:
+            # Same providers as /wiki-chat; fails over to Gemini until the first token is sent
+            for text in get_provider_registry().stream(**args):
+                if text:
+                    parts.append(text)
+                    yield _sse("token", {"text": text})
+        except Exception as e:
+            print(f"Wiki chat stream failed: {e}")
+            yield _sse("error", {"error": str(e)})
+            return
+        yield _sse("done", {"success": True, "answer": "".join(parts)})
+
+    return _sse_response(events())
+
+
+def _share_wiki_result(data: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], int]:
+    """Email the rendered wiki sections; returns (response body, status)."""
+    if not data or 'email' not in data or 'sections' not in data:
+        return {"error": "Missing email or sections data"}, 400
+    
+    target_email = data['email']
+    sections = data['sections']
+    meta = data.get('meta', {})
+    repo_url = meta.get('repo_url', 'Unknown Repository')
+    
+    # Email configuration
+    smtp_server = "smtp.gmail.com"
+    smtp_port = 587
+    sender_email = os.getenv("EMAIL_USER")
+    sender_password = os.getenv("EMAIL_PASS")
+    
+    if not sender_email or not sender_password:
+        return {"error": "Backend email credentials not configured (EMAIL_USER/EMAIL_PASS)"}, 500
+
+    # Create message
+    msg = MIMEMultipart()
+    msg['From'] = f"CodeMesher Wiki <{sender_email}>"
+    msg['To'] = target_email
+    msg['Subject'] = f"Code Wiki: {repo_url.split('/')[-1]}"
+    
+    # Build HTML content
+    html_content = f"""
+    <div style="font-family: Arial, sans-serif; max-width: 800px; margin: 0 auto; color: #333;">
+        <h1 style="color: #2563eb; border-bottom: 2px solid #e5e7eb; padding-bottom: 10px;">
+            Code Wiki: {repo_url}
+        </h1>
+        <p style="color: #666; font-size: 0.9em;">Generated on: {meta.get('generated_at', 'N/A')}</p>
+    """
+    
+    for section in sections:
         html_content += f"""
-            <hr style="margin-top: 50px; border: 0; border-top: 1px solid #e5e7eb;" />
-            <p style="text-align: center; color: #94a3b8; font-size: 0.8em;">
-                Sent via CodeMesher • Automated Documentation Generator
-            </p>
-        </div>
+        <div style="margin-top: 30px;">
+            <h2 style="color: #1e293b; background: #f8fafc; padding: 10px; border-radius: 5px;">
+                {section.get('title', 'Untitled')}
+            </h2>
+            <div style="line-height: 1.6; color: #475569;">
         """
+        for content_item in section.get('content', []):
+            # Basic check for code blocks to wrap them in pre tags
+            if content_item.strip().startswith('```'):
+                code = content_item.replace('```', '').strip()
+                html_content += f"<pre style='background: #1e293b; color: #e2e8f0; padding: 15px; border-radius: 8px; overflow-x: auto;'>{code}</pre>"
+            else:
+                html_content += f"<p>{content_item}</p>"
         
-        msg.attach(MIMEText(html_content, 'html'))
+        html_content += "</div></div>"
         
-        # Send email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)
-            server.send_message(msg)
-            
-        return jsonify({"success": True, "message": "Email sent successfully!"}), 200
+    html_content += f"""
+        <hr style="margin-top: 50px; border: 0; border-top: 1px solid #e5e7eb;" />
+        <p style="text-align: center; color: #94a3b8; font-size: 0.8em;">
+            Sent via CodeMesher • Automated Documentation Generator
+        </p>
+    </div>
+    """
+    
+    msg.attach(MIMEText(html_content, 'html'))
+    
+    # Send email
+    with smtplib.SMTP(smtp_server, smtp_port) as server:
+        server.starttls()
+        server.login(sender_email, sender_password)
+        server.send_message(msg)
+        
+    return {"success": True, "message": "Email sent successfully!"}, 200
+
+
+@app.route('/share-wiki', methods=['POST', 'OPTIONS'])
+def share_wiki():
+    if request.method == "OPTIONS":
+        return jsonify({}), 200
+    
+    try:
+        body, status = _share_wiki_result(request.get_json(force=True, silent=True))
+        return jsonify(body), status
         
     except Exception as e:
         print(f"Failed to send email: {e}")
@@ -591,6 +1069,39 @@ def _extract_selection_text(current: str, selection: Optional[Dict[str, Any]]) -
     
 
 
+def _selection_window(current: str, selection: Optional[Dict[str, Any]], context_lines: int) -> Optional[Tuple[int, int, int, str]]:
+    """Lines around the selection, each prefixed with its absolute line number.
+
+    Returns (first_line, last_line, total_lines, numbered_text), or None when the
+    selection is missing or unusable.
+    """
+    if not selection:
+        return None
+    try:
+        s_line = int(selection.get("start_line"))
+        e_line = int(selection.get("end_line"))
+    except (TypeError, ValueError):
+        return None
+    lines = current.split("\n")
+    if s_line < 1 or e_line < s_line or s_line > len(lines):
+        return None
+    first = max(1, s_line - context_lines)
+    last = min(len(lines), e_line + context_lines)
+    width = len(str(last))
+    numbered = "\n".join(f"{n:>{width}}| {lines[n - 1]}" for n in range(first, last + 1))
+    return first, last, len(lines), numbered
+
+
+def _outline_block(current: str, file_path: str, first: int, last: int) -> str:
+    """Outline lines for symbols not entirely inside lines first..last."""
+    entries = []
+    for item in symbol_outline(current, file_path, max_items=int(os.getenv("EDIT_OUTLINE_MAX_ITEMS", "150"))):
+        if first <= item["line"] and item["end_line"] <= last:
+            continue
+        entries.append(f"L{item['line']}-{item['end_line']}: {'  ' * item['depth']}{item['signature']}")
+    return "\n".join(entries)
+
+
 def buildPrompt(payload: Dict[str, Any]) -> str:
     """Combine incoming fields into a single, highly structured prompt.
 
@@ -638,8 +1149,33 @@ def buildPrompt(payload: Dict[str, Any]) -> str:
         else:
             sections.append("<<SELECTION_CONTENT>>\n```\n" + selection_text + "\n```")
 
+    # Selection scope: the selection, a numbered window around it and an outline of the
+    # rest of the file, so prompt size follows the selection rather than the file.
+    # scope=auto (default) switches to it for files over EDIT_FULL_FILE_CHARS.
+    scope = str(payload.get("scope") or "auto").lower()
+    window = None
+    if scope == "selection" or (scope == "auto" and len(current) > int(os.getenv("EDIT_FULL_FILE_CHARS", "16000"))):
+        try:
+            context_lines = payload.get("context_lines")
+            context_lines = int(context_lines if context_lines is not None else os.getenv("EDIT_CONTEXT_LINES", "60"))
+        except (TypeError, ValueError):
+            context_lines = 60
+        window = _selection_window(current, selection, max(0, context_lines))
+    if window:
+        first, last, total, numbered = window
+        outline = _outline_block(current, file_path, first, last)
+        if outline:
+            sections.append(
+                "<<OUTLINE>>\nSymbols outside the window (signatures only; bodies omitted), "
+                "as `L<start>-<end>: <signature>`:\n" + outline
+            )
+        sections.append(
+            f"<<CONTEXT_WINDOW>>\nLines {first}-{last} of {total}. Each line starts with its absolute "
+            "line number and `| `; that prefix is not part of the file and does not count toward columns.\n"
+            "```" + fence_lang + "\n" + numbered + "\n```"
+        )
     # Include current file contents in a fenced block to reduce formatting errors.
-    if fence_lang:
+    elif fence_lang:
         sections.append("<<CURRENT_FILE>>\n```" + fence_lang + "\n" + current + "\n```")
     else:
         sections.append("<<CURRENT_FILE>>\n```\n" + current + "\n```")
@@ -670,9 +1206,16 @@ def buildPrompt(payload: Dict[str, Any]) -> str:
         + "- The replacement must be a plain string, not fenced.\n"
         + "- If selection is provided, restrict edits to that range.\n"
     )
+    if window:
+        sections[-1] += (
+            "- Only the lines shown in CONTEXT_WINDOW may be edited; use their absolute line numbers.\n"
+        )
 
     prompt = "\n\n".join(sections).strip()
     return prompt
+_JSON_OBJECT_START = re.compile(r'\{\s*["}]')
+
+
 def _extract_json_from_text(text: str) -> Optional[str]:
     """Try to extract a JSON object substring from arbitrary text.
 
@@ -701,34 +1244,17 @@ def _extract_json_from_text(text: str) -> Optional[str]:
             if candidate.startswith("{") and candidate.endswith("}"):
                 return candidate
 
-    # General brace matching ignoring braces inside quoted strings
-    # Find the first balanced JSON object substring if present
-    in_string = False
-    escape = False
-    depth = 0
-    start_idx = -1
-    for idx, ch in enumerate(text):
-        if in_string:
-            if escape:
-                escape = False
-            elif ch == "\\":
-                escape = True
-            elif ch == '"':
-                in_string = False
-        else:
-            if ch == '"':
-                in_string = True
-            elif ch == '{':
-                if depth == 0:
-                    start_idx = idx
-                depth += 1
-            elif ch == '}':
-                if depth > 0:
-                    depth -= 1
-                    if depth == 0 and start_idx != -1:
-                        candidate = text[start_idx : idx + 1].strip()
-                        if candidate.startswith("{") and candidate.endswith("}"):
-                            return candidate
+    # First decodable object (decoding runs in C, not a Python char loop). Only a '{' followed
+    # by '"' or '}' can start one; skipping the rest matters because every failed decode
+    # counts the newlines before it for its error message, which made code-heavy text quadratic.
+    decoder = json.JSONDecoder()
+    for candidate in _JSON_OBJECT_START.finditer(text):
+        start_idx = candidate.start()
+        try:
+            _, end_idx = decoder.raw_decode(text, start_idx)
+            return text[start_idx:end_idx].strip()
+        except ValueError:
+            continue
     return None
 
 
@@ -820,7 +1346,8 @@ def callModelAPI(prompt: str) -> str:
 
     Providers supported via env MODEL_PROVIDER:
     - mock (default): returns a static, valid JSON result
-    - openai / groq / hf / ollama: stubs prepared; require external deps/tokens
+    - any provider registered in pipeline/model_providers.py (openai / groq / gemini / hf / ollama);
+      MODEL_FALLBACKS lists providers to fail over to
 
     For maximum accuracy, providers should be called with low temperature and
     JSON-only response settings where available.
@@ -840,7 +1367,6 @@ def callModelAPI(prompt: str) -> str:
             if sel_marker in prompt:
                 sel_part = prompt.split(sel_marker, 1)[1].split("<<", 1)[0]
                 # Lines like: start_line=X start_col=Y\nend_line=A end_col=B
-                import re
                 m = re.search(r"start_line=(\d+)\s+start_col=(\d+)", sel_part)
                 n = re.search(r"end_line=(\d+)\s+end_col=(\d+)", sel_part)
                 if m and n:
@@ -849,7 +1375,13 @@ def callModelAPI(prompt: str) -> str:
         except Exception:
             pass
 
-        replacement = "// edit applied by mock provider\n"
+        # Comment syntax of the target file, so the marker survives server-side validation
+        comment = "//"
+        if "<<FILE_PATH>>" in prompt:
+            mock_path = prompt.split("<<FILE_PATH>>", 1)[1].split("<<", 1)[0].strip()
+            if _detect_fence_language(mock_path) in ("python", "ruby"):
+                comment = "#"
+        replacement = f"{comment} edit applied by mock provider\n"
         mock_obj = {
             "edits": [
                 {
@@ -865,142 +1397,56 @@ def callModelAPI(prompt: str) -> str:
         }
         return json.dumps(mock_obj)
 
-    # Lazy import requests only if a real HTTP call is attempted
-    try:
-        import requests  # type: ignore
-    except Exception as exc:  # pragma: no cover - optional dependency
-        return json.dumps(
-            {
-                "edits": [],
-                "debug": {
-                    "prompt_used": prompt,
-                    "errors": [
-                        "requests_not_installed",
-                        f"provider={provider}",
-                        f"detail={type(exc).__name__}: {exc}",
-                    ],
-                },
-            }
-        )
+    # Real providers go through the registry: failover to MODEL_FALLBACKS on errors,
+    # optional hedging (PROVIDER_HEDGE=1) and the shared prompt cache.
+    result = get_provider_registry().complete(**_model_request(provider, prompt))
+    return _model_text(provider, prompt, result)
 
-    # Example stubs for real providers; user can configure tokens/endpoints
-    headers: Dict[str, str] = {}
-    temperature = float(os.getenv("MODEL_TEMPERATURE", "0"))
 
-    if provider == "openai":  # Uses OpenAI's responses API if available
-        api_key = os.getenv("OPENAI_API_KEY", "")
-        base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
-        model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        if not api_key:
-            return json.dumps(
-                {
-                    "edits": [],
-                    "debug": {
-                        "prompt_used": prompt,
-                        "errors": ["missing OPENAI_API_KEY"],
-                    },
-                }
-            )
-        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        payload = {
-            "model": model,
-            "input": prompt,
-            # Prefer JSON-only outputs if the provider supports it; for
-            # compatible models you could use `response_format={"type":"json_object"}`.
-            # We keep it generic here to avoid SDK dependency.
-            "temperature": temperature,
-        }
-        resp = requests.post(f"{base_url}/responses", headers=headers, json=payload, timeout=60)
-        resp.raise_for_status()
-        data = resp.json()
-        # Best-effort extraction; OpenAI responses API returns { output: [{content:[{type:'output_text', text:'...'}]}] }
-        try:
-            outputs = data.get("output", [])
-            if outputs and isinstance(outputs, list):
-                first = outputs[0]
-                content = first.get("content", []) if isinstance(first, dict) else []
-                if content and isinstance(content, list) and isinstance(content[0], dict):
-                    text = content[0].get("text")
-                    if isinstance(text, str):
-                        return text
-        except Exception:
-            pass
-        # Fallback: raw JSON
-        return json.dumps(data)
-    if provider == "ollama":
-        base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-        model = os.getenv("OLLAMA_MODEL", "qwen2.5-coder:latest")
-        payload = {"model": model, "prompt": prompt, "options": {"temperature": temperature}}
-        resp = requests.post(f"{base_url}/api/generate", json=payload, timeout=120)
-        resp.raise_for_status()
-        # Ollama streams results by default; when using REST we may get a single JSON object per line
-        try:
-            # Concatenate streamed lines
-            text_chunks: List[str] = []
-            for line in resp.iter_lines(decode_unicode=True):
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                    if obj.get("done") and text_chunks:
-                        break
-                    part = obj.get("response", "")
-                    if isinstance(part, str):
-                        text_chunks.append(part)
-                except Exception:
-                    text_chunks.append(line)
-            combined = "".join(text_chunks).strip()
-            return combined
-        except Exception:
-            return resp.text
+async def acallModelAPI(prompt: str) -> str:
+    """Async twin of callModelAPI for the ASGI app; the provider call is awaited, not threaded."""
+    provider = os.getenv("MODEL_PROVIDER", "mock").strip().lower()
+    if provider == "mock":
+        return callModelAPI(prompt)
+    result = await get_provider_registry().acomplete(**_model_request(provider, prompt))
+    return _model_text(provider, prompt, result)
 
-    if provider == "groq":
-        api_key = os.getenv("GROQ_API_KEY", "")
-        if not api_key:
-            return json.dumps(
-                {
-                    "edits": [],
-                    "debug": {"prompt_used": prompt, "errors": ["missing GROQ_API_KEY"]},
-                }
-            )
-        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        model = os.getenv("GROQ_MODEL", "llama-3.1-70b-versatile")
-        payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "temperature": temperature}
-        resp = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload, timeout=60)
-        resp.raise_for_status()
-        data = resp.json()
-        try:
-            return data["choices"][0]["message"]["content"]
-        except Exception:
-            return json.dumps(data)
 
-    if provider == "hf":  # Hugging Face Inference
-        api_key = os.getenv("HF_API_KEY", "")
-        model = os.getenv("HF_MODEL", "Qwen/Qwen2.5-Coder-32B-Instruct")
-        if not api_key:
-            return json.dumps(
-                {
-                    "edits": [],
-                    "debug": {"prompt_used": prompt, "errors": ["missing HF_API_KEY"]},
-                }
-            )
-        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        payload = {"inputs": prompt, "parameters": {"temperature": temperature}}
-        resp = requests.post(f"https://api-inference.huggingface.co/models/{model}", headers=headers, json=payload, timeout=120)
-        resp.raise_for_status()
-        # Some HF models return a simple string; others return list of dicts
-        try:
-            data = resp.json()
-            if isinstance(data, list) and data and isinstance(data[0], dict) and "generated_text" in data[0]:
-                return data[0]["generated_text"]
-            if isinstance(data, dict) and "generated_text" in data:
-                return str(data["generated_text"])  # type: ignore
-            return json.dumps(data)
-        except Exception:
-            return resp.text
+def _model_request(provider: str, prompt: str) -> Dict[str, Any]:
+    return {
+        "messages": [{"role": "user", "content": prompt}],
+        "order": provider_order(provider),
+        "temperature": float(os.getenv("MODEL_TEMPERATURE", "0")),
+        "timeout": float(os.getenv("MODEL_TIMEOUT", "60")),
+        "json_mode": True,  # provider JSON mode where available (Groq/OpenAI/Gemini/Ollama)
+    }
+
+
+def _model_text(provider: str, prompt: str, result: Dict[str, Any]) -> str:
+    if result["ok"]:
+        return result["output"]
+    return json.dumps({"edits": [], "debug": {"prompt_used": prompt, "errors": [f"provider={provider}", result["error"]]}})
+
+
+def streamModelAPI(prompt: str) -> Iterator[str]:
+    """Streaming counterpart of callModelAPI: yields raw text deltas in JSON mode.
+
+    The mock provider and providers without native streaming yield one chunk.
+    Raises RuntimeError when no provider could answer.
+    """
+    provider = os.getenv("MODEL_PROVIDER", "mock").strip().lower()
+    if provider == "mock":
+        yield callModelAPI(prompt)
+        return
+    yield from get_provider_registry().stream(
+        [{"role": "user", "content": prompt}],
+        order=provider_order(provider),
+        temperature=float(os.getenv("MODEL_TEMPERATURE", "0")),
+        timeout=float(os.getenv("MODEL_TIMEOUT", "60")),
+        json_mode=True,
+    )
+
 
-    # Unknown provider: echo input for debugging
-    return json.dumps({"edits": [], "debug": {"prompt_used": prompt, "errors": [f"unknown provider: {provider}"]}})
 def _validate_request_payload(payload: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
     """Basic validation of the /edit request JSON payload."""
     required_fields = ["current", "file_path", "user", "mode"]
@@ -1013,9 +1459,144 @@ def _validate_request_payload(payload: Dict[str, Any]) -> Tuple[bool, Optional[s
     return True, None
 
 
+def _apply_to_current(payload: Dict[str, Any], parsed: Dict[str, Any]) -> List[str]:
+    """Apply parsed edits to `current` server-side and attach patched/diff/validation.
+
+    Edits that could not be applied are moved to `rejected`, so `edits` always matches
+    `patched`. Returns the problems worth sending back to the model (empty when clean).
+    """
+    outcome = apply_edits(payload.get("current", ""), parsed["edits"], payload.get("file_path", ""))
+    parsed["edits"] = outcome["applied"]
+    parsed["rejected"] = outcome["rejected"]
+    parsed["patched"] = outcome["patched"]
+    parsed["diff"] = outcome["diff"]
+    parsed["validation"] = outcome["validation"]
+
+    problems = [
+        f"edit {r['edit'].get('start_line')}:{r['edit'].get('start_col')}-"
+        f"{r['edit'].get('end_line')}:{r['edit'].get('end_col')} rejected: {r['reason']}"
+        for r in outcome["rejected"]
+    ]
+    validation = outcome["validation"]
+    if validation and validation.get("introduced"):
+        problems.append(f"the patched file no longer parses as {validation['language']}: {validation['error']}")
+    return problems
+
+
+def _edit_result(payload: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """Validate an /edit payload, build prompt, call model, parse and apply the edits."""
+    steps = _edit_steps(payload)
+    prompt, result = _advance_edit(steps, None)
+    while result is None:
+        prompt, result = _advance_edit(steps, callModelAPI(prompt))
+    return result
+
+
+def _advance_edit(steps: Generator[str, str, Tuple[Dict[str, Any], int]], raw_text: Optional[str]):
+    """Resume `_edit_steps` with the model's answer: (next prompt, None) or (None, (body, status))."""
+    try:
+        return (next(steps) if raw_text is None else steps.send(raw_text)), None
+    except StopIteration as done:
+        return None, done.value
+
+
+def _edit_steps(payload: Dict[str, Any]) -> Generator[str, str, Tuple[Dict[str, Any], int]]:
+    """The /edit flow without the model call: yields each prompt and is sent the raw answer,
+    so the Flask route calls the model synchronously and the ASGI route awaits it."""
+    error = _resolve_file_session(payload, "current")
+    if error:
+        return error
+    ok, err = _validate_request_payload(payload)
+    if not ok:
+        return {"error": err}, 400
+
+    # Build prompt and call model
+    prompt = buildPrompt(payload)
+    raw_text = yield prompt
+    parsed = parse_model_json_response(raw_text, prompt_used=prompt)
+
+    # Always the expected structure; an unusable model answer is reported, not hidden
+    if parsed["debug"].get("errors") and not parsed["edits"]:
+        parsed["error"] = "Model did not return usable edit JSON; see debug.errors."
+        return parsed, 502
+
+    problems = _apply_to_current(payload, parsed)
+    # Opt-in: each repair attempt is another full model call on the request's latency
+    repairs = int(os.getenv("EDIT_REPAIR_ATTEMPTS", "0"))
+    while problems and repairs > 0:
+        # Send the concrete problems back rather than making the editor do another round trip
+        repairs -= 1
+        repair_prompt = (
+            prompt
+            + "\n\n<<PREVIOUS_ATTEMPT_PROBLEMS>>\n"
+            + "\n".join(f"- {p}" for p in problems)
+            + "\nReturn the complete corrected JSON. Coordinates are absolute 1-based file positions; edits must not overlap."
+        )
+        retry = parse_model_json_response((yield repair_prompt), prompt_used=repair_prompt)
+        if not retry["edits"]:
+            break
+        retry_problems = _apply_to_current(payload, retry)
+        if len(retry_problems) < len(problems):
+            parsed, problems = retry, retry_problems
+
+    return _finish_edit(payload, parsed, problems)
+
+
+def _finish_edit(payload: Dict[str, Any], parsed: Dict[str, Any], problems: List[str]) -> Tuple[Dict[str, Any], int]:
+    """Shape the applied result for the client, shared by /edit and the `done` event of /edit/stream."""
+    if payload.get("file_session"):
+        # Edit coordinates refer to this version; the client only needs the diff back
+        parsed["file_session"] = payload["file_session"]
+        parsed["hash"] = payload["file_hash"]
+        if not payload.get("return_patched"):
+            parsed.pop("patched", None)
+    if problems and (not parsed["edits"] or (parsed["validation"] or {}).get("introduced")):
+        parsed["error"] = "Model edits could not be applied cleanly; see rejected and validation."
+        return parsed, 422
+    return parsed, 200
+
+
+def _edit_stream_events(payload: Dict[str, Any]) -> Iterator[str]:
+    """SSE events for /edit/stream: one `edit` per edit as soon as its JSON object closes,
+    then `done` with the body /edit would return plus its `status` (or `error`)."""
+    prompt = buildPrompt(payload)
+    parser = IncrementalArrayParser("edits")
+    streamed = 0
+    try:
+        for delta in streamModelAPI(prompt):
+            for obj in parser.feed(delta):
+                for edit in _validate_model_response({"edits": [obj]})["edits"]:
+                    streamed += 1
+                    yield _sse("edit", {"index": streamed - 1, "edit": edit})
+    except Exception as e:
+        traceback.print_exc()
+        yield _sse("error", {"error": str(e), "streamed": streamed})
+        return
+
+    parsed = parse_model_json_response(parser.text, prompt_used=prompt)
+    if parser.errors:
+        parsed["debug"].setdefault("errors", []).extend(parser.errors)
+    parsed["streamed"] = streamed
+    if parsed["debug"].get("errors") and not parsed["edits"]:
+        parsed["error"] = "Model did not return usable edit JSON; see debug.errors."
+        yield _sse("error", parsed)
+        return
+    # Edits were already sent as they arrived; the final event tells the client whether they apply cleanly
+    body, status = _finish_edit(payload, parsed, _apply_to_current(payload, parsed))
+    body["status"] = status  # what /edit would have answered
+    yield _sse("done", body)
+
+
 @app.route('/edit', methods=['POST'])
 def edit():
-    """Accept code-edit request, build prompt, call model, safely parse response."""
+    """Accept code-edit request, build prompt, call model, safely parse response.
+
+    Status codes: 200 edits applied cleanly (or nothing to change); 400 invalid body;
+    404/409 unknown or stale `file_session`; 502 the model returned no usable edit JSON;
+    422 the edits could not be applied, or broke the file's syntax (see `rejected` and
+    `validation`). With EDIT_REPAIR_ATTEMPTS > 0 the problems are first sent back to the
+    model that many times.
+    """
     try:
         payload = request.get_json(force=True, silent=False)  # Ensure JSON or raise
         if not isinstance(payload, dict):
@@ -1023,17 +1604,46 @@ def edit():
     except Exception as exc:
         return jsonify({"error": f"invalid JSON body: {type(exc).__name__}: {exc}"}), 400
 
+    body, status = _edit_result(payload)
+    return jsonify(body), status
+
+
+@app.route('/edit/stream', methods=['POST'])
+def edit_stream():
+    """Same contract as /edit, streamed as server-sent events so edits can be applied early."""
+    try:
+        payload = request.get_json(force=True, silent=False)
+        if not isinstance(payload, dict):
+            return jsonify({"error": "request body must be a JSON object"}), 400
+    except Exception as exc:
+        return jsonify({"error": f"invalid JSON body: {type(exc).__name__}: {exc}"}), 400
+
+    error = _resolve_file_session(payload, "current")
+    if error:
+        return jsonify(error[0]), error[1]
     ok, err = _validate_request_payload(payload)
     if not ok:
         return jsonify({"error": err}), 400
+    return _sse_response(_edit_stream_events(payload))
 
-    # Build prompt and call model
-    prompt = buildPrompt(payload)
-    raw_text = callModelAPI(prompt)
-    parsed = parse_model_json_response(raw_text, prompt_used=prompt)
 
-    # Ensure we always return a JSON object with expected structure
-    return jsonify(parsed), 200
+@app.route('/edit/session', methods=['POST'])
+def edit_session():
+    """Upload a file once; /edit, /edit/stream and /ask-anything then accept
+    `file_session` + `base_hash` + `deltas` instead of the full text."""
+    body, status = _create_file_session(request.get_json(force=True, silent=True))
+    return jsonify(body), status
+
+
+def _create_file_session(data: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], int]:
+    if not isinstance(data, dict) or not isinstance(data.get("content"), str):
+        return {"error": "content (string) is required"}, 400
+    session = file_session_store.create(str(data.get("file_path", "")), data["content"])
+    return {
+        "file_session": session.session_id,
+        "hash": session.hash,
+        "lines": session.table.line_count(),
+    }, 201
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
@@ -0,0 +1,119 @@
+# pipeline/analysis_cache.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from tracing import record_cache
+
+# Bump when analyze_code_string heuristics change; cached static results become stale.
+STATIC_ANALYSIS_VERSION = "static-v1"
+# Bump when generate_llm_prompt (or the review instructions) change.
+REVIEW_PROMPT_VERSION = "review-v1"
+
+
+def content_sha1(content: str) -> str:
+    """Full sha1 of the content; `content_fingerprint` in the analysis is its first 10 chars."""
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def make_key(*parts: Any) -> str:
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """Two-level cache for /analyze-file style work: static analysis and LLM reviews.
+
+    Entries live in an in-memory LRU and, when `cache_dir` is set, in JSON files on disk
+    so they survive restarts and are shared by workers on the same host.
+    """
+
+    def __init__(self, max_entries: int = 1024, cache_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def static_key(self, content: str) -> str:
+        return make_key("static", STATIC_ANALYSIS_VERSION, content_sha1(content))
+
+    def review_key(self, content: str, model: str, max_content_chars: int) -> str:
+        return make_key("review", REVIEW_PROMPT_VERSION, model, max_content_chars, content_sha1(content))
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                record_cache("analysis", "hit")
+                return self._entries[key]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                record_cache("analysis", "miss")
+                return None
+            self.hits += 1
+            self._store(key, value)
+        record_cache("analysis", "hit")
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._store(key, value)
+        self._write_disk(key, value)
+
+    def _store(self, key: str, value: Any) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Any]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ignoring unreadable analysis cache entry {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, value: Any) -> None:
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)  # atomic, so readers never see half a file
+        except Exception as e:
+            print(f"Failed to write analysis cache entry {key}: {e}")
+
+
+_analysis_cache: Optional[AnalysisCache] = None
+_analysis_cache_lock = threading.Lock()
+
+
+def get_analysis_cache() -> AnalysisCache:
+    """Process-wide cache configured by ANALYSIS_CACHE_SIZE and ANALYSIS_CACHE_DIR."""
+    global _analysis_cache
+    with _analysis_cache_lock:
+        if _analysis_cache is None:
+            _analysis_cache = AnalysisCache(
+                max_entries=int(os.getenv("ANALYSIS_CACHE_SIZE", "1024")),
+                cache_dir=os.getenv("ANALYSIS_CACHE_DIR") or None,
+            )
+        return _analysis_cache
@@ -0,0 +1,148 @@
+# pipeline/async_clients.py
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+from llm_cache import get_prompt_cache, is_ok_result, prompt_key, ttl_for
+from tracing import span
+from usage import record_groq_response
+
+T = TypeVar("T")
+
+GROQ_CHAT_URL = os.getenv("GROQ_API_BASE", "https://api.groq.com").rstrip("/") + "/openai/v1/chat/completions"
+GITHUB_API_URL = os.getenv("GITHUB_API_BASE", "https://api.github.com").rstrip("/") + "/repos"
+
+# Bounded concurrency per upstream. Requests beyond the limit wait on the event loop
+# instead of pinning a thread each, so one process can hold many in-flight chats.
+LLM_SEMAPHORE = asyncio.Semaphore(int(os.getenv("ASYNC_LLM_CONCURRENCY", "64")))
+GITHUB_SEMAPHORE = asyncio.Semaphore(int(os.getenv("ASYNC_GITHUB_CONCURRENCY", "32")))
+BLOCKING_SEMAPHORE = asyncio.Semaphore(int(os.getenv("ASYNC_BLOCKING_CONCURRENCY", "8")))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Process-wide pooled HTTP client (created lazily, closed by `close_client`)."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(120.0, connect=10.0),
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run sync code (git clone, regex analysis, legacy providers) in a thread, bounded."""
+    async with BLOCKING_SEMAPHORE:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+async def afetch_github_file(owner: str, repo: str, path: str, branch: str = "main") -> str:
+    """Async twin of main.fetch_github_file."""
+    headers = {"Accept": "application/vnd.github.v3.raw"}
+    token = os.getenv("GITHUB_TOKEN")
+    if token:
+        headers["Authorization"] = f"token {token}"
+    url = f"{GITHUB_API_URL}/{owner}/{repo}/contents/{path}"
+    async with GITHUB_SEMAPHORE:
+        with span("github_fetch"):
+            r = await get_client().get(url, params={"ref": branch}, headers=headers, timeout=10)
+    if r.status_code != 200:
+        raise Exception(f"GitHub fetch failed: {r.text}")
+    return r.text
+
+
+def _groq_payload(prompt: str, model: str, max_tokens: int, stream: bool) -> Dict[str, Any]:
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "You are an expert software engineer and code reviewer."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.3,
+        "max_tokens": max_tokens,
+        "stream": stream,
+    }
+
+
+async def acall_groq(prompt: str, model: str = "llama-3.3-70b-versatile", api_key: str = None, timeout: int = 120, max_tokens: int = 1500) -> Dict[str, Any]:
+    """Async twin of file_analyzer.call_groq; same {"ok": ..., "output"/"error": ...} contract."""
+    api_key = api_key or os.getenv("GROQ_API_KEY")
+    if not api_key:
+        return {"ok": False, "error": "Missing Groq API key. Set GROQ_API_KEY env variable or pass `api_key`."}
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    payload = _groq_payload(prompt, model, max_tokens, False)
+
+    async def request_completion() -> Dict[str, Any]:
+        try:
+            async with LLM_SEMAPHORE:
+                with span("call_groq"):
+                    response = await get_client().post(GROQ_CHAT_URL, headers=headers, json=payload, timeout=timeout)
+            if response.status_code != 200:
+                return {"ok": False, "error": f"Groq API error {response.status_code}: {response.text}"}
+            data = response.json()
+            record_groq_response(model, api_key, data, response.headers)
+            output = data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+            return {"ok": True, "output": output or "No response content."}
+        except httpx.TimeoutException:
+            return {"ok": False, "error": f"Groq API request timed out after {timeout}s."}
+        except Exception as e:
+            return {"ok": False, "error": f"Unexpected error: {e}"}
+
+    # Same key as the sync call_groq, so both serving modes share cached answers
+    key = prompt_key(model, payload["temperature"], payload["messages"], max_tokens=max_tokens)
+    return await get_prompt_cache().aget_or_call(key, request_completion, ttl_for(payload["temperature"]), cacheable=is_ok_result)
+
+
+async def acall_groq_stream(prompt: str, model: str = "llama-3.3-70b-versatile", api_key: str = None, timeout: int = 120, max_tokens: int = 1500) -> AsyncIterator[str]:
+    """Async twin of file_analyzer.call_groq_stream; raises RuntimeError on failure."""
+    api_key = api_key or os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise RuntimeError("Missing Groq API key. Set GROQ_API_KEY env variable or pass `api_key`.")
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    async with LLM_SEMAPHORE:
+        try:
+            async with get_client().stream(
+                "POST", GROQ_CHAT_URL, headers=headers, json=_groq_payload(prompt, model, max_tokens, True), timeout=timeout
+            ) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise RuntimeError(f"Groq API error {response.status_code}: {body.decode(errors='ignore')}")
+                async for line in response.aiter_lines():
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                        if (chunk.get("x_groq") or {}).get("usage"):
+                            # The final chunk carries the request's usage
+                            record_groq_response(model, api_key, chunk, response.headers)
+                        delta = chunk["choices"][0].get("delta", {}).get("content")
+                    except (json.JSONDecodeError, KeyError, IndexError):
+                        continue
+                    if delta:
+                        yield delta
+        except httpx.TimeoutException:
+            raise RuntimeError(f"Groq API request timed out after {timeout}s.")
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"Groq HTTP error: {e}")
+
+
+async def bounded_llm(coro_factory: Callable[[], Awaitable[T]]) -> T:
+    """Await an LLM coroutine (e.g. a LangChain `ainvoke`) under the shared LLM limit."""
+    async with LLM_SEMAPHORE:
+        return await coro_factory()
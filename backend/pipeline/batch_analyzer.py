@@ -0,0 +1,217 @@
+# pipeline/batch_analyzer.py
+import contextvars
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from file_analyzer import FileAnalyzer
+from llm_batcher import new_nonce, pack_sections, split_sections
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Shared process pool for CPU-bound static analysis (one per worker process)."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            workers = int(os.getenv("ANALYSIS_PROCESSES", "0")) or min(4, os.cpu_count() or 1)
+            _process_pool = ProcessPoolExecutor(max_workers=workers)
+        return _process_pool
+
+
+def _static_analysis(code: str) -> Dict[str, Any]:
+    """Top-level so it can be pickled into the process pool."""
+    return FileAnalyzer().analyze_code_string(code)
+
+
+def batch_input_error(file_paths: Any, contents: Any) -> Optional[str]:
+    """Why a batch request body is malformed, or None when it is usable.
+
+    `file_paths` must be a list of strings (a bare string would iterate by character) and
+    `files`, when given, a {path: content} object of strings.
+    """
+    if not isinstance(file_paths, list) or not all(isinstance(p, str) for p in file_paths):
+        return "file_paths must be a list of strings"
+    if not isinstance(contents, dict) or not all(isinstance(k, str) and isinstance(v, str) for k, v in contents.items()):
+        return "files must be an object mapping paths to file contents"
+    return None
+
+
+class BatchAnalyzer:
+    """Analyze many files in one request.
+
+    Files are fetched concurrently, statically analyzed in a process pool, and small files
+    are packed into shared LLM prompts whose answers are split back per file. Results are
+    yielded as soon as each file completes.
+    """
+
+    def __init__(
+        self,
+        fetch_file: Callable[[str], str],
+        llm_call: Callable[..., Dict[str, Any]],
+        fetch_workers: int = 8,
+        llm_workers: int = 4,
+        small_file_chars: int = 3000,
+        max_batch_chars: int = 12000,
+        max_content_chars: int = 4000,
+        model: str = "",
+        cache: Optional[Any] = None,
+    ):
+        self.fetch_file = fetch_file
+        self.llm_call = llm_call
+        self.fetch_workers = fetch_workers
+        self.llm_workers = llm_workers
+        self.small_file_chars = small_file_chars
+        self.max_batch_chars = max_batch_chars
+        self.max_content_chars = max_content_chars
+        self.model = model
+        self.cache = cache  # AnalysisCache, optional
+        self.analyzer = FileAnalyzer()
+
+    def run(self, file_paths: List[str], contents: Optional[Dict[str, str]] = None) -> Iterator[Dict[str, Any]]:
+        contents = dict(contents or {})
+        process_pool = _get_process_pool()
+        pending: Dict[Future, Tuple[str, Any]] = {}
+        batch: List[Tuple[str, str]] = []  # (path, per-file prompt)
+        batch_chars = 0
+        codes: Dict[str, str] = {}
+        analyses: Dict[str, Dict[str, Any]] = {}
+
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as io_pool, \
+                ThreadPoolExecutor(max_workers=self.llm_workers) as llm_pool:
+
+            def submit_llm(items: List[Tuple[str, str]]) -> None:
+                if len(items) == 1:
+                    path, prompt = items[0]
+                    pending[llm_pool.submit(contextvars.copy_context().run, self.llm_call, prompt)] = ("llm", ([path], ""))
+                else:
+                    nonce = new_nonce()
+                    prompt = pack_sections("Review each of the following files.", items, nonce=nonce)
+                    max_tokens = min(8000, 700 * len(items))
+                    future = llm_pool.submit(contextvars.copy_context().run, self.llm_call, prompt, max_tokens=max_tokens)
+                    pending[future] = ("llm", ([p for p, _ in items], nonce))
+
+            # Stage 1: fetch (or take the provided content)
+            for path in file_paths:
+                if path in contents and contents[path]:
+                    future: Future = Future()
+                    future.set_result(contents[path])
+                else:
+                    future = io_pool.submit(self.fetch_file, path)
+                pending[future] = ("fetch", path)
+
+            while pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, ref = pending.pop(future)
+
+                    if stage == "fetch":
+                        try:
+                            code = future.result()
+                        except Exception as e:
+                            yield {"file_path": ref, "success": False, "error": f"GitHub fetch failed: {e}"}
+                            continue
+                        if not code:
+                            yield {"file_path": ref, "success": False, "error": "Empty file content."}
+                            continue
+                        codes[ref] = code
+                        # Stage 2: static analysis in the process pool (unless cached)
+                        cached = self.cache.get(self.cache.static_key(code)) if self.cache else None
+                        if cached is not None:
+                            static_future: Future = Future()
+                            static_future.set_result(cached)
+                        else:
+                            static_future = process_pool.submit(_static_analysis, code)
+                        pending[static_future] = ("static", (ref, cached is not None))
+
+                    elif stage == "static":
+                        ref, from_cache = ref
+                        try:
+                            analysis = future.result()
+                        except Exception as e:
+                            yield {"file_path": ref, "success": False, "error": f"Static analysis failed: {e}"}
+                            continue
+                        if "error" in analysis:
+                            yield {"file_path": ref, "success": False, "error": analysis["error"]}
+                            continue
+                        analyses[ref] = analysis
+                        if self.cache:
+                            if not from_cache:
+                                self.cache.put(self.cache.static_key(codes[ref]), analysis)
+                            review = self.cache.get(self._review_key(ref, codes))
+                            if review is not None:
+                                yield self._file_result(ref, review, analyses, codes, batched=False, cached=True)
+                                continue
+                        prompt = self.analyzer.generate_llm_prompt(
+                            analysis, file_content=codes[ref], max_content_chars=self.max_content_chars
+                        )
+                        # Stage 3: large files go alone, small ones share a prompt
+                        if len(prompt) > self.small_file_chars:
+                            submit_llm([(ref, prompt)])
+                        else:
+                            batch.append((ref, prompt))
+                            batch_chars += len(prompt)
+                            if batch_chars >= self.max_batch_chars:
+                                submit_llm(batch)
+                                batch, batch_chars = [], 0
+
+                    elif stage == "llm":
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            result = {"ok": False, "error": str(e)}
+                        paths, nonce = ref
+                        yield from self._collect_llm(paths, nonce, result, resubmit=submit_llm, analyses=analyses, codes=codes)
+
+                # Nothing else can join the open batch once all fetch/static work is done
+                if batch and not any(stage in ("fetch", "static") for stage, _ in pending.values()):
+                    submit_llm(batch)
+                    batch, batch_chars = [], 0
+
+    def _collect_llm(
+        self,
+        paths: List[str],
+        nonce: str,
+        result: Dict[str, Any],
+        resubmit: Callable[[List[Tuple[str, str]]], None],
+        analyses: Dict[str, Dict[str, Any]],
+        codes: Dict[str, str],
+    ) -> Iterator[Dict[str, Any]]:
+        if not result.get("ok"):
+            for path in paths:
+                yield {"file_path": path, "success": False, "error": result.get("error"), "static_analysis": analyses[path]}
+            return
+
+        if len(paths) == 1:
+            yield self._file_result(paths[0], result["output"], analyses, codes, batched=False)
+            return
+
+        sections = split_sections(result["output"], nonce=nonce)
+        for path in paths:
+            if path in sections and sections[path]:
+                yield self._file_result(path, sections[path], analyses, codes, batched=True)
+            else:
+                # The model dropped or mangled this section; review the file on its own
+                prompt = self.analyzer.generate_llm_prompt(
+                    analyses[path], file_content=codes[path], max_content_chars=self.max_content_chars
+                )
+                resubmit([(path, prompt)])
+
+    def _review_key(self, path: str, codes: Dict[str, str]) -> str:
+        return self.cache.review_key(codes[path], self.model, self.max_content_chars)
+
+    def _file_result(self, path: str, output: str, analyses, codes, batched: bool, cached: bool = False) -> Dict[str, Any]:
+        if self.cache and not cached:
+            self.cache.put(self._review_key(path, codes), output)
+        return {
+            "file_path": path,
+            "success": True,
+            "batched": batched,
+            "cached": cached,
+            "static_analysis": analyses[path],
+            "ai_analysis": output,
+            "fetched_file_content_preview": codes[path][:2000],
+        }
@@ -0,0 +1,247 @@
+# pipeline/chat_history.py
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class ChatSession:
+    """State for one chat conversation: the file context, a rolling memo and recent turns."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.context = ""
+        self.context_hash = ""
+        self.memo = ""
+        self.messages: List[Dict[str, str]] = []  # [{"role": "human"|"ai", "content": "..."}]
+        self.created_at = time.time()
+        self.last_access = self.created_at
+
+    def size(self) -> int:
+        """Approximate memory footprint in characters."""
+        return len(self.context) + len(self.memo) + sum(len(m["content"]) for m in self.messages)
+
+    def history_messages(self) -> List[Tuple[str, str]]:
+        """Recent turns in the (role, content) shape accepted by MessagesPlaceholder."""
+        return [(m["role"], m["content"]) for m in self.messages]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "context": self.context,
+            "context_hash": self.context_hash,
+            "memo": self.memo,
+            "messages": list(self.messages),
+            "created_at": self.created_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChatSession":
+        session = cls(data["session_id"])
+        session.context = data.get("context", "")
+        session.context_hash = data.get("context_hash", "")
+        session.memo = data.get("memo", "")
+        session.messages = list(data.get("messages", []))
+        session.created_at = data.get("created_at", session.created_at)
+        return session
+
+
+def _fallback_summarizer(memo: str, messages: List[Dict[str, str]], max_chars: int = 1500) -> str:
+    """Deterministic summary used when no LLM summarizer is configured or it fails."""
+    lines = [memo] if memo else []
+    for m in messages:
+        speaker = "User" if m["role"] == "human" else "Assistant"
+        text = " ".join(m["content"].split())
+        lines.append(f"{speaker}: {text[:200]}")
+    combined = "\n".join(lines)
+    # Keep the most recent part of the memo when it overflows
+    return combined[-max_chars:]
+
+
+class BoundedHistoryStore:
+    """Chat history store with LRU + TTL eviction, a global memory cap and rolling summarization.
+
+    Only the last `keep_turns` exchanges are kept verbatim; older turns are folded into a
+    compact memo by `summarizer(memo, messages) -> str`, so the prompt stays flat in size
+    as a conversation grows. `acommit_turn` uses the coroutine `asummarizer` instead, when
+    given, so async callers do not park a thread on the LLM call.
+
+    With a shared `backend` (see state_backend.py) sessions are read through and written
+    back on every turn, so any worker process can continue a conversation.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 256,
+        ttl_seconds: int = 3600,
+        max_total_chars: int = 4_000_000,
+        keep_turns: int = 4,
+        max_memo_chars: int = 1500,
+        summarizer: Optional[Callable[[str, List[Dict[str, str]]], str]] = None,
+        asummarizer: Optional[Callable[[str, List[Dict[str, str]]], Awaitable[str]]] = None,
+        backend: Optional[Any] = None,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_total_chars = max_total_chars
+        self.keep_turns = keep_turns
+        self.max_memo_chars = max_memo_chars
+        self.summarizer = summarizer
+        self.asummarizer = asummarizer
+        self.backend = backend
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.RLock()
+        # Serialize commits of one session across its summarization (striped, so nothing to clean up)
+        self._turn_locks = [threading.Lock() for _ in range(64)]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get_session(self, session_id: str, context: Optional[str] = None) -> ChatSession:
+        """Return the session for `session_id`, creating it if needed.
+
+        When `context` is given and differs from the stored one (e.g. the file changed),
+        it replaces the stored context; the conversation itself is kept.
+        """
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if self.backend is not None:
+                stored = self.backend.load_session(session_id)
+                if stored is not None:
+                    session = ChatSession.from_dict(stored)
+                    self._sessions[session_id] = session
+            if session is None:
+                session = ChatSession(session_id)
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            session.last_access = time.time()
+
+            if context is not None:
+                context_hash = hashlib.sha1(context.encode("utf-8")).hexdigest()
+                if context_hash != session.context_hash:
+                    session.context = context
+                    session.context_hash = context_hash
+                    self._persist(session)
+            self._enforce_caps(protect=session_id)
+            return session
+
+    def commit_turn(self, session_id: str, user_message: str, answer: str) -> None:
+        """Append a completed exchange and compact older turns into the memo.
+
+        Concurrent turns on one session run one after the other: each folds its overflow
+        into the memo the previous one wrote, so no overflow is lost to a last-write-wins.
+        """
+        with self._turn_locks[hash(session_id) % len(self._turn_locks)]:
+            session, overflow = self._append_turn(session_id, user_message, answer)
+            # Summarize outside the store lock; the LLM call may take a while
+            if overflow:
+                self._set_memo(session, self._summarize(session.memo, overflow))
+            self._persist(session)
+
+    async def acommit_turn(self, session_id: str, user_message: str, answer: str) -> None:
+        """Async twin of commit_turn: same per-session ordering, but the summary is awaited
+        on the event loop and only the store/backend work runs in a thread."""
+        turn_lock = self._turn_locks[hash(session_id) % len(self._turn_locks)]
+        # Poll rather than block a thread on the lock, so cancellation cannot leak it
+        while not turn_lock.acquire(blocking=False):
+            await asyncio.sleep(0.01)
+        try:
+            session, overflow = await asyncio.to_thread(self._append_turn, session_id, user_message, answer)
+            if overflow:
+                self._set_memo(session, await self._asummarize(session.memo, overflow))
+            await asyncio.to_thread(self._persist, session)
+        finally:
+            turn_lock.release()
+
+    def _append_turn(self, session_id: str, user_message: str, answer: str) -> Tuple[ChatSession, List[Dict[str, str]]]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self.get_session(session_id)
+            session.messages.append({"role": "human", "content": user_message})
+            session.messages.append({"role": "ai", "content": answer})
+            session.last_access = time.time()
+            self._sessions.move_to_end(session_id)
+            return session, self._take_overflow(session)
+
+    def _set_memo(self, session: ChatSession, memo: str) -> None:
+        with self._lock:
+            session.memo = memo
+            self._enforce_caps(protect=session.session_id)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        if self.backend is not None:
+            self.backend.delete_session(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "total_chars": sum(s.size() for s in self._sessions.values()),
+                "max_sessions": self.max_sessions,
+                "max_total_chars": self.max_total_chars,
+            }
+
+    def _persist(self, session: ChatSession) -> None:
+        if self.backend is None:
+            return
+        try:
+            self.backend.save_session(session.session_id, session.to_dict())
+        except Exception as e:
+            print(f"Failed to persist chat session {session.session_id}: {e}")
+
+    def _take_overflow(self, session: ChatSession) -> List[Dict[str, str]]:
+        keep = self.keep_turns * 2
+        if len(session.messages) <= keep:
+            return []
+        overflow = session.messages[:-keep]
+        session.messages = session.messages[-keep:]
+        return overflow
+
+    def _summarize(self, memo: str, messages: List[Dict[str, str]]) -> str:
+        if self.summarizer:
+            try:
+                summary = (self.summarizer(memo, messages) or "").strip()
+                if summary:
+                    return summary[: self.max_memo_chars]
+            except Exception as e:
+                print(f"History summarization failed, using fallback: {e}")
+        return _fallback_summarizer(memo, messages, self.max_memo_chars)
+
+    async def _asummarize(self, memo: str, messages: List[Dict[str, str]]) -> str:
+        if not self.asummarizer:
+            return await asyncio.to_thread(self._summarize, memo, messages)
+        try:
+            summary = (await self.asummarizer(memo, messages) or "").strip()
+            if summary:
+                return summary[: self.max_memo_chars]
+        except Exception as e:
+            print(f"History summarization failed, using fallback: {e}")
+        return _fallback_summarizer(memo, messages, self.max_memo_chars)
+
+    def _expire(self) -> None:
+        if not self.ttl_seconds:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        # OrderedDict is in LRU order, so expired sessions are at the front
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if oldest.last_access >= cutoff:
+                break
+            del self._sessions[oldest_id]
+
+    def _enforce_caps(self, protect: Optional[str] = None) -> None:
+        total = sum(s.size() for s in self._sessions.values())
+        while self._sessions and (len(self._sessions) > self.max_sessions or total > self.max_total_chars):
+            oldest_id = next(iter(self._sessions))
+            if oldest_id == protect:
+                if len(self._sessions) == 1:
+                    break
+                self._sessions.move_to_end(oldest_id)
+                continue
+            total -= self._sessions.pop(oldest_id).size()
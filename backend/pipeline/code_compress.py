@@ -0,0 +1,119 @@
+# pipeline/code_compress.py
+"""Language-aware comment and blank-line stripping for LLM prompts.
+
+One precompiled pattern per language family matches string literals and comments
+as alternatives of a single regex, so a single scan (in the regex engine) tells
+them apart: strings are kept verbatim, comments dropped. `#` inside a string and
+the `//` of "http://" in a string survive. Python docstrings (a triple-quoted
+string that starts its line) count as comments.
+
+Every alternative starts with a literal character, which lets `re` skip straight
+to the next quote or comment marker instead of trying each alternative at every
+position; keep it that way when adding a language.
+"""
+import os
+import re
+from bisect import bisect_right
+from typing import Callable, Dict, Optional, Pattern
+
+# String literals; single-quoted forms stay on one line and honor escapes
+_SQ = r"'(?:[^'\\\n]|\\.)*'"
+_DQ = r'"(?:[^"\\\n]|\\.)*"'
+_BQ = r"`(?:[^`\\]|\\.)*`"  # JS/TS template literals, Go raw strings (may span lines)
+_TSQ = r"'''(?:[^'\\]|\\.|'(?!''))*'''"
+_TDQ = r'"""(?:[^"\\]|\\.|"(?!""))*"""'
+
+# Comments
+_HASH = r"\#[^\n]*"
+# Shell/YAML: `#` starts a comment only at the start of a word, so `${#arr[@]}` and `$#` are code.
+# The `#` stays first (lookbehinds after it) so the literal-prefix scan still applies.
+_WORD_HASH = r"\#(?:(?<=^\#)|(?<=\s\#))[^\n]*"
+_SLASH = r"//[^\n]*"
+# PHP: `#` comments, except PHP 8 attributes `#[...]`
+_PHP_HASH = r"\#(?!\[)[^\n]*"
+_BLOCK = r"/\*[\s\S]*?(?:\*/|\Z)"
+_DASH = r"--[^\n]*"
+_MARKUP = r"<!--[\s\S]*?(?:-->|\Z)"
+
+# JS/TS regex literal: a `/` (not `//` or `/*`) right after an operator, `(`, `,` or `return`,
+# possibly one or two spaces later, where it cannot be a division. Kept verbatim like a
+# string, so `/https?:\/\//` is not mistaken for a `//` comment. Fixed-width lookbehinds
+# after the leading `/` keep the literal-prefix scan.
+_REGEX_AFTER = r"[(,=:\[!&|?{;\n]"
+_REGEX = (
+    r"/(?=[^/*\n])"
+    rf"(?:(?<={_REGEX_AFTER}/)|(?<={_REGEX_AFTER}\s/)|(?<={_REGEX_AFTER}\s\s/)|(?<=return\s/)|(?<=^/))"
+    r"(?:[^/\\\n\[]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/"
+)
+
+# family -> alternatives, earliest wins at a position (triple quotes before single ones)
+_FAMILIES: Dict[str, tuple] = {
+    "python": (_TDQ, _TSQ, _SQ, _DQ, _HASH),
+    "c": (_SQ, _DQ, _BQ, _SLASH, _BLOCK),
+    "js": (_SQ, _DQ, _BQ, _SLASH, _BLOCK, _REGEX),
+    "php": (_SQ, _DQ, _BQ, _SLASH, _BLOCK, _PHP_HASH),
+    "hash": (_SQ, _DQ, _HASH),
+    "shell": (_SQ, _DQ, _WORD_HASH),
+    "sql": (_SQ, _DQ, _DASH, _BLOCK),
+    "markup": (_MARKUP,),
+    # Unknown language: every common comment form, still string-aware
+    "generic": (_TDQ, _TSQ, _SQ, _DQ, _BQ, _HASH, _SLASH, _BLOCK),
+}
+_COMMENT_STARTS = ("#", "//", "/*", "--", "<!--")
+
+EXTENSION_FAMILIES: Dict[str, str] = {
+    **dict.fromkeys(("py", "pyi", "pyw"), "python"),
+    **dict.fromkeys((
+        "java", "go", "c", "h", "cc", "cpp", "cxx", "hpp", "cs", "kt", "kts", "swift", "scala", "rs", "dart",
+    ), "c"),
+    **dict.fromkeys(("js", "jsx", "mjs", "cjs", "ts", "tsx"), "js"),
+    "php": "php",
+    **dict.fromkeys(("sh", "bash", "zsh", "yaml", "yml"), "shell"),
+    **dict.fromkeys(("rb", "pl", "r", "toml", "ps1"), "hash"),
+    "sql": "sql",
+    **dict.fromkeys(("html", "htm", "xml", "svg"), "markup"),
+}
+
+# FileAnalyzer.analyze_code_string() language labels
+_LABEL_FAMILIES = {"python": "python", "javascript/typescript": "js", "html": "markup"}
+
+_PATTERNS: Dict[str, Pattern] = {family: re.compile("|".join(alts)) for family, alts in _FAMILIES.items()}
+
+
+def _strip_comment(match: "re.Match") -> str:
+    text = match.group()
+    if text.startswith(_COMMENT_STARTS):
+        return ""
+    if text.startswith(('"""', "'''")):
+        # A triple-quoted string that opens its line (after indentation and an r/b/u/f
+        # prefix) is a docstring or bare string statement: documentation, not code
+        source, start = match.string, match.start()
+        line_start = source.rfind("\n", 0, start) + 1
+        if not source[line_start:start].strip(" \trRbBuUfF"):
+            return ""
+    return text
+
+
+def language_for_path(path: Optional[str]) -> str:
+    """Comment family for a file path, by extension ("generic" when unknown)."""
+    ext = os.path.splitext(path or "")[1].lstrip(".").lower()
+    return EXTENSION_FAMILIES.get(ext, "generic")
+
+
+def language_for_label(label: Optional[str]) -> str:
+    """Comment family for a language label such as FileAnalyzer's "Python"."""
+    return _LABEL_FAMILIES.get((label or "").strip().lower(), "generic")
+
+
+def compress_code(code: str, language: str = "generic") -> str:
+    """Strip comments, trailing whitespace and blank lines; `language` is a family from language_for_path."""
+    if not code:
+        return ""
+    code = _PATTERNS.get(language, _PATTERNS["generic"]).sub(_strip_comment, code)
+    return "\n".join([line for line in map(str.rstrip, code.split("\n")) if line])
+
+
+def line_locator(content: str) -> Callable[[int], int]:
+    """Offset -> 1-based line number by bisecting line starts (slicing and counting per match is quadratic)."""
+    starts = [0] + [m.end() for m in re.finditer("\n", content)]
+    return lambda offset: bisect_right(starts, offset)
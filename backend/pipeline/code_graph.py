@@ -1,5 +1,7 @@
 # pipeline/code_graph.py
 import ast
+import re
+from typing import Any, Dict, List
 
 class CodeGraph:
     def __init__(self, code: str):
@@ -27,3 +29,68 @@ class CodeGraph:
                             calls.append(n.func.attr)
                 graph[node.name] = calls
         return graph
+
+    def outline(self, max_items: int = 200) -> List[Dict[str, Any]]:
+        """Classes and functions (including methods) in source order:
+        [{"line", "end_line", "depth", "signature"}]. Empty when the code does not parse."""
+        try:
+            tree = ast.parse(self.code)
+        except (SyntaxError, ValueError):
+            return []
+        lines = self.code.split("\n")
+        items: List[Dict[str, Any]] = []
+
+        def visit(node: ast.AST, depth: int) -> None:
+            for child in ast.iter_child_nodes(node):
+                if len(items) >= max_items:
+                    return
+                if isinstance(child, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                    items.append({
+                        "line": child.lineno,
+                        "end_line": getattr(child, "end_lineno", child.lineno),
+                        "depth": depth,
+                        "signature": lines[child.lineno - 1].strip(),
+                    })
+                    visit(child, depth + 1)
+
+        visit(tree, 0)
+        return items
+
+
+# Declaration lines for languages we do not parse; indentation stands in for nesting depth
+_DECLARATION_PATTERNS = {
+    "script": re.compile(
+        r"^([ \t]*)(?:export\s+)?(?:default\s+)?(?:abstract\s+)?(?:async\s+)?"
+        r"(?:(?:function\*?|class|interface|type|enum)\s+\w+|(?:const|let)\s+\w+\s*=\s*(?:async\s*)?(?:\(|function))",
+        re.MULTILINE,
+    ),
+    "generic": re.compile(
+        r"^([ \t]*)(?:(?:pub(?:\([^)]*\))?|export)\s+)?"
+        r"(?:(?:fn|func|def|class|struct|trait|impl|interface|enum|module|object)\b"
+        r"|(?:(?:public|private|protected|internal|static|final|override|virtual|abstract)\s+)+[\w<>\[\],\s]*\()",
+        re.MULTILINE,
+    ),
+}
+
+
+def symbol_outline(code: str, file_path: str, max_items: int = 200) -> List[Dict[str, Any]]:
+    """Signature-only outline of a file: ast for Python, declaration regexes elsewhere.
+
+    Regex items have no reliable end, so their `end_line` equals `line`.
+    """
+    lower = (file_path or "").lower()
+    if lower.endswith((".py", ".pyi")):
+        return CodeGraph(code).outline(max_items)
+
+    pattern = _DECLARATION_PATTERNS["script" if lower.endswith((".js", ".jsx", ".ts", ".tsx", ".mjs")) else "generic"]
+    items: List[Dict[str, Any]] = []
+    line_no, last_pos = 1, 0
+    for match in pattern.finditer(code):
+        line_no += code.count("\n", last_pos, match.start())
+        last_pos = match.start()
+        end = code.find("\n", match.start())
+        signature = code[match.start():end if end != -1 else len(code)].strip().rstrip("{").strip()
+        items.append({"line": line_no, "end_line": line_no, "depth": len(match.group(1).expandtabs(4)) // 4, "signature": signature})
+        if len(items) >= max_items:
+            break
+    return items
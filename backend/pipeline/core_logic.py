@@ -0,0 +1,134 @@
+# pipeline/core_logic.py
+"""Selection of a file's most logic-dense lines for the wiki prompts.
+
+Each distinct non-comment line is scored once by a weighted set of scorers and the top N are
+kept with a heap, then emitted in file order. One pass over the file, O(n log N).
+
+Scorers (CORE_LOGIC_SCORERS, e.g. "density=1,idf=0.5"):
+- density: control flow, calls/brackets and the number of distinct words on the line
+- idf: rarity of the line's identifiers across the repository, so names specific to
+  this file outrank boilerplate every file shares (needs the repo's files)
+"""
+import heapq
+import math
+import os
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Stop words and boilerplate to ignore
+IGNORE_KEYWORDS = frozenset({'import', 'from', 'export', 'require', 'const', 'let', 'var', 'self', 'this'})
+_LOGIC_MARKERS = ('if ', 'for ', 'while ', 'return ', 'await ', 'async ', '= ')
+_STRUCTURE_CHARS = ('{', '(', '[', ':')
+_COMMENT_PREFIXES = ('#', '//', '*', '/')
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+DEFAULT_TOP_N = 50
+DEFAULT_SCORERS = "density=1,idf=1"
+
+
+# Scores one stripped, non-comment line; must depend on the text alone (scores are memoized per file)
+Scorer = Callable[[str], float]
+
+
+def density_score(text: str) -> float:
+    """Logic density: more complex lines (logic operators, assignments, calls) score higher."""
+    score = 0
+    if any(op in text for op in _LOGIC_MARKERS):
+        score += 5
+    if any(sym in text for sym in _STRUCTURE_CHARS):
+        score += 2
+    # Count unique meaningful words
+    words = set(text.lower().split())
+    words -= IGNORE_KEYWORDS
+    return score + len(words)
+
+
+class IdentifierRarity:
+    """Sum of the smoothed inverse document frequency of a line's identifiers.
+
+    Document frequency is counted over the repository's files, so an identifier that
+    appears in every file scores ~0 and one unique to the current file scores highest.
+    """
+
+    def __init__(self, doc_freq: Dict[str, int], n_docs: int):
+        self.n_docs = n_docs
+        self._idf = {term: math.log((1 + n_docs) / (1 + df)) for term, df in doc_freq.items()}
+        # Identifiers never seen in the corpus (df = 0)
+        self._unseen = math.log(1 + n_docs)
+
+    @classmethod
+    def from_files(cls, files: Dict[str, str]) -> "IdentifierRarity":
+        doc_freq: Dict[str, int] = {}
+        for content in files.values():
+            for term in set(_IDENTIFIER.findall(content.lower())):
+                doc_freq[term] = doc_freq.get(term, 0) + 1
+        return cls(doc_freq, len(files))
+
+    def __call__(self, text: str) -> float:
+        terms = set(_IDENTIFIER.findall(text.lower()))
+        terms -= IGNORE_KEYWORDS
+        idf, unseen = self._idf, self._unseen
+        return sum(idf.get(term, unseen) for term in terms)
+
+
+# name -> factory(repo files or None) -> scorer, or None when the scorer needs the repo
+SCORER_FACTORIES: Dict[str, Callable[[Optional[Dict[str, str]]], Optional[Scorer]]] = {
+    "density": lambda files: density_score,
+    "idf": lambda files: IdentifierRarity.from_files(files) if files else None,
+}
+
+
+class CoreLogicRanker:
+    """Keeps the `top_n` highest-scoring lines of a file, in their original order."""
+
+    def __init__(self, scorers: Iterable[Tuple[Scorer, float]], top_n: int = DEFAULT_TOP_N):
+        self.scorers = [(scorer, weight) for scorer, weight in scorers if weight]
+        self.top_n = top_n
+        if len(self.scorers) == 1 and self.scorers[0][1] == 1:
+            self.score: Scorer = self.scorers[0][0]
+        else:
+            self.score = lambda text: sum(weight * scorer(text) for scorer, weight in self.scorers)
+
+    def select(self, code: str) -> str:
+        lines = code.split('\n')
+        score = self.score
+        # Closing braces, `return result` and friends repeat a lot; score each text once
+        memo: Dict[str, float] = {}
+        scored: List[Tuple[float, int]] = []
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            if not stripped or stripped.startswith(_COMMENT_PREFIXES):
+                continue
+            value = memo.get(stripped)
+            if value is None:
+                value = memo[stripped] = score(stripped)
+            # -i: among equal scores the earlier line wins
+            scored.append((value, -i))
+        top = heapq.nlargest(self.top_n, scored)
+        return "\n".join(lines[-neg_i] for neg_i in sorted((neg_i for _, neg_i in top), reverse=True))
+
+
+def parse_scorers(spec: str) -> List[Tuple[str, float]]:
+    """Parse `density=1,idf=0.5` into [("density", 1.0), ("idf", 0.5)]; a bare name has weight 1."""
+    parsed = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition("=")
+        if not name:
+            continue
+        if name not in SCORER_FACTORIES:
+            print(f"Unknown core-logic scorer '{name}', ignoring.")
+            continue
+        parsed.append((name, float(weight) if weight else 1.0))
+    return parsed
+
+
+def build_ranker(files: Optional[Dict[str, str]] = None, spec: Optional[str] = None) -> CoreLogicRanker:
+    """Ranker configured by CORE_LOGIC_SCORERS / CORE_LOGIC_TOP_N; `files` enables repo-level scorers."""
+    scorers = []
+    for name, weight in parse_scorers(spec or os.getenv("CORE_LOGIC_SCORERS", DEFAULT_SCORERS)):
+        scorer = SCORER_FACTORIES[name](files)
+        if scorer is not None:
+            scorers.append((scorer, weight))
+    if not scorers:
+        scorers = [(density_score, 1.0)]
+    return CoreLogicRanker(scorers, top_n=int(os.getenv("CORE_LOGIC_TOP_N", str(DEFAULT_TOP_N))))
@@ -0,0 +1,112 @@
+# pipeline/edit_applier.py
+import ast
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from model_infer import ModelInfer
+
+_differ = ModelInfer()
+
+
+class LineIndex:
+    """Offsets of every line start in `text`, so a (line, col) pair maps to an offset in O(1).
+
+    Lines and columns are 1-based, as in the /edit contract. A column may point one
+    past the last character of its line (end of line) but not beyond.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        starts = [0]
+        pos = text.find("\n")
+        while pos != -1:
+            starts.append(pos + 1)
+            pos = text.find("\n", pos + 1)
+        self.starts = starts
+
+    def line_length(self, line: int) -> int:
+        start = self.starts[line - 1]
+        end = self.starts[line] - 1 if line < len(self.starts) else len(self.text)
+        return end - start
+
+    def offset(self, line: int, col: int) -> int:
+        """Absolute offset of (line, col); raises ValueError for coordinates outside the text."""
+        if line < 1 or line > len(self.starts):
+            raise ValueError(f"line {line} is outside 1..{len(self.starts)}")
+        length = self.line_length(line)
+        if col < 1 or col > length + 1:
+            raise ValueError(f"column {col} is outside 1..{length + 1} on line {line}")
+        return self.starts[line - 1] + col - 1
+
+
+def validate_source(file_path: str, text: str) -> Optional[Dict[str, Any]]:
+    """Syntax-check `text` for languages we can parse in-process; None when unsupported."""
+    lower = (file_path or "").lower()
+    if lower.endswith((".py", ".pyi")):
+        try:
+            ast.parse(text, filename=file_path or "<edit>")
+        except (SyntaxError, ValueError) as e:
+            detail = f"{e.msg} (line {e.lineno}, col {e.offset})" if isinstance(e, SyntaxError) else str(e)
+            return {"language": "python", "ok": False, "error": detail}
+        return {"language": "python", "ok": True}
+    if lower.endswith(".json"):
+        try:
+            json.loads(text)
+        except ValueError as e:
+            return {"language": "json", "ok": False, "error": str(e)}
+        return {"language": "json", "ok": True}
+    return None
+
+
+def apply_edits(current: str, edits: List[Dict[str, Any]], file_path: str = "") -> Dict[str, Any]:
+    """Apply normalized /edit edits to `current` in a single pass.
+
+    Edits whose coordinates fall outside the file, or that overlap an earlier edit, are
+    rejected (with the reason) instead of corrupting the result. Returns
+    {"patched", "diff", "applied", "rejected", "validation"}; `validation` is None for
+    languages we cannot check, otherwise {"language", "ok", "error"?, "introduced"}
+    where `introduced` means the original parsed and the patched text does not.
+    """
+    index = LineIndex(current)
+    spans: List[Tuple[int, int, int, Dict[str, Any]]] = []
+    rejected: List[Dict[str, Any]] = []
+    for position, edit in enumerate(edits):
+        try:
+            start = index.offset(edit["start_line"], edit["start_col"])
+            end = index.offset(edit["end_line"], edit["end_col"])
+        except ValueError as e:
+            rejected.append({"edit": edit, "reason": str(e)})
+            continue
+        if end < start:
+            rejected.append({"edit": edit, "reason": "end is before start"})
+            continue
+        spans.append((start, end, position, edit))
+
+    # Stable by start offset, so inserts at the same point keep the model's order
+    spans.sort(key=lambda s: (s[0], s[2]))
+    parts: List[str] = []
+    applied: List[Dict[str, Any]] = []
+    cursor = 0
+    for start, end, _, edit in spans:
+        if start < cursor:
+            rejected.append({"edit": edit, "reason": "overlaps a previous edit"})
+            continue
+        parts.append(current[cursor:start])
+        parts.append(edit["replacement"])
+        applied.append(edit)
+        cursor = end
+    parts.append(current[cursor:])
+    patched = "".join(parts)
+
+    validation = validate_source(file_path, patched) if applied else None
+    if validation is not None:
+        baseline = validate_source(file_path, current)
+        validation["introduced"] = not validation["ok"] and bool(baseline and baseline["ok"])
+
+    return {
+        "patched": patched,
+        "diff": _differ.diff_code(current, patched),
+        "applied": applied,
+        "rejected": rejected,
+        "validation": validation,
+    }
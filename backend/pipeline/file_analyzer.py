@@ -1,34 +1,36 @@
 # Add/replace these methods in your FileAnalyzer class file (pipeline/file_analyzer.py)
 
-import subprocess
 import textwrap
 import hashlib
 import time
 from collections import Counter
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import re
 import requests
 
 from dotenv import load_dotenv
 import os
 
+from code_compress import compress_code, language_for_label, line_locator
+from llm_cache import get_prompt_cache, is_ok_result, prompt_key, ttl_for
+from ollama_client import get_ollama_client
+from tracing import span
+from usage import record_groq_response
+
 # Load variables from .env into environment
 load_dotenv()
 
+# GROQ_API_BASE is the same variable langchain_groq's ChatGroq reads, so one override covers both
+GROQ_CHAT_URL = os.getenv("GROQ_API_BASE", "https://api.groq.com").rstrip("/") + "/openai/v1/chat/completions"
+
+
 class FileAnalyzer:
-    def _compress_code(self, code: str) -> str:
-        """Strip comments and excessive whitespace to save tokens."""
-        if not code: return ""
-        # Remove single line comments
-        code = re.sub(r'#.*$', '', code, flags=re.MULTILINE) # Python
-        code = re.sub(r'//.*$', '', code, flags=re.MULTILINE) # JS/TS
-        # Remove multi-line comments (simplified)
-        code = re.sub(r'\'\'\'(.*?)\'\'\'', '', code, flags=re.DOTALL)
-        code = re.sub(r'\"\"\"(.*?)\"\"\"', '', code, flags=re.DOTALL)
-        code = re.sub(r'/\*(.*?)\*/', '', code, flags=re.DOTALL)
-        # Remove excessive blank lines
-        lines = [l for l in code.splitlines() if l.strip()]
-        return "\n".join(lines)
+    def _compress_code(self, code: str, language: Optional[str] = None) -> str:
+        """Strip comments and excessive whitespace to save tokens.
+
+        `language` is an analysis label ("Python", ...); unknown languages get every common comment form stripped.
+        """
+        return compress_code(code, language_for_label(language))
 
     # ... existing methods ...
 
@@ -81,18 +83,19 @@ class FileAnalyzer:
         # extract simple functions & classes (best-effort)
         functions = []
         classes = []
+        line_of = line_locator(content)
         if language.startswith("Python"):
             for m in re.finditer(r'^def\s+([A-Za-z_]\w*)\s*\(([^)]*)\)\s*:', content, re.MULTILINE):
                 functions.append({
                     "name": m.group(1),
                     "signature": m.group(0).strip(),
-                    "line": content[:m.start()].count('\n') + 1
+                    "line": line_of(m.start())
                 })
             for m in re.finditer(r'^class\s+([A-Za-z_]\w*)\s*(\([^)]*\))?\s*:', content, re.MULTILINE):
                 classes.append({
                     "name": m.group(1),
                     "inherits": m.group(2).strip('()') if m.group(2) else None,
-                    "line": content[:m.start()].count('\n') + 1
+                    "line": line_of(m.start())
                 })
         else:
             # JS/TS heuristics
@@ -100,18 +103,18 @@ class FileAnalyzer:
                 functions.append({
                     "name": m.group(1),
                     "type": "function_declaration",
-                    "line": content[:m.start()].count('\n') + 1
+                    "line": line_of(m.start())
                 })
             for m in re.finditer(r'([A-Za-z_]\w*)\s*=\s*\([^)]*\)\s*=>', content):
                 functions.append({
                     "name": m.group(1),
                     "type": "arrow_function",
-                    "line": content[:m.start()].count('\n') + 1
+                    "line": line_of(m.start())
                 })
             for m in re.finditer(r'class\s+([A-Za-z_]\w*)', content):
                 classes.append({
                     "name": m.group(1),
-                    "line": content[:m.start()].count('\n') + 1
+                    "line": line_of(m.start())
                 })
 
         # imports & exports counts (heuristic)
@@ -242,7 +245,7 @@ class FileAnalyzer:
 
         code_block = ""
         if file_content:
-            compressed = self._compress_code(file_content)
+            compressed = self._compress_code(file_content, analysis.get('language'))
             snippet = compressed if len(compressed) <= max_content_chars else compressed[:max_content_chars] + "\n/* ...truncated... */"
             code_block = f"\n\n### Logic Snippets\n```\n{snippet}\n```"
 
@@ -279,90 +282,17 @@ class FileAnalyzer:
         --- CODE END ---
         """).strip()
 
-        # --- Step 2: Run Ollama ---
-        try:
-            process = subprocess.run(
-                ["ollama", "run", model],
-                input=prompt,
-                capture_output=True,
-                text=True,
-                timeout=timeout
-            )
-
-            if process.returncode != 0:
-                return {"ok": False, "error": process.stderr.strip() or f"Ollama exited with code {process.returncode}"}
-
-            return {"ok": True, "output": process.stdout.strip()}
-
-        except FileNotFoundError:
-            return {"ok": False, "error": "`ollama` CLI not found. Install Ollama or fix PATH."}
-        except subprocess.TimeoutExpired:
-            return {"ok": False, "error": f"Ollama model '{model}' timed out after {timeout}s."}
-        except Exception as e:
-            return {"ok": False, "error": f"Unexpected error: {e}"}
-
-# # Helper: example function to run Ollama via CLI
-# def call_ollama(prompt: str, model: str = "deepseek-coder:6.7b", timeout: int = 120) -> Dict[str, Any]:
-#     """
-#     Calls the local `ollama` CLI to run a model with the provided prompt.
-#     Returns a dict: {"ok": True, "output": "..."} or {"ok": False, "error": "..."}.
-
-#     NOTES:
-#     - This uses `ollama run <model> --prompt "<prompt>"`. Ensure `ollama` CLI is installed
-#       and you're authenticated/able to run the chosen model locally.
-#     - If you prefer the HTTP API, replace this implementation to POST to your local Ollama server.
-#     """
-#     try:
-#         # Make sure the prompt is a single string; avoid shell interpolation by passing arguments as list
-#         # We pass the prompt via stdin to avoid shell escaping issues.
-#         process = subprocess.run(
-#             ["ollama", "run", model, "--prompt", prompt],
-#             capture_output=True,
-#             text=True,
-#             timeout=timeout
-#         )
-#         if process.returncode != 0:
-#             return {"ok": False, "error": process.stderr.strip() or f"ollama exited {process.returncode}"}
-#         return {"ok": True, "output": process.stdout.strip()}
-#     except FileNotFoundError:
-#         return {"ok": False, "error": "`ollama` CLI not found. Install Ollama or use another execution method."}
-#     except subprocess.TimeoutExpired:
-#         return {"ok": False, "error": "Ollama call timed out."}
-#     except Exception as e:
-#         return {"ok": False, "error": str(e)}
+        # --- Step 2: Run Ollama (shared HTTP client; the model stays loaded between calls) ---
+        return get_ollama_client().generate(prompt, model=model, timeout=timeout)
 
 
 
 def call_ollama(prompt: str, model: str = "deepseek-coder:6.7b", timeout: int = 120) -> Dict[str, Any]:
     """
-    Calls the local Ollama model via CLI by piping the prompt to stdin.
-    Works with modern Ollama CLI versions (>= v0.1.29+).
+    Calls a local Ollama model. Kept for existing callers; this used to spawn
+    `ollama run` per request and now goes through the pooled HTTP client.
     """
-    import subprocess
-
-    try:
-        process = subprocess.run(
-            ["ollama", "run", model],
-            input=prompt,
-            capture_output=True,
-            text=True,
-            timeout=timeout
-        )
-
-        if process.returncode != 0:
-            return {
-                "ok": False,
-                "error": process.stderr.strip() or f"ollama exited {process.returncode}"
-            }
-
-        return {"ok": True, "output": process.stdout.strip()}
-
-    except FileNotFoundError:
-        return {"ok": False, "error": "`ollama` CLI not found. Install Ollama or update PATH."}
-    except subprocess.TimeoutExpired:
-        return {"ok": False, "error": "Ollama call timed out."}
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+    return call_ollama_http(prompt, model=model, timeout=timeout)
 
 
 import requests
@@ -403,42 +333,24 @@ def call_ollama_http(prompt: str, model: str = "tinyllama:1.1b", timeout: int =
     Returns:
         dict: { "ok": True, "output": "<text>" } or { "ok": False, "error": "<error message>" }
     """
-    try:
-        url = "http://127.0.0.1:11434/api/generate"
-        payload = {"model": model, "prompt": prompt}
+    def request_completion() -> Dict[str, Any]:
+        return get_ollama_client().generate(prompt, model=model, timeout=timeout)
 
+    # Ollama samples at its default temperature, so this is only cached with LLM_CACHE_SAMPLED=1
+    key = prompt_key(f"ollama:{model}", None, prompt)
+    return get_prompt_cache().get_or_call(key, request_completion, ttl_for(None), cacheable=is_ok_result)
 
-        print("payload", payload)
-        
-        # Streamed response from Ollama
-        with requests.post(url, json=payload, stream=True, timeout=timeout) as response:
-            response.raise_for_status()
 
-            output_lines = []
-            for line in response.iter_lines(decode_unicode=True):
-                if not line:
-                    continue
-                try:
-                    data = json.loads(line)
-                    if "response" in data:
-                        output_lines.append(data["response"])
-                except json.JSONDecodeError:
-                    continue
-
-            output = "".join(output_lines).strip()
-            return {"ok": True, "output": output or "No response content."}
-
-    except requests.exceptions.Timeout:
-        return {"ok": False, "error": f"Ollama request timed out after {timeout}s."}
-    except requests.exceptions.RequestException as e:
-        return {"ok": False, "error": f"Ollama HTTP error: {e}"}
-    except Exception as e:
-        return {"ok": False, "error": f"Unexpected error: {e}"}
+def call_ollama_stream(prompt: str, model: str = "tinyllama:1.1b", timeout: int = 180) -> Iterator[str]:
+    """
+    Streaming variant of `call_ollama_http`: yields text deltas as the local model
+    produces them. Raises RuntimeError on HTTP errors so callers can report them.
+    """
+    return get_ollama_client().generate_stream(prompt, model=model, timeout=timeout)
     
 
     
-
-def call_groq(prompt: str, model: str = "llama-3.3-70b-versatile", api_key: str = None, timeout: int = 120) -> Dict[str, Any]:
+def call_groq(prompt: str, model: str = "llama-3.3-70b-versatile", api_key: str = None, timeout: int = 120, max_tokens: int = 1500) -> Dict[str, Any]:
     """
     Calls the Groq API for text generation using the given model.
     
@@ -447,6 +359,7 @@ def call_groq(prompt: str, model: str = "llama-3.3-70b-versatile", api_key: str
         model (str): The Groq model to use (e.g., "llama3-70b", "mixtral-8x7b").
         api_key (str): Your Groq API key (if not provided, it should be set as an environment variable GROQ_API_KEY).
         timeout (int): Timeout for the API call in seconds.
+        max_tokens (int): Upper bound on generated tokens.
     
     Returns:
         dict: { "ok": True, "output": "<text>" } or { "ok": False, "error": "<error message>" }
@@ -458,7 +371,7 @@ def call_groq(prompt: str, model: str = "llama-3.3-70b-versatile", api_key: str
     if not api_key:
         return {"ok": False, "error": "Missing Groq API key. Set GROQ_API_KEY env variable or pass `api_key`."}
 
-    url = "https://api.groq.com/openai/v1/chat/completions"
+    url = GROQ_CHAT_URL
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -471,23 +384,83 @@ def call_groq(prompt: str, model: str = "llama-3.3-70b-versatile", api_key: str
             {"role": "user", "content": prompt}
         ],
         "temperature": 0.3,
-        "max_tokens": 1500
+        "max_tokens": max_tokens
     }
 
-    try:
-        response = requests.post(url, headers=headers, json=payload, timeout=timeout)
+    def request_completion() -> Dict[str, Any]:
+        try:
+            with span("call_groq"):
+                response = requests.post(url, headers=headers, json=payload, timeout=timeout)
+
+            if response.status_code != 200:
+                return {"ok": False, "error": f"Groq API error {response.status_code}: {response.text}"}
+
+            data = response.json()
+            record_groq_response(model, api_key, data, response.headers)
+            output = data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+            return {"ok": True, "output": output or "No response content."}
+
+        except requests.exceptions.Timeout:
+            return {"ok": False, "error": f"Groq API request timed out after {timeout}s."}
+        except Exception as e:
+            return {"ok": False, "error": f"Unexpected error: {e}"}
 
-        if response.status_code != 200:
-            return {"ok": False, "error": f"Groq API error {response.status_code}: {response.text}"}
+    # Identical prompts (same model/temperature/messages) are answered once and shared
+    key = prompt_key(model, payload["temperature"], payload["messages"], max_tokens=max_tokens)
+    return get_prompt_cache().get_or_call(key, request_completion, ttl_for(payload["temperature"]), cacheable=is_ok_result)
 
-        data = response.json()
-        output = data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
-        return {"ok": True, "output": output or "No response content."}
 
+def call_groq_stream(prompt: str, model: str = "llama-3.3-70b-versatile", api_key: str = None, timeout: int = 120, max_tokens: int = 1500) -> Iterator[str]:
+    """
+    Streaming variant of `call_groq`: yields text deltas as the provider produces them.
+
+    Uses the OpenAI-compatible `stream: true` mode (server-sent `data:` lines).
+    Raises RuntimeError on configuration or HTTP errors so callers can report them.
+    """
+    api_key = api_key or os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise RuntimeError("Missing Groq API key. Set GROQ_API_KEY env variable or pass `api_key`.")
+
+    url = GROQ_CHAT_URL
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "You are an expert software engineer and code reviewer."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.3,
+        "max_tokens": max_tokens,
+        "stream": True
+    }
+
+    try:
+        with requests.post(url, headers=headers, json=payload, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"Groq API error {response.status_code}: {response.text}")
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                    if (chunk.get("x_groq") or {}).get("usage"):
+                        # The final chunk carries the request's usage
+                        record_groq_response(model, api_key, chunk, response.headers)
+                    delta = chunk["choices"][0].get("delta", {}).get("content")
+                except (json.JSONDecodeError, KeyError, IndexError):
+                    continue
+                if delta:
+                    yield delta
     except requests.exceptions.Timeout:
-        return {"ok": False, "error": f"Groq API request timed out after {timeout}s."}
-    except Exception as e:
-        return {"ok": False, "error": f"Unexpected error: {e}"}
+        raise RuntimeError(f"Groq API request timed out after {timeout}s.")
+    except requests.exceptions.RequestException as e:
+        raise RuntimeError(f"Groq HTTP error: {e}")
 # ---------------------------
 # Usage example:
 # ---------------------------
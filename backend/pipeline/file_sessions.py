@@ -0,0 +1,304 @@
+# pipeline/file_sessions.py
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from state_backend import content_hash
+
+
+class PieceTable:
+    """Editable text stored as pieces over immutable strings (the upload plus inserted text).
+
+    An edit splits at most two pieces and never copies the document, and each piece
+    caches its newline count so (line, col) lookups walk pieces instead of characters.
+    The flat text is only built when asked for, and cached until the next edit.
+    """
+
+    COMPACT_PIECES = 512
+
+    def __init__(self, text: str = ""):
+        self._pieces: List[Tuple[str, int, int, int]] = [self._piece(text, 0, len(text))] if text else []
+        self.length = len(text)
+        self._text: Optional[str] = text
+
+    @staticmethod
+    def _piece(src: str, start: int, end: int) -> Tuple[str, int, int, int]:
+        return (src, start, end, src.count("\n", start, end))
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = "".join(src[a:b] for src, a, b, _ in self._pieces)
+        return self._text
+
+    def line_count(self) -> int:
+        return 1 + sum(p[3] for p in self._pieces)
+
+    def _line_start(self, line: int) -> Optional[int]:
+        """Offset where 1-based `line` starts, or None past the last line."""
+        if line == 1:
+            return 0
+        remaining = line - 1  # newlines to skip
+        pos = 0
+        for src, a, b, newlines in self._pieces:
+            if newlines < remaining:
+                remaining -= newlines
+                pos += b - a
+                continue
+            idx = a - 1
+            for _ in range(remaining):
+                idx = src.index("\n", idx + 1)
+            return pos + (idx - a) + 1
+        return None
+
+    def offset(self, line: int, col: int) -> int:
+        """Absolute offset of 1-based (line, col); raises ValueError outside the text."""
+        start = self._line_start(line) if line >= 1 else None
+        if start is None:
+            raise ValueError(f"line {line} is outside 1..{self.line_count()}")
+        next_start = self._line_start(line + 1)
+        length = (next_start - 1 if next_start is not None else self.length) - start
+        if col < 1 or col > length + 1:
+            raise ValueError(f"column {col} is outside 1..{length + 1} on line {line}")
+        return start + col - 1
+
+    def replace(self, start: int, end: int, text: str) -> None:
+        """Replace offsets [start, end) with `text`."""
+        if not 0 <= start <= end <= self.length:
+            raise ValueError(f"range {start}..{end} is outside 0..{self.length}")
+        before: List[Tuple[str, int, int, int]] = []
+        after: List[Tuple[str, int, int, int]] = []
+        pos = 0
+        for piece in self._pieces:
+            src, a, b, _ = piece
+            p_start, p_end = pos, pos + (b - a)
+            pos = p_end
+            if p_end <= start:
+                before.append(piece)
+            elif p_start >= end:
+                after.append(piece)
+            else:
+                if p_start < start:
+                    before.append(self._piece(src, a, a + (start - p_start)))
+                if p_end > end:
+                    after.append(self._piece(src, a + (end - p_start), b))
+        middle = [self._piece(text, 0, len(text))] if text else []
+        self._pieces = before + middle + after
+        self.length += len(text) - (end - start)
+        self._text = None
+        if len(self._pieces) > self.COMPACT_PIECES:
+            flat = self.text()
+            self._pieces = [self._piece(flat, 0, len(flat))] if flat else []
+
+    def snapshot(self) -> Tuple[List[Tuple[str, int, int, int]], int, Optional[str]]:
+        return (list(self._pieces), self.length, self._text)
+
+    def restore(self, state: Tuple[List[Tuple[str, int, int, int]], int, Optional[str]]) -> None:
+        self._pieces, self.length, self._text = list(state[0]), state[1], state[2]
+
+
+class FileSession:
+    """One uploaded file kept server-side so later requests only send deltas."""
+
+    def __init__(self, session_id: str, file_path: str, content: str, known_hash: Optional[str] = None):
+        self.session_id = session_id
+        self.file_path = file_path
+        self.table = PieceTable(content)
+        self._hash: Optional[str] = known_hash or content_hash(content)
+        self.last_access = time.time()
+        # Edits since the last snapshot written to the backend, as (offset, length, text)
+        self.log: List[Tuple[int, int, str]] = []
+        self.log_chars = 0
+        self.snapshot_id = ""
+        self.snapshot_at = 0.0
+
+    @property
+    def hash(self) -> str:
+        """Content hash, computed on first use after an edit rather than on every edit."""
+        if self._hash is None:
+            self._hash = content_hash(self.text())
+        return self._hash
+
+    def text(self) -> str:
+        return self.table.text()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"file_path": self.file_path, "content": self.text(), "hash": self.hash, "snapshot": self.snapshot_id}
+
+
+class FileSessionStore:
+    """LRU + TTL store of FileSessions with a global character cap.
+
+    Clients upload a file once (`create`) and afterwards send `deltas` against the
+    content hash they last saw (`apply_deltas`). A delta is
+    {"start_line", "start_col", "end_line", "end_col", "text"} (1-based, end exclusive,
+    like /edit edits) or {"offset", "length", "text"}; deltas apply in order, each
+    relative to the result of the previous one. With a shared `backend` any worker can
+    continue the session: a change writes only the deltas since the last full snapshot,
+    and a snapshot is taken once that log grows (FILE_SESSION_LOG_MAX entries or a quarter
+    of the file) or ages (FILE_SESSION_SNAPSHOT_SECONDS).
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 512,
+        ttl_seconds: int = 3600,
+        max_total_chars: int = 64_000_000,
+        backend: Optional[Any] = None,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_total_chars = max_total_chars
+        self.backend = backend
+        self._sessions: "OrderedDict[str, FileSession]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def create(self, file_path: str, content: str) -> FileSession:
+        session = FileSession(uuid.uuid4().hex, file_path, content)
+        with self._lock:
+            self._expire()
+            self._sessions[session.session_id] = session
+            self._enforce_caps(protect=session.session_id)
+        self._persist(session)
+        return session
+
+    def get(self, session_id: str, reload: bool = False) -> Optional[FileSession]:
+        """Session by id; `reload` re-reads the shared backend (another worker may have moved it on)."""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if (session is None or reload) and self.backend is not None:
+                stored = self.backend.load_session(f"file:{session_id}")
+                if stored is not None:
+                    session = self._restore(session_id, stored)
+                    self._sessions[session_id] = session
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session.last_access = time.time()
+            return session
+
+    def apply_deltas(
+        self,
+        session_id: str,
+        base_hash: Optional[str],
+        deltas: Optional[List[Dict[str, Any]]],
+        expected_hash: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Apply `deltas` to the session if it is still at `base_hash`.
+
+        Returns {"ok": True, "session": ...} or {"ok": False, "code", "error", "hash"?}
+        with code "unknown_session", "stale_base" or "bad_delta". When `expected_hash`
+        is given and the result does not match it, the session is left unchanged.
+        """
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                return {"ok": False, "code": "unknown_session", "error": "Unknown or expired file session; upload the file again."}
+            if base_hash and base_hash != session.hash and self.backend is not None:
+                session = self.get(session_id, reload=True) or session
+            if base_hash and base_hash != session.hash:
+                return {"ok": False, "code": "stale_base", "error": "base_hash does not match the server copy.", "hash": session.hash}
+            if not deltas:
+                return {"ok": True, "session": session}
+            if not isinstance(deltas, list):
+                return {"ok": False, "code": "bad_delta", "error": "deltas must be a list", "hash": session.hash}
+
+            old_hash = session.hash
+            state = session.table.snapshot()
+            applied: List[Tuple[int, int, str]] = []
+            try:
+                for delta in deltas:
+                    text = str(delta.get("text", ""))
+                    if "offset" in delta:
+                        start = int(delta["offset"])
+                        end = start + int(delta.get("length", 0))
+                    else:
+                        start = session.table.offset(int(delta["start_line"]), int(delta["start_col"]))
+                        end = session.table.offset(int(delta["end_line"]), int(delta["end_col"]))
+                    session.table.replace(start, end, text)
+                    applied.append((start, end - start, text))
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                session.table.restore(state)
+                return {"ok": False, "code": "bad_delta", "error": f"Invalid delta: {e}", "hash": old_hash}
+
+            session._hash = None
+            if expected_hash and expected_hash != session.hash:
+                session.table.restore(state)
+                session._hash = old_hash
+                return {"ok": False, "code": "stale_base", "error": "Deltas did not produce expected_hash.", "hash": old_hash}
+            session.log.extend(applied)
+            session.log_chars += sum(len(text) for _, _, text in applied)
+            self._enforce_caps(protect=session_id)
+        self._persist(session)
+        return {"ok": True, "session": session}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "total_chars": sum(s.table.length for s in self._sessions.values()),
+                "max_sessions": self.max_sessions,
+                "max_total_chars": self.max_total_chars,
+            }
+
+    def _persist(self, session: FileSession) -> None:
+        if self.backend is None:
+            return
+        try:
+            if self._needs_snapshot(session):
+                session.snapshot_id = uuid.uuid4().hex[:12]
+                session.snapshot_at = time.time()
+                session.log, session.log_chars = [], 0
+                self.backend.save_session(f"file:{session.session_id}", session.to_dict())
+            else:
+                # A log under an older snapshot id is ignored on load, so no need to clear it
+                self.backend.save_session(
+                    f"file:{session.session_id}:log",
+                    {"snapshot": session.snapshot_id, "deltas": [list(d) for d in session.log]},
+                )
+        except Exception as e:
+            print(f"Failed to persist file session {session.session_id}: {e}")
+
+    def _needs_snapshot(self, session: FileSession) -> bool:
+        if not session.snapshot_id:
+            return True
+        if len(session.log) >= int(os.getenv("FILE_SESSION_LOG_MAX", "64")):
+            return True
+        if session.log_chars > max(4096, session.table.length // 4):
+            return True
+        # Keep the snapshot row fresh for backends that expire idle rows
+        return time.time() - session.snapshot_at > float(os.getenv("FILE_SESSION_SNAPSHOT_SECONDS", "300"))
+
+    def _restore(self, session_id: str, stored: Dict[str, Any]) -> FileSession:
+        """Rebuild a session from its backend snapshot plus the delta log written after it."""
+        session = FileSession(session_id, stored.get("file_path", ""), stored.get("content", ""), stored.get("hash"))
+        session.snapshot_id = stored.get("snapshot", "")
+        session.snapshot_at = time.time()
+        log = self.backend.load_session(f"file:{session_id}:log") if session.snapshot_id else None
+        if log and log.get("snapshot") == session.snapshot_id and log.get("deltas"):
+            for offset, length, text in log["deltas"]:
+                session.table.replace(offset, offset + length, text)
+                session.log.append((offset, length, text))
+                session.log_chars += len(text)
+            session._hash = None
+        return session
+
+    def _expire(self) -> None:
+        if not self.ttl_seconds:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if oldest.last_access >= cutoff:
+                break
+            del self._sessions[oldest_id]
+
+    def _enforce_caps(self, protect: Optional[str] = None) -> None:
+        total = sum(s.table.length for s in self._sessions.values())
+        while self._sessions and (len(self._sessions) > self.max_sessions or total > self.max_total_chars):
+            oldest_id = next(iter(self._sessions))
+            if oldest_id == protect:
+                break
+            total -= self._sessions.pop(oldest_id).table.length
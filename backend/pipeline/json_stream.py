@@ -0,0 +1,97 @@
+# pipeline/json_stream.py
+import json
+from typing import Any, Dict, List, Optional
+
+
+class IncrementalArrayParser:
+    """Pull complete elements out of `{"<key>": [ {...}, {...} ]}` while the JSON is still arriving.
+
+    Feed text chunks as the model streams them; `feed` returns every object of the
+    target array whose closing brace has arrived, already decoded. Each character is
+    scanned once and only the element being built is buffered, so a long response
+    costs O(n) overall. Text before the first `{` (prose, a code fence) is skipped.
+    """
+
+    def __init__(self, key: str = "edits"):
+        self.key = key
+        self.errors: List[str] = []
+        self._chunks: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_parts: Optional[List[str]] = None  # only top-level strings (keys) are kept
+        self._last_string: Optional[str] = None
+        self._array_depth: Optional[int] = None  # depth of elements inside the target array
+        self._array_done = False
+        self._element_parts: Optional[List[str]] = None
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far, for a final whole-document parse."""
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        if not chunk:
+            return []
+        self._chunks.append(chunk)
+        completed: List[Dict[str, Any]] = []
+        element_start = 0 if self._element_parts is not None else -1
+        string_start = 0 if self._string_parts is not None else -1
+
+        for idx, ch in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._string_parts is not None:
+                        self._string_parts.append(chunk[string_start:idx])
+                        self._last_string = "".join(self._string_parts)
+                        self._string_parts = None
+                        string_start = -1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._string_parts = []
+                    string_start = idx + 1
+            elif ch == "{" or ch == "[":
+                if (
+                    ch == "["
+                    and self._depth == 1
+                    and self._array_depth is None
+                    and not self._array_done
+                    and self._last_string == self.key
+                ):
+                    self._array_depth = self._depth + 1
+                elif ch == "{" and self._array_depth is not None and self._depth == self._array_depth:
+                    self._element_parts = []
+                    element_start = idx
+                self._depth += 1
+            elif ch == "}" or ch == "]":
+                self._depth -= 1
+                if ch == "}" and self._element_parts is not None and self._depth == self._array_depth:
+                    self._element_parts.append(chunk[element_start:idx + 1])
+                    raw = "".join(self._element_parts)
+                    self._element_parts = None
+                    element_start = -1
+                    try:
+                        obj = json.loads(raw)
+                    except ValueError as exc:
+                        self.errors.append(f"element_json_error: {exc}")
+                        continue
+                    if isinstance(obj, dict):
+                        completed.append(obj)
+                elif ch == "]" and self._array_depth is not None and self._depth == self._array_depth - 1:
+                    self._array_depth = None
+                    self._array_done = True
+
+        # Carry partial element / key text over to the next chunk
+        if self._element_parts is not None and element_start >= 0:
+            self._element_parts.append(chunk[element_start:])
+        if self._string_parts is not None and string_start >= 0:
+            self._string_parts.append(chunk[string_start:])
+        return completed
@@ -0,0 +1,214 @@
+# pipeline/llm_batcher.py
+import asyncio
+import contextvars
+import os
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from usage import current_scope, shared_usage
+
+_SECTION_PATTERNS: Dict[str, "re.Pattern[str]"] = {}
+
+
+def _section_pattern(label: str) -> "re.Pattern[str]":
+    pattern = _SECTION_PATTERNS.get(label)
+    if pattern is None:
+        pattern = _SECTION_PATTERNS[label] = re.compile(
+            rf'^=== {re.escape(label)}(?:-([0-9a-f]+))?: (.+?) ===[ \t]*$', re.MULTILINE
+        )
+    return pattern
+
+
+def new_nonce() -> str:
+    """Per-batch marker tag, so packed content cannot forge or guess another item's marker."""
+    return secrets.token_hex(4)
+
+
+def _marker_label(label: str, nonce: str) -> str:
+    return f"{label}-{nonce}" if nonce else label
+
+
+def pack_sections(header: str, sections: List[Tuple[str, str]], label: str = "FILE", id_name: str = "path", nonce: str = "") -> str:
+    """Build one prompt holding several independent items, each under a `=== LABEL-nonce: id ===` line."""
+    marker = _marker_label(label, nonce)
+    body = "\n\n".join(f"=== {marker}: {name} ===\n{text}" for name, text in sections)
+    noun = label.lower()
+    return (
+        f"{header}\n\n"
+        f"Answer each {noun} independently. Start every answer with the exact line "
+        f"`=== {marker}: <{id_name}> ===` using the same {id_name}, in the same order, and nothing before the first one.\n\n"
+        f"{body}"
+    )
+
+
+def split_sections(text: str, label: str = "FILE", nonce: str = "") -> Dict[str, str]:
+    """Inverse of pack_sections: map each `=== LABEL-nonce: id ===` marker to the text that follows it.
+
+    Marker-like lines with another (or no) nonce are not boundaries; they stay part of the
+    surrounding section, so an item echoing a forged marker cannot fill in another item.
+    """
+    sections: Dict[str, str] = {}
+    text = text or ""
+    matches = [m for m in _section_pattern(label).finditer(text) if (m.group(1) or "") == nonce]
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        sections[m.group(2).strip().strip('`')] = text[m.end():end].strip()
+    return sections
+
+
+class _Item:
+    __slots__ = ("prompt", "future", "context", "scope")
+
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.future: Future = Future()
+        # A shared batch runs (spans, profiling) in its first item's context; its usage is
+        # split across every item's request scope by prompt length
+        self.context = contextvars.copy_context()
+        self.scope = current_scope()
+
+
+class MicroBatcher:
+    """Coalesce small prompts to one model into shared multi-part requests.
+
+    `submit` queues a prompt; a dispatcher thread waits up to `window_ms` after the first
+    queued item (or until `max_items` / `max_chars` is reached), packs the items with
+    `pack_sections` under a fresh nonce, sends one request and splits the answer back per item. Items the
+    model dropped are retried on their own, so callers always get their own answer.
+    `send(prompt, max_tokens)` must return the usual {"ok", "output"/"error"} dict.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, int], Dict[str, Any]],
+        header: str = "Answer each of the following independent requests.",
+        window_ms: float = 20,
+        max_items: int = 6,
+        max_chars: int = 12000,
+        small_chars: int = 3000,
+        tokens_per_item: int = 700,
+        max_tokens: int = 8000,
+        single_max_tokens: int = 1500,
+        workers: int = 4,
+        enabled: bool = True,
+    ):
+        self.send = send
+        self.enabled = enabled
+        self.header = header
+        self.window = window_ms / 1000.0
+        self.max_items = max_items
+        self.max_chars = max_chars
+        self.small_chars = small_chars
+        self.tokens_per_item = tokens_per_item
+        self.max_tokens = max_tokens
+        self.single_max_tokens = single_max_tokens
+        self.batches_sent = 0
+        self.items_batched = 0
+        self._queue: List[_Item] = []
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-batch")
+        threading.Thread(target=self._dispatch_loop, name="llm-batcher", daemon=True).start()
+
+    def submit_future(self, prompt: str) -> Future:
+        if not self.enabled or len(prompt) > self.small_chars:
+            # Large prompts gain nothing from sharing a request
+            return self._pool.submit(contextvars.copy_context().run, self.send, prompt, self.single_max_tokens)
+        item = _Item(prompt)
+        with self._cond:
+            self._queue.append(item)
+            self._cond.notify()
+        return item.future
+
+    def submit(self, prompt: str) -> Dict[str, Any]:
+        return self.submit_future(prompt).result()
+
+    async def asubmit(self, prompt: str) -> Dict[str, Any]:
+        return await asyncio.wrap_future(self.submit_future(prompt))
+
+    def _take_batch(self) -> List[_Item]:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = time.monotonic() + self.window
+            while len(self._queue) < self.max_items and sum(len(i.prompt) for i in self._queue) < self.max_chars:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch: List[_Item] = []
+            chars = 0
+            while self._queue and len(batch) < self.max_items:
+                if batch and chars + len(self._queue[0].prompt) > self.max_chars:
+                    break
+                item = self._queue.pop(0)
+                batch.append(item)
+                chars += len(item.prompt)
+            return batch
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            batch = self._take_batch()
+            self._pool.submit(batch[0].context.run, self._run_batch, batch)
+
+    def _run_batch(self, batch: List[_Item]) -> None:
+        try:
+            if len(batch) == 1:
+                batch[0].future.set_result(self.send(batch[0].prompt, self.single_max_tokens))
+                return
+
+            ids = [str(i + 1) for i in range(len(batch))]
+            nonce = new_nonce()
+            prompt = pack_sections(self.header, list(zip(ids, (item.prompt for item in batch))), label="ITEM", id_name="id", nonce=nonce)
+            with shared_usage([(item.scope, len(item.prompt)) for item in batch]):
+                result = self.send(prompt, min(self.max_tokens, self.tokens_per_item * len(batch)))
+            self.batches_sent += 1
+            self.items_batched += len(batch)
+            if not result.get("ok"):
+                for item in batch:
+                    item.future.set_result(result)
+                return
+
+            sections = split_sections(result["output"], label="ITEM", nonce=nonce)
+            for item_id, item in zip(ids, batch):
+                if sections.get(item_id):
+                    item.future.set_result({"ok": True, "output": sections[item_id], "batched": True})
+                else:
+                    # The model dropped or mangled this section; ask again on its own
+                    item.future.set_result(self.send(item.prompt, self.single_max_tokens))
+        except Exception as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+
+
+_batchers: Dict[Tuple[str, str], MicroBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def batching_enabled() -> bool:
+    return os.getenv("LLM_BATCH_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+
+
+def get_batcher(model: str, header: str = "Review each of the following files.") -> MicroBatcher:
+    """Shared batcher for small Groq prompts to `model` (LLM_BATCH_WINDOW_MS, LLM_BATCH_MAX_ITEMS)."""
+    with _batchers_lock:
+        batcher = _batchers.get((model, header))
+        if batcher is None:
+            from file_analyzer import call_groq
+
+            batcher = _batchers[(model, header)] = MicroBatcher(
+                send=lambda prompt, max_tokens: call_groq(prompt, model=model, max_tokens=max_tokens),
+                header=header,
+                window_ms=float(os.getenv("LLM_BATCH_WINDOW_MS", "20")),
+                max_items=int(os.getenv("LLM_BATCH_MAX_ITEMS", "6")),
+                max_chars=int(os.getenv("LLM_BATCH_MAX_CHARS", "12000")),
+                small_chars=int(os.getenv("LLM_BATCH_SMALL_CHARS", "3000")),
+                workers=int(os.getenv("LLM_BATCH_WORKERS", "16")),
+                enabled=batching_enabled(),
+            )
+        return batcher
@@ -0,0 +1,365 @@
+# pipeline/llm_cache.py
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from state_backend import compress_text, decompress_text
+from tracing import record_cache
+from usage import record_message_usage
+
+_MISS = object()
+
+
+def _normalize_messages(messages: Any) -> List[Dict[str, str]]:
+    """Plain prompts, OpenAI-style dicts and LangChain messages all hash the same way."""
+    if isinstance(messages, str):
+        return [{"role": "human", "content": messages}]
+    normalized = []
+    for m in messages:
+        if isinstance(m, dict):
+            role = {"user": "human", "assistant": "ai"}.get(m.get("role"), m.get("role"))
+            normalized.append({"role": str(role), "content": str(m.get("content", ""))})
+        elif isinstance(m, (tuple, list)):
+            normalized.append({"role": str(m[0]), "content": str(m[1])})
+        else:
+            normalized.append({"role": str(getattr(m, "type", "human")), "content": str(getattr(m, "content", m))})
+    return normalized
+
+
+def prompt_key(model: str, temperature: Optional[float], messages: Any, **params: Any) -> str:
+    """Cache key for one completion: model, temperature, messages and any output-shaping params."""
+    material = {
+        "model": model,
+        "temperature": temperature,
+        "messages": _normalize_messages(messages),
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def ttl_for(temperature: Optional[float]) -> float:
+    """Cache lifetime for a completion at `temperature`; 0 means do not cache it.
+
+    Only deterministic (temperature-0) completions are cached by default: replaying a
+    sampled answer would make every retry of a chat return the same text. Set
+    LLM_CACHE_SAMPLED=1 to cache sampled completions too, for LLM_CACHE_TTL seconds.
+    """
+    if temperature is not None and float(temperature) == 0:
+        return float(os.getenv("LLM_CACHE_TTL_DETERMINISTIC", str(30 * 24 * 3600)))
+    if os.getenv("LLM_CACHE_SAMPLED", "0").strip().lower() not in ("1", "true", "yes"):
+        return 0.0
+    return float(os.getenv("LLM_CACHE_TTL", "3600"))
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class PromptCache:
+    """Response cache in front of model calls, with single-flight coalescing.
+
+    Identical concurrent requests share one upstream call: the first caller runs it and
+    the rest wait for its result. Successful results are kept in an LRU with per-entry
+    TTL and, when `path` is set, in a SQLite table (compressed) that outlives restarts
+    and is shared by every worker on the host. Errors are never cached.
+    """
+
+    def __init__(self, max_entries: int = 2048, path: Optional[str] = None, max_rows: int = 50000, enabled: bool = True):
+        self.max_entries = max_entries
+        self.path = path
+        self.max_rows = max_rows
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self._ainflight: Dict[Tuple[int, str], "asyncio.Future"] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._puts = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn().execute(
+                "CREATE TABLE IF NOT EXISTS prompt_cache "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ------------------------------------------------------------------ lookups
+
+    def get(self, key: str) -> Any:
+        """Cached value for `key`, or the module-level `_MISS` sentinel."""
+        now = time.time()
+        with self._lock:
+            value = self._get_memory(key, now)
+        if value is not _MISS:
+            record_cache("prompt", "hit")
+            return value
+
+        value = self._read_disk(key, now)
+        with self._lock:
+            if value is _MISS:
+                self.misses += 1
+            else:
+                self.hits += 1
+        record_cache("prompt", "miss" if value is _MISS else "hit")
+        return value
+
+    def put(self, key: str, value: Any, ttl: float) -> None:
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._store(key, value, expires_at)
+            self._puts += 1
+            prune = self._puts % 256 == 0
+        self._write_disk(key, value, expires_at, prune)
+
+    def _get_memory(self, key: str, now: float) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISS
+        expires_at, value = entry
+        if expires_at < now:
+            del self._entries[key]
+            return _MISS
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def _store(self, key: str, value: Any, expires_at: float) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, key: str, now: float) -> Any:
+        if not self.path:
+            return _MISS
+        try:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM prompt_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if not row or row[1] < now:
+                return _MISS
+            value = json.loads(decompress_text(row[0]))
+        except Exception as e:
+            print(f"Ignoring unreadable prompt cache entry {key}: {e}")
+            return _MISS
+        with self._lock:
+            self._store(key, value, row[1])
+        return value
+
+    def _write_disk(self, key: str, value: Any, expires_at: float, prune: bool) -> None:
+        if not self.path:
+            return
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO prompt_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, compress_text(json.dumps(value)), expires_at),
+            )
+            if prune:
+                conn.execute("DELETE FROM prompt_cache WHERE expires_at < ?", (time.time(),))
+                conn.execute(
+                    "DELETE FROM prompt_cache WHERE key IN ("
+                    "SELECT key FROM prompt_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                )
+        except Exception as e:
+            print(f"Failed to write prompt cache entry {key}: {e}")
+
+    # ------------------------------------------------------------- single-flight
+
+    def get_or_call(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        ttl: float,
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Return the cached value for `key`, or run `fn` once for all concurrent callers.
+
+        A `ttl` of 0 (see ttl_for) bypasses the cache and the coalescing entirely.
+        """
+        if not self.enabled or ttl <= 0:
+            return fn()
+        value = self.get(key)
+        if value is not _MISS:
+            return value
+
+        with self._lock:
+            value = self._get_memory(key, time.time())
+            if value is not _MISS:
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            record_cache("prompt", "coalesced")
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = fn()
+            if cacheable is None or cacheable(flight.value):
+                self.put(key, flight.value, ttl)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    async def aget_or_call(
+        self,
+        key: str,
+        coro_factory: Callable[[], Awaitable[Any]],
+        ttl: float,
+        cacheable: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Async variant of get_or_call; coalesces callers on the same event loop."""
+        if not self.enabled or ttl <= 0:
+            return await coro_factory()
+        value = self.get(key)
+        if value is not _MISS:
+            return value
+
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        pending = self._ainflight.get(flight_key)
+        if pending is not None:
+            self.coalesced += 1
+            record_cache("prompt", "coalesced")
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The leader was cancelled (its client went away), not us: try again
+                return await self.aget_or_call(key, coro_factory, ttl, cacheable)
+
+        future = loop.create_future()
+        self._ainflight[flight_key] = future
+        try:
+            value = await coro_factory()
+            if cacheable is None or cacheable(value):
+                self.put(key, value, ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody was waiting
+            raise
+        finally:
+            self._ainflight.pop(flight_key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "persistent": bool(self.path),
+            }
+
+
+def _llm_identity(llm: Any) -> Tuple[str, Optional[float]]:
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or ""
+    return f"{type(llm).__name__}:{model}", getattr(llm, "temperature", None)
+
+
+def _llm_api_key(llm: Any) -> Optional[str]:
+    for attr in ("groq_api_key", "google_api_key", "api_key"):
+        value = getattr(llm, attr, None)
+        if value is not None:
+            return value.get_secret_value() if hasattr(value, "get_secret_value") else str(value)
+    return None
+
+
+def _content(output: Any) -> str:
+    return output.content if hasattr(output, "content") else str(output)
+
+
+def record_llm_usage(llm: Any, output: Any) -> None:
+    """Feed a LangChain response's usage_metadata to the usage ledger."""
+    provider = type(llm).__name__.replace("Chat", "").lower() or "langchain"
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or ""
+    record_message_usage(provider, str(model), _llm_api_key(llm), output)
+
+
+def _invoke(llm: Any, messages: Any) -> str:
+    output = llm.invoke(messages)
+    record_llm_usage(llm, output)
+    return _content(output)
+
+
+def invoke_cached(llm: Any, messages: Any) -> str:
+    """`llm.invoke(messages)` through the prompt cache; returns the text content."""
+    model, temperature = _llm_identity(llm)
+    key = prompt_key(model, temperature, messages)
+    return get_prompt_cache().get_or_call(key, lambda: _invoke(llm, messages), ttl_for(temperature))
+
+
+async def ainvoke_cached(llm: Any, messages: Any) -> str:
+    """Async twin of invoke_cached."""
+    model, temperature = _llm_identity(llm)
+    key = prompt_key(model, temperature, messages)
+
+    async def call() -> str:
+        output = await llm.ainvoke(messages)
+        record_llm_usage(llm, output)
+        return _content(output)
+
+    return await get_prompt_cache().aget_or_call(key, call, ttl_for(temperature))
+
+
+def is_ok_result(result: Any) -> bool:
+    """Cache policy for the `{"ok": ..., "output"/"error": ...}` helpers."""
+    return isinstance(result, dict) and bool(result.get("ok"))
+
+
+_prompt_cache: Optional[PromptCache] = None
+_prompt_cache_lock = threading.Lock()
+
+
+def get_prompt_cache() -> PromptCache:
+    """Process-wide cache configured by LLM_CACHE_ENABLED, LLM_CACHE_SIZE and LLM_CACHE_PATH."""
+    global _prompt_cache
+    with _prompt_cache_lock:
+        if _prompt_cache is None:
+            _prompt_cache = PromptCache(
+                max_entries=int(os.getenv("LLM_CACHE_SIZE", "2048")),
+                path=os.getenv("LLM_CACHE_PATH") or None,
+                max_rows=int(os.getenv("LLM_CACHE_MAX_ROWS", "50000")),
+                enabled=os.getenv("LLM_CACHE_ENABLED", "1").strip().lower() not in ("0", "false", "no"),
+            )
+        return _prompt_cache
@@ -0,0 +1,605 @@
+# pipeline/model_providers.py
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import requests
+
+from llm_cache import get_prompt_cache, is_ok_result, prompt_key, ttl_for
+from ollama_client import get_ollama_client
+from tracing import record_retry, span
+from usage import record_groq_response, record_message_usage, record_usage
+
+Messages = List[Dict[str, str]]
+
+
+def _prompt_text(messages: Messages) -> str:
+    """Flatten chat messages for completion-style APIs (Ollama generate, HF inference)."""
+    if len(messages) == 1:
+        return messages[0]["content"]
+    return "\n\n".join(m["content"] for m in messages)
+
+
+class ProviderStats:
+    """Rolling latency window and error counters for one provider."""
+
+    def __init__(self, window: int = 200):
+        self.latencies: "deque[float]" = deque(maxlen=window)
+        self.successes = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self.latencies.append(latency)
+                self.successes += 1
+                self.consecutive_failures = 0
+                return
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= int(os.getenv("PROVIDER_FAILURE_THRESHOLD", "3")):
+                # Stop preferring a provider that keeps failing; it is retried after the cooldown
+                self.cooldown_until = time.time() + float(os.getenv("PROVIDER_COOLDOWN", "30"))
+
+    def healthy(self) -> bool:
+        return time.time() >= self.cooldown_until
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "successes": self.successes,
+            "errors": self.errors,
+            "consecutive_failures": self.consecutive_failures,
+            "healthy": self.healthy(),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+def gemini_overrides() -> Dict[str, Any]:
+    """Extra ChatGoogleGenerativeAI kwargs; GEMINI_API_BASE points it at another endpoint (e.g. a stub)."""
+    base = os.getenv("GEMINI_API_BASE")
+    return {"base_url": base} if base else {}
+
+
+class ChatModelUnavailable(NotImplementedError):
+    """The provider has no LangChain chat model (wiki generation skips such providers)."""
+
+
+class ModelProvider(ABC):
+    """One configured model endpoint. `complete` returns the text or raises."""
+
+    kind = "base"
+
+    def __init__(self, name: str, model: str, api_key: str = ""):
+        self.name = name
+        self.model = model
+        self.api_key = api_key
+        self.stats = ProviderStats()
+
+    @abstractmethod
+    def complete(self, messages: Messages, temperature: float, max_tokens: Optional[int], timeout: float, json_mode: bool = False) -> str:
+        ...
+
+    async def acomplete(self, messages: Messages, temperature: float, max_tokens: Optional[int], timeout: float, json_mode: bool = False) -> str:
+        return await asyncio.to_thread(self.complete, messages, temperature, max_tokens, timeout, json_mode)
+
+    def stream(self, messages: Messages, temperature: float, max_tokens: Optional[int], timeout: float, json_mode: bool = False) -> Iterator[str]:
+        """Yield text deltas. Providers without native streaming yield the whole answer once."""
+        yield self.complete(messages, temperature, max_tokens, timeout, json_mode)
+
+    async def astream(self, messages: Messages, temperature: float, max_tokens: Optional[int], timeout: float, json_mode: bool = False) -> AsyncIterator[str]:
+        """Async twin of stream; defaults to the whole `acomplete` answer as one delta."""
+        yield await self.acomplete(messages, temperature, max_tokens, timeout, json_mode)
+
+    def chat_model(self, temperature: float):
+        """LangChain chat model for chains that need one (wiki generation)."""
+        raise ChatModelUnavailable(f"{self.kind} provider has no LangChain chat model")
+
+
+class GroqProvider(ModelProvider):
+    kind = "groq"
+    url = os.getenv("GROQ_API_BASE", "https://api.groq.com").rstrip("/") + "/openai/v1/chat/completions"
+
+    def _payload(self, messages: Messages, temperature: float, max_tokens: Optional[int], json_mode: bool, stream: bool = False) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"model": self.model, "messages": messages, "temperature": temperature}
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    def _content(self, data: Dict[str, Any], headers: Any = None) -> str:
+        record_groq_response(self.model, self.api_key, data, headers)
+        return data["choices"][0]["message"]["content"]
+
+    def complete(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        resp = requests.post(self.url, headers=self._headers(), json=self._payload(messages, temperature, max_tokens, json_mode), timeout=timeout)
+        if resp.status_code != 200:
+            raise RuntimeError(f"Groq API error {resp.status_code}: {resp.text}")
+        return self._content(resp.json(), resp.headers)
+
+    async def acomplete(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        # Reuse the ASGI app's pooled client; imported lazily so Flask does not need httpx
+        from async_clients import get_client
+
+        resp = await get_client().post(self.url, headers=self._headers(), json=self._payload(messages, temperature, max_tokens, json_mode), timeout=timeout)
+        if resp.status_code != 200:
+            raise RuntimeError(f"Groq API error {resp.status_code}: {resp.text}")
+        return self._content(resp.json(), resp.headers)
+
+    def stream(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        payload = self._payload(messages, temperature, max_tokens, json_mode, stream=True)
+        with requests.post(self.url, headers=self._headers(), json=payload, stream=True, timeout=timeout) as resp:
+            if resp.status_code != 200:
+                raise RuntimeError(f"Groq API error {resp.status_code}: {resp.text}")
+            for line in resp.iter_lines(decode_unicode=True):
+                if line and line.startswith("data:") and line[len("data:"):].strip() == "[DONE]":
+                    break
+                delta = self._stream_delta(line, resp.headers)
+                if delta:
+                    yield delta
+
+    async def astream(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        from async_clients import get_client
+
+        payload = self._payload(messages, temperature, max_tokens, json_mode, stream=True)
+        async with get_client().stream("POST", self.url, headers=self._headers(), json=payload, timeout=timeout) as resp:
+            if resp.status_code != 200:
+                body = await resp.aread()
+                raise RuntimeError(f"Groq API error {resp.status_code}: {body.decode(errors='ignore')}")
+            async for line in resp.aiter_lines():
+                if line and line.startswith("data:") and line[len("data:"):].strip() == "[DONE]":
+                    break
+                delta = self._stream_delta(line, resp.headers)
+                if delta:
+                    yield delta
+
+    def _stream_delta(self, line: str, headers: Any) -> Optional[str]:
+        """Text of one server-sent `data:` line, or None for keep-alives and malformed chunks."""
+        if not line or not line.startswith("data:"):
+            return None
+        try:
+            chunk = json.loads(line[len("data:"):].strip())
+            if (chunk.get("x_groq") or {}).get("usage"):
+                # The final chunk carries the request's usage
+                record_groq_response(self.model, self.api_key, chunk, headers)
+            return chunk["choices"][0].get("delta", {}).get("content")
+        except (json.JSONDecodeError, KeyError, IndexError, AttributeError):
+            return None
+
+    def chat_model(self, temperature):
+        from langchain_groq import ChatGroq
+
+        return ChatGroq(model_name=self.model, groq_api_key=self.api_key, temperature=temperature)
+
+
+class GeminiProvider(ModelProvider):
+    kind = "gemini"
+
+    def complete(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        output = self.chat_model(temperature, json_mode).invoke([(m["role"], m["content"]) for m in messages])
+        record_message_usage(self.kind, self.model, self.api_key, output)
+        return output.content
+
+    async def acomplete(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        output = await self.chat_model(temperature, json_mode).ainvoke([(m["role"], m["content"]) for m in messages])
+        record_message_usage(self.kind, self.model, self.api_key, output)
+        return output.content
+
+    def stream(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        for chunk in self.chat_model(temperature, json_mode).stream([(m["role"], m["content"]) for m in messages]):
+            if chunk.content:
+                yield chunk.content
+
+    async def astream(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        async for chunk in self.chat_model(temperature, json_mode).astream([(m["role"], m["content"]) for m in messages]):
+            if chunk.content:
+                yield chunk.content
+
+    def chat_model(self, temperature, json_mode=False):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        extra = {"response_mime_type": "application/json"} if json_mode else {}
+        return ChatGoogleGenerativeAI(model=self.model, google_api_key=self.api_key, temperature=temperature, **gemini_overrides(), **extra)
+
+
+class OpenAIProvider(ModelProvider):
+    kind = "openai"
+
+    def __init__(self, name: str, model: str, api_key: str, base_url: str):
+        super().__init__(name, model, api_key)
+        self.base_url = base_url
+
+    def complete(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        payload: Dict[str, Any] = {"model": self.model, "input": _prompt_text(messages), "temperature": temperature}
+        if json_mode:
+            payload["text"] = {"format": {"type": "json_object"}}
+        resp = requests.post(f"{self.base_url}/responses", headers=headers, json=payload, timeout=timeout)
+        resp.raise_for_status()
+        data = resp.json()
+        usage = data.get("usage") or {}
+        record_usage(self.kind, self.model, self.api_key, usage.get("input_tokens"), usage.get("output_tokens"))
+        # Responses API returns { output: [{content:[{type:'output_text', text:'...'}]}] }
+        try:
+            text = data["output"][0]["content"][0]["text"]
+            if isinstance(text, str):
+                return text
+        except (KeyError, IndexError, TypeError):
+            pass
+        return json.dumps(data)
+
+
+class OllamaProvider(ModelProvider):
+    """Local model through the shared, concurrency-capped OllamaClient."""
+
+    kind = "ollama"
+
+    def _options(self, temperature: float, max_tokens: Optional[int]) -> Dict[str, Any]:
+        options: Dict[str, Any] = {"temperature": temperature}
+        if max_tokens:
+            options["num_predict"] = max_tokens
+        return options
+
+    def complete(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        result = get_ollama_client().generate(
+            _prompt_text(messages), model=self.model, timeout=timeout,
+            options=self._options(temperature, max_tokens), fmt="json" if json_mode else None,
+        )
+        if not result["ok"]:
+            raise RuntimeError(result["error"])
+        return result["output"]
+
+    def stream(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        yield from get_ollama_client().generate_stream(
+            _prompt_text(messages), model=self.model, timeout=timeout,
+            options=self._options(temperature, max_tokens), fmt="json" if json_mode else None,
+        )
+
+
+class HFProvider(ModelProvider):
+    kind = "hf"
+    # Model id is appended; point HF_API_URL at a dedicated endpoint or a local stub if needed
+    url = os.getenv("HF_API_URL", "https://api-inference.huggingface.co/models").rstrip("/")
+
+    def complete(self, messages, temperature, max_tokens, timeout, json_mode=False):
+        # The inference API has no JSON mode; the prompt's format instructions carry it
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        payload = {"inputs": _prompt_text(messages), "parameters": {"temperature": temperature}}
+        resp = requests.post(f"{self.url}/{self.model}", headers=headers, json=payload, timeout=timeout)
+        resp.raise_for_status()
+        data = resp.json()
+        # Some HF models return a simple string; others return list of dicts
+        if isinstance(data, list) and data and isinstance(data[0], dict) and "generated_text" in data[0]:
+            return data[0]["generated_text"]
+        if isinstance(data, dict) and "generated_text" in data:
+            return str(data["generated_text"])
+        return json.dumps(data)
+
+
+class ProviderRegistry:
+    """All configured model providers, with failover and optional hedging.
+
+    `complete` tries providers in the requested order, skipping ones that are cooling
+    down after repeated failures. With `hedge=True`, if the current provider has not
+    answered within its own p95 latency, the next one is fired too and the first
+    successful answer wins. Results use the repo's `{"ok", "output"/"error"}` shape
+    plus the name of the provider that answered.
+    """
+
+    def __init__(self, max_workers: int = 32):
+        self._providers: Dict[str, ModelProvider] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider")
+
+    def register(self, provider: ModelProvider) -> None:
+        self._providers[provider.name] = provider
+
+    def get(self, name: str) -> Optional[ModelProvider]:
+        return self._providers.get(name)
+
+    def by_kind(self, kind: str) -> List[ModelProvider]:
+        return [p for p in self._providers.values() if p.kind == kind]
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: {"kind": p.kind, "model": p.model, **p.stats.snapshot()} for name, p in self._providers.items()}
+
+    def _candidates(self, order: List[str]) -> List[ModelProvider]:
+        providers = [self._providers[n] for n in order if n in self._providers]
+        # Providers in cooldown go last rather than away, so something is always tried
+        return [p for p in providers if p.stats.healthy()] + [p for p in providers if not p.stats.healthy()]
+
+    def _hedge_delay(self, provider: ModelProvider) -> float:
+        min_samples = int(os.getenv("PROVIDER_HEDGE_MIN_SAMPLES", "10"))
+        p95 = provider.stats.percentile(0.95) if len(provider.stats.latencies) >= min_samples else None
+        return p95 if p95 is not None else float(os.getenv("PROVIDER_HEDGE_DELAY", "5"))
+
+    def _cache_key(self, candidates: List[ModelProvider], messages: Messages, temperature: float, max_tokens: Optional[int], json_mode: bool) -> str:
+        models = ",".join(f"{p.kind}:{p.model}" for p in candidates)
+        return prompt_key(f"providers[{models}]", temperature, messages, max_tokens=max_tokens, json_mode=json_mode)
+
+    def _timed(self, provider: ModelProvider, messages, temperature, max_tokens, timeout, json_mode) -> str:
+        start = time.perf_counter()
+        try:
+            with span(f"provider:{provider.name}"):
+                text = provider.complete(messages, temperature, max_tokens, timeout, json_mode)
+        except Exception:
+            provider.stats.record(time.perf_counter() - start, False)
+            raise
+        provider.stats.record(time.perf_counter() - start, True)
+        return text
+
+    async def _atimed(self, provider: ModelProvider, messages, temperature, max_tokens, timeout, json_mode) -> str:
+        start = time.perf_counter()
+        try:
+            with span(f"provider:{provider.name}"):
+                text = await asyncio.wait_for(provider.acomplete(messages, temperature, max_tokens, timeout, json_mode), timeout)
+        except asyncio.CancelledError:
+            raise  # lost a hedge race; not the provider's fault
+        except Exception:
+            provider.stats.record(time.perf_counter() - start, False)
+            raise
+        provider.stats.record(time.perf_counter() - start, True)
+        return text
+
+    def complete(
+        self,
+        messages: Messages,
+        order: List[str],
+        temperature: float = 0.3,
+        max_tokens: Optional[int] = None,
+        timeout: float = 60,
+        hedge: Optional[bool] = None,
+        cache: bool = True,
+        json_mode: bool = False,
+    ) -> Dict[str, Any]:
+        candidates = self._candidates(order)
+        if not candidates:
+            return {"ok": False, "error": f"No configured provider among: {', '.join(order)}"}
+        hedge = _hedging_enabled() if hedge is None else hedge
+
+        def run() -> Dict[str, Any]:
+            errors: List[str] = []
+            pending: Dict[Future, ModelProvider] = {}
+            queue = list(candidates)
+
+            def launch() -> None:
+                provider = queue.pop(0)
+                pending[self._pool.submit(contextvars.copy_context().run, self._timed, provider, messages, temperature, max_tokens, timeout, json_mode)] = provider
+
+            launch()
+            while pending:
+                newest = list(pending.values())[-1]
+                delay = self._hedge_delay(newest) if hedge and queue else None
+                done, _ = wait(list(pending), timeout=delay, return_when=FIRST_COMPLETED)
+                if not done:
+                    print(f"Hedging: {newest.name} slower than {delay:.2f}s, also trying {queue[0].name}")
+                    record_retry("provider", "hedge")
+                    launch()
+                    continue
+                for future in done:
+                    provider = pending.pop(future)
+                    try:
+                        text = future.result()
+                    except Exception as e:
+                        errors.append(f"{provider.name}: {e}")
+                        continue
+                    # Slower hedged calls cannot be interrupted; they finish in the background
+                    return {"ok": True, "output": text, "provider": provider.name}
+                if not pending and queue:
+                    record_retry("provider", "failover")
+                    launch()  # failover
+            return {"ok": False, "error": "All providers failed: " + "; ".join(errors)}
+
+        if not cache:
+            return run()
+        key = self._cache_key(candidates, messages, temperature, max_tokens, json_mode)
+        return get_prompt_cache().get_or_call(key, run, ttl_for(temperature), cacheable=is_ok_result)
+
+    async def acomplete(
+        self,
+        messages: Messages,
+        order: List[str],
+        temperature: float = 0.3,
+        max_tokens: Optional[int] = None,
+        timeout: float = 60,
+        hedge: Optional[bool] = None,
+        cache: bool = True,
+        json_mode: bool = False,
+    ) -> Dict[str, Any]:
+        """Async twin of complete; losing hedged calls are cancelled."""
+        candidates = self._candidates(order)
+        if not candidates:
+            return {"ok": False, "error": f"No configured provider among: {', '.join(order)}"}
+        hedge = _hedging_enabled() if hedge is None else hedge
+
+        async def run() -> Dict[str, Any]:
+            errors: List[str] = []
+            pending: Dict["asyncio.Task", ModelProvider] = {}
+            queue = list(candidates)
+
+            def launch() -> None:
+                provider = queue.pop(0)
+                task = asyncio.ensure_future(self._atimed(provider, messages, temperature, max_tokens, timeout, json_mode))
+                pending[task] = provider
+
+            launch()
+            try:
+                while pending:
+                    newest = list(pending.values())[-1]
+                    delay = self._hedge_delay(newest) if hedge and queue else None
+                    done, _ = await asyncio.wait(list(pending), timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        print(f"Hedging: {newest.name} slower than {delay:.2f}s, also trying {queue[0].name}")
+                        record_retry("provider", "hedge")
+                        launch()
+                        continue
+                    for task in done:
+                        provider = pending.pop(task)
+                        try:
+                            text = task.result()
+                        except Exception as e:
+                            errors.append(f"{provider.name}: {e}")
+                            continue
+                        return {"ok": True, "output": text, "provider": provider.name}
+                    if not pending and queue:
+                        record_retry("provider", "failover")
+                        launch()  # failover
+            finally:
+                for task in pending:
+                    task.cancel()
+            return {"ok": False, "error": "All providers failed: " + "; ".join(errors)}
+
+        if not cache:
+            return await run()
+        key = self._cache_key(candidates, messages, temperature, max_tokens, json_mode)
+        return await get_prompt_cache().aget_or_call(key, run, ttl_for(temperature), cacheable=is_ok_result)
+
+    def stream(
+        self,
+        messages: Messages,
+        order: List[str],
+        temperature: float = 0.3,
+        max_tokens: Optional[int] = None,
+        timeout: float = 60,
+        json_mode: bool = False,
+    ) -> Iterator[str]:
+        """Yield deltas from the first provider that answers.
+
+        Failover only happens before the first delta; once text has been sent to the
+        client, switching providers would splice two different answers together.
+        """
+        candidates = self._candidates(order)
+        if not candidates:
+            raise RuntimeError(f"No configured provider among: {', '.join(order)}")
+        errors: List[str] = []
+        for provider in candidates:
+            start = time.perf_counter()
+            started = False
+            try:
+                for delta in provider.stream(messages, temperature, max_tokens, timeout, json_mode):
+                    started = True
+                    yield delta
+            except Exception as e:
+                provider.stats.record(time.perf_counter() - start, False)
+                if started:
+                    raise
+                errors.append(f"{provider.name}: {e}")
+                continue
+            provider.stats.record(time.perf_counter() - start, True)
+            return
+        raise RuntimeError("All providers failed: " + "; ".join(errors))
+
+    async def astream(
+        self,
+        messages: Messages,
+        order: List[str],
+        temperature: float = 0.3,
+        max_tokens: Optional[int] = None,
+        timeout: float = 60,
+        json_mode: bool = False,
+    ) -> AsyncIterator[str]:
+        """Async twin of stream, with the same failover-before-the-first-delta rule."""
+        candidates = self._candidates(order)
+        if not candidates:
+            raise RuntimeError(f"No configured provider among: {', '.join(order)}")
+        errors: List[str] = []
+        for provider in candidates:
+            start = time.perf_counter()
+            started = False
+            try:
+                async for delta in provider.astream(messages, temperature, max_tokens, timeout, json_mode):
+                    started = True
+                    yield delta
+            except Exception as e:
+                provider.stats.record(time.perf_counter() - start, False)
+                if started:
+                    raise
+                errors.append(f"{provider.name}: {e}")
+                continue
+            provider.stats.record(time.perf_counter() - start, True)
+            return
+        raise RuntimeError("All providers failed: " + "; ".join(errors))
+
+
+def _hedging_enabled() -> bool:
+    return os.getenv("PROVIDER_HEDGE", "0").strip().lower() in ("1", "true", "yes")
+
+
+def _split_keys(value: Optional[str]) -> List[str]:
+    return [k.strip() for k in (value or "").split(",") if k.strip() and "REPLACE" not in k]
+
+
+def build_registry_from_env() -> ProviderRegistry:
+    """Register every provider that has credentials configured.
+
+    Multiple Groq/Gemini keys become separate providers (`groq`, `groq-2`, ...) so
+    they can be rotated and tracked independently.
+    """
+    registry = ProviderRegistry(max_workers=int(os.getenv("PROVIDER_POOL_SIZE", "32")))
+
+    groq_model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+    for i, key in enumerate(_split_keys(os.getenv("GROQ_API_KEYS") or os.getenv("GROQ_API_KEY"))):
+        registry.register(GroqProvider("groq" if i == 0 else f"groq-{i + 1}", groq_model, key))
+
+    gemini_model = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+    for i, key in enumerate(_split_keys(os.getenv("GOOGLE_API_KEY"))):
+        registry.register(GeminiProvider("gemini" if i == 0 else f"gemini-{i + 1}", gemini_model, key))
+
+    if os.getenv("OPENAI_API_KEY"):
+        registry.register(OpenAIProvider(
+            "openai",
+            os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+            os.getenv("OPENAI_API_KEY"),
+            os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        ))
+
+    if os.getenv("HF_API_KEY"):
+        registry.register(HFProvider("hf", os.getenv("HF_MODEL", "Qwen/Qwen2.5-Coder-32B-Instruct"), os.getenv("HF_API_KEY")))
+
+    # Local; always registered; failures just send traffic to the next provider
+    registry.register(OllamaProvider("ollama", os.getenv("OLLAMA_MODEL", "qwen2.5-coder:latest")))
+    return registry
+
+
+_registry: Optional[ProviderRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_provider_registry() -> ProviderRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = build_registry_from_env()
+        return _registry
+
+
+def provider_order(primary: str, fallbacks_env: str = "MODEL_FALLBACKS") -> List[str]:
+    """`primary` followed by the comma-separated fallbacks in `fallbacks_env`."""
+    order = [primary]
+    for name in _split_keys(os.getenv(fallbacks_env)):
+        if name not in order:
+            order.append(name)
+    return order
@@ -0,0 +1,380 @@
+# pipeline/module_clustering.py
+"""Module clustering for the wiki: directory tree + import graph, with token bounds.
+
+1. Seed one group per directory (or per caller-supplied label).
+2. Split groups above `max_tokens`: label propagation over the import graph inside
+   the group finds communities, which are then packed first-fit-decreasing into
+   parts under the bound (a community that is itself too big is cut in BFS order,
+   so imported files stay next to their importers).
+3. Merge groups below `min_tokens` into the group they import from / are imported
+   by the most, or else the one sharing the deepest directory, as long as the
+   result stays under `max_tokens`.
+
+Sizes are whatever the caller measures (the wiki uses the tokens of each file's
+extracted structure, i.e. exactly what is sent), so every module fits one request
+and no file has to be dropped.
+"""
+import os
+import posixpath
+import re
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+Graph = Dict[str, Dict[str, int]]
+
+_PY_FROM = re.compile(r"^[ \t]*from[ \t]+(\.*[\w.]*)[ \t]+import[ \t]+\(?([\w, \t*]+)", re.MULTILINE)
+_PY_IMPORT = re.compile(r"^[ \t]*import[ \t]+([\w., \t]+)", re.MULTILINE)
+# Alternatives start with a literal (no leading \b) so `re` can skip ahead; see code_compress.py
+_JS_SPEC = re.compile(
+    r"""(?:import\s+(?:[\w*{}\s,$]+\s+from\s+)?|export\s+[\w*{}\s,$]+\s+from\s+|require\(\s*|import\(\s*)['"]([^'"\n]+)['"]"""
+)
+_GO_BLOCK = re.compile(r"^import\s*\(([^)]*)\)", re.MULTILINE)
+_GO_SINGLE = re.compile(r'^import\s+(?:[\w.]+\s+)?"([^"]+)"', re.MULTILINE)
+_QUOTED = re.compile(r'"([^"]+)"')
+_JAVA_IMPORT = re.compile(r"^[ \t]*import[ \t]+(?:static[ \t]+)?([\w.]+)", re.MULTILINE)
+_C_INCLUDE = re.compile(r'^[ \t]*#[ \t]*include[ \t]+"([^"]+)"', re.MULTILINE)
+
+_PART_SUFFIX = re.compile(r" \(part \d+\)$")
+_JS_EXTS = ("", ".ts", ".tsx", ".js", ".jsx", ".mjs", ".cjs", "/index.ts", "/index.tsx", "/index.js", "/index.jsx")
+_JS_FAMILY = ("js", "jsx", "ts", "tsx", "mjs", "cjs")
+
+
+def _ext(path: str) -> str:
+    return os.path.splitext(path)[1].lstrip(".").lower()
+
+
+class _RepoIndex:
+    """Lookups from import targets to repo paths."""
+
+    def __init__(self, paths: Iterable[str]):
+        self.paths: Set[str] = set(paths)
+        self.py_modules: Dict[str, List[str]] = defaultdict(list)
+        self.by_basename: Dict[str, List[str]] = defaultdict(list)
+        self.dirs: Dict[str, List[str]] = defaultdict(list)
+        self.dirs_by_basename: Dict[str, List[str]] = defaultdict(list)
+        for path in sorted(self.paths):
+            directory = posixpath.dirname(path)
+            self.dirs[directory].append(path)
+            self.by_basename[posixpath.basename(path)].append(path)
+            if _ext(path) == "py":
+                parts = path[:-3].split("/")
+                if parts[-1] == "__init__":
+                    parts = parts[:-1]
+                # Every suffix, so `pkg.mod` resolves whether or not the repo nests it under src/
+                for i in range(len(parts)):
+                    if parts[i:]:
+                        self.py_modules[".".join(parts[i:])].append(path)
+        for directory in self.dirs:
+            if directory:
+                self.dirs_by_basename[posixpath.basename(directory)].append(directory)
+
+    def _entry(self, directory: str) -> Optional[str]:
+        """Representative file of a directory (an index/__init__ file when there is one)."""
+        files = self.dirs.get(directory)
+        if not files:
+            return None
+        for f in files:
+            if posixpath.basename(f).split(".")[0] in ("index", "__init__", "mod", "main", "lib"):
+                return f
+        return files[0]
+
+    def python(self, path: str, content: str) -> Iterable[str]:
+        package = posixpath.dirname(path).split("/") if posixpath.dirname(path) else []
+        for module, names in _PY_FROM.findall(content):
+            dots = len(module) - len(module.lstrip("."))
+            module = module.lstrip(".")
+            if dots:
+                base = package[:len(package) - (dots - 1)] if dots - 1 <= len(package) else []
+                prefix = ".".join(base + ([module] if module else []))
+            else:
+                prefix = module
+            targets = [prefix] if prefix else []
+            # `from pkg import mod` may import a submodule
+            targets += [f"{prefix}.{n.strip()}" if prefix else n.strip() for n in names.split(",") if n.strip() and n.strip() != "*"]
+            for target in targets:
+                yield from self.py_modules.get(target, ())[:1]
+        for modules in _PY_IMPORT.findall(content):
+            for module in modules.split(","):
+                name = module.strip().split(" ")[0]
+                if name:
+                    yield from self.py_modules.get(name, ())[:1]
+
+    def javascript(self, path: str, content: str) -> Iterable[str]:
+        directory = posixpath.dirname(path)
+        for spec in _JS_SPEC.findall(content):
+            if spec.startswith("."):
+                base = posixpath.normpath(posixpath.join(directory, spec))
+                for ext in _JS_EXTS:
+                    if base + ext in self.paths:
+                        yield base + ext
+                        break
+                continue
+            # Bare specifier: a workspace package (packages/<name>) imported by name
+            parts = spec.split("/")
+            name, rest = (parts[1], parts[2:]) if spec.startswith("@") and len(parts) > 1 else (parts[0], parts[1:])
+            for package_dir in self.dirs_by_basename.get(name, ())[:1]:
+                target = None
+                if rest:
+                    base = posixpath.join(package_dir, *rest)
+                    target = next((base + e for e in _JS_EXTS if base + e in self.paths), None)
+                target = target or self._entry(package_dir) or self._entry(posixpath.join(package_dir, "src"))
+                if target:
+                    yield target
+
+    def go(self, path: str, content: str) -> Iterable[str]:
+        imports = _GO_SINGLE.findall(content)
+        for block in _GO_BLOCK.findall(content):
+            imports += _QUOTED.findall(block)
+        for imported in imports:
+            # Longest repo directory that the import path ends with
+            best = max((d for d in self.dirs if d and (imported == d or imported.endswith("/" + d))), key=len, default=None)
+            if best is not None:
+                entry = self._entry(best)
+                if entry:
+                    yield entry
+
+    def java(self, path: str, content: str) -> Iterable[str]:
+        for imported in _JAVA_IMPORT.findall(content):
+            parts = imported.split(".")
+            for ext in ("java", "kt"):
+                suffix = "/".join(parts) + "." + ext
+                match = next((p for p in self.by_basename.get(f"{parts[-1]}.{ext}", ()) if p.endswith(suffix)), None)
+                if match:
+                    yield match
+                    break
+
+    def c(self, path: str, content: str) -> Iterable[str]:
+        directory = posixpath.dirname(path)
+        for included in _C_INCLUDE.findall(content):
+            local = posixpath.normpath(posixpath.join(directory, included))
+            if local in self.paths:
+                yield local
+            else:
+                yield from self.by_basename.get(posixpath.basename(included), ())[:1]
+
+
+_PARSERS = {
+    "py": _RepoIndex.python,
+    **dict.fromkeys(_JS_FAMILY, _RepoIndex.javascript),
+    "go": _RepoIndex.go,
+    "java": _RepoIndex.java,
+    "kt": _RepoIndex.java,
+    **dict.fromkeys(("c", "h", "cc", "cpp", "hpp"), _RepoIndex.c),
+}
+
+
+def import_graph(files: Dict[str, str]) -> Graph:
+    """Undirected graph of resolved in-repo imports; edge weight = import statements between the two files."""
+    index = _RepoIndex(files)
+    graph: Graph = defaultdict(dict)
+    for path, content in files.items():
+        parser = _PARSERS.get(_ext(path))
+        if parser is None or not content:
+            continue
+        for target in parser(index, path, content):
+            if target == path:
+                continue
+            graph[path][target] = graph[path].get(target, 0) + 1
+            graph[target][path] = graph[target].get(path, 0) + 1
+    return dict(graph)
+
+
+def _common_dir(paths: Iterable[str]) -> str:
+    dirs = [posixpath.dirname(p).split("/") if posixpath.dirname(p) else [] for p in paths]
+    if not dirs:
+        return ""
+    prefix = dirs[0]
+    for d in dirs[1:]:
+        i = 0
+        while i < len(prefix) and i < len(d) and prefix[i] == d[i]:
+            i += 1
+        prefix = prefix[:i]
+    return "/".join(prefix)
+
+
+class _Group:
+    __slots__ = ("name", "paths", "size", "directory")
+
+    def __init__(self, name: str, paths: List[str], size: int):
+        self.name = name
+        self.paths = paths
+        self.size = size
+        self.directory = _common_dir(paths)
+
+
+def _communities(paths: List[str], graph: Graph, rounds: int = 10) -> List[List[str]]:
+    """Label propagation restricted to `paths`; deterministic (sorted order, smallest label on ties)."""
+    members = set(paths)
+    label = {p: p for p in paths}
+    for _ in range(rounds):
+        changed = False
+        for p in sorted(paths):
+            weights: Dict[str, int] = defaultdict(int)
+            for q, w in graph.get(p, {}).items():
+                if q in members:
+                    weights[label[q]] += w
+            if not weights:
+                continue
+            best = min(weights, key=lambda l: (-weights[l], l))
+            if weights[best] > weights.get(label[p], 0) and best != label[p]:
+                label[p] = best
+                changed = True
+        if not changed:
+            break
+    groups: Dict[str, List[str]] = defaultdict(list)
+    for p in sorted(paths):
+        groups[label[p]].append(p)
+    return list(groups.values())
+
+
+def _bfs_order(paths: List[str], graph: Graph) -> List[str]:
+    """Paths ordered so import neighbours sit next to each other (BFS from the best-connected file)."""
+    members = set(paths)
+    remaining = sorted(paths, key=lambda p: (-sum(w for q, w in graph.get(p, {}).items() if q in members), p))
+    seen: Set[str] = set()
+    order: List[str] = []
+    for start in remaining:
+        if start in seen:
+            continue
+        queue = deque([start])
+        seen.add(start)
+        while queue:
+            p = queue.popleft()
+            order.append(p)
+            for q in sorted(graph.get(p, {}), key=lambda q: (-graph[p][q], q)):
+                if q in members and q not in seen:
+                    seen.add(q)
+                    queue.append(q)
+    return order
+
+
+def _split(group: _Group, sizes: Dict[str, int], graph: Graph, max_tokens: int) -> List[_Group]:
+    """Parts of an oversized group, each under `max_tokens` (a single oversized file stays alone)."""
+    pieces: List[List[str]] = []
+    for community in _communities(group.paths, graph):
+        if sum(sizes[p] for p in community) <= max_tokens:
+            pieces.append(community)
+            continue
+        chunk: List[str] = []
+        chunk_size = 0
+        for p in _bfs_order(community, graph):
+            if chunk and chunk_size + sizes[p] > max_tokens:
+                pieces.append(chunk)
+                chunk, chunk_size = [], 0
+            chunk.append(p)
+            chunk_size += sizes[p]
+        if chunk:
+            pieces.append(chunk)
+
+    # First-fit decreasing: few, full parts
+    bins: List[Tuple[int, List[str]]] = []
+    for piece in sorted(pieces, key=lambda ps: (-sum(sizes[p] for p in ps), ps[0])):
+        size = sum(sizes[p] for p in piece)
+        for i, (bin_size, bin_paths) in enumerate(bins):
+            if bin_size + size <= max_tokens:
+                bins[i] = (bin_size + size, bin_paths + piece)
+                break
+        else:
+            bins.append((size, list(piece)))
+    if len(bins) == 1:
+        return [group]
+    parts = []
+    for i, (size, paths) in enumerate(bins, 1):
+        part = _Group(group.name, sorted(paths), size)
+        # A deeper shared directory names the part better than a counter
+        deeper = part.directory and part.directory != group.directory and part.directory.startswith(group.directory)
+        part.name = part.directory if deeper else f"{group.name} (part {i})"
+        parts.append(part)
+    return parts
+
+
+def _affinity(a: str, b: str) -> int:
+    """Shared leading directory components."""
+    pa, pb = a.split("/") if a else [], b.split("/") if b else []
+    n = 0
+    while n < len(pa) and n < len(pb) and pa[n] == pb[n]:
+        n += 1
+    return n
+
+
+def _merge_small(groups: List[_Group], graph: Graph, max_tokens: int, min_tokens: int) -> List[_Group]:
+    owner = {p: g for g in groups for p in g.paths}
+    alive = list(groups)
+    while True:
+        small = sorted((g for g in alive if g.size < min_tokens), key=lambda g: (g.size, g.name))
+        merged = False
+        for g in small:
+            links: Dict[int, int] = defaultdict(int)
+            for p in g.paths:
+                for q, w in graph.get(p, {}).items():
+                    h = owner[q]
+                    if h is not g:
+                        links[id(h)] += w
+            best, best_key = None, None
+            for h in alive:
+                if h is g or g.size + h.size > max_tokens:
+                    continue
+                link, affinity = links.get(id(h), 0), _affinity(g.directory, h.directory)
+                if not link and not affinity:
+                    continue
+                key = (link, affinity, -(g.size + h.size), h.name)
+                if best_key is None or key > best_key:
+                    best, best_key = h, key
+            if best is None:
+                continue
+            combined = _Group(_merged_name(best, g), sorted(best.paths + g.paths), best.size + g.size)
+            alive = [x for x in alive if x is not g and x is not best] + [combined]
+            for p in combined.paths:
+                owner[p] = combined
+            merged = True
+            break
+        if not merged:
+            return alive
+
+
+def _merged_name(a: _Group, b: _Group) -> str:
+    directory = _common_dir(a.paths + b.paths)
+    if directory:
+        # Both live under one directory: name the module after it
+        return directory
+    big, other = (a, b) if a.size >= b.size else (b, a)
+    names = big.name.split(" + ")
+    if names[-1] == "more" or other.name in names:
+        return big.name
+    return " + ".join(names + [other.name]) if len(names) < 3 else f"{names[0]} + more"
+
+
+def cluster_modules(
+    sizes: Dict[str, int],
+    graph: Optional[Graph] = None,
+    max_tokens: int = 6000,
+    min_tokens: int = 1500,
+    labels: Optional[Dict[str, str]] = None,
+) -> Dict[str, List[str]]:
+    """Group files into modules of at most `max_tokens` (sum of `sizes`), sorted by name.
+
+    `labels` pre-assigns files to named seed groups (files without a label are seeded
+    by directory, top-level files as "root").
+    """
+    graph = graph or {}
+    seeds: Dict[str, List[str]] = defaultdict(list)
+    for path in sorted(sizes):
+        seeds[(labels or {}).get(path) or posixpath.dirname(path) or "root"].append(path)
+
+    groups: List[_Group] = []
+    for name, paths in seeds.items():
+        group = _Group(name, paths, sum(sizes[p] for p in paths))
+        groups.extend(_split(group, sizes, graph, max_tokens) if group.size > max_tokens else [group])
+
+    groups = _merge_small(groups, graph, max_tokens, min_tokens)
+
+    # Groups that ended up with the same base name (parts of one directory) are numbered
+    by_base: Dict[str, List[_Group]] = defaultdict(list)
+    for group in groups:
+        by_base[_PART_SUFFIX.sub("", group.name)].append(group)
+    modules: Dict[str, List[str]] = {}
+    for base in sorted(by_base):
+        same = sorted(by_base[base], key=lambda g: g.paths[0])
+        for i, group in enumerate(same, 1):
+            modules[f"{base} (part {i}/{len(same)})" if len(same) > 1 else base] = group.paths
+    return modules
@@ -0,0 +1,144 @@
+# pipeline/ollama_client.py
+import json
+import os
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from usage import record_usage
+
+
+class OllamaClient:
+    """HTTP client for a local Ollama server.
+
+    One pooled `requests.Session` is shared by every caller, `keep_alive` keeps the model
+    resident between requests, and a semaphore caps concurrent generations so a burst of
+    traffic queues here instead of thrashing the local GPU/CPU.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "http://127.0.0.1:11434",
+        keep_alive: str = "30m",
+        max_concurrency: int = 2,
+        pool_size: int = 8,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.keep_alive = keep_alive
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _payload(self, prompt: str, model: str, stream: bool, options: Optional[Dict[str, Any]], fmt: Optional[str]) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"model": model, "prompt": prompt, "stream": stream, "keep_alive": self.keep_alive}
+        if options:
+            payload["options"] = options
+        if fmt:
+            payload["format"] = fmt
+        return payload
+
+    def generate(
+        self,
+        prompt: str,
+        model: str,
+        timeout: float = 180,
+        options: Optional[Dict[str, Any]] = None,
+        fmt: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Non-streaming generation; returns {"ok": True, "output": ...} or {"ok": False, "error": ...}."""
+        if not self._slots.acquire(timeout=timeout):
+            return {"ok": False, "error": f"Ollama busy: no free slot within {timeout}s."}
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/generate", json=self._payload(prompt, model, False, options, fmt), timeout=timeout
+            )
+            response.raise_for_status()
+            data = response.json()
+            record_usage("ollama", model, None, data.get("prompt_eval_count"), data.get("eval_count"))
+            output = data.get("response", "").strip()
+            return {"ok": True, "output": output or "No response content."}
+        except requests.exceptions.Timeout:
+            return {"ok": False, "error": f"Ollama request timed out after {timeout}s."}
+        except requests.exceptions.RequestException as e:
+            return {"ok": False, "error": f"Ollama HTTP error: {e}"}
+        except Exception as e:
+            return {"ok": False, "error": f"Unexpected error: {e}"}
+        finally:
+            self._slots.release()
+
+    def generate_stream(
+        self,
+        prompt: str,
+        model: str,
+        timeout: float = 180,
+        options: Optional[Dict[str, Any]] = None,
+        fmt: Optional[str] = None,
+    ) -> Iterator[str]:
+        """Yield text deltas as Ollama produces them; raises RuntimeError on failure.
+
+        The concurrency slot is held until the stream is exhausted or closed.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise RuntimeError(f"Ollama busy: no free slot within {timeout}s.")
+        try:
+            with self.session.post(
+                f"{self.base_url}/api/generate",
+                json=self._payload(prompt, model, True, options, fmt),
+                stream=True,
+                timeout=timeout,
+            ) as response:
+                if response.status_code != 200:
+                    raise RuntimeError(f"Ollama HTTP error {response.status_code}: {response.text}")
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if data.get("error"):
+                        raise RuntimeError(f"Ollama error: {data['error']}")
+                    if data.get("response"):
+                        yield data["response"]
+                    if data.get("done"):
+                        record_usage("ollama", model, None, data.get("prompt_eval_count"), data.get("eval_count"))
+                        break
+        except requests.exceptions.Timeout:
+            raise RuntimeError(f"Ollama request timed out after {timeout}s.")
+        except requests.exceptions.RequestException as e:
+            raise RuntimeError(f"Ollama HTTP error: {e}")
+        finally:
+            self._slots.release()
+
+    def warm(self, model: str, timeout: float = 300) -> bool:
+        """Load `model` into memory ahead of the first request (empty prompt + keep_alive)."""
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/generate", json={"model": model, "keep_alive": self.keep_alive}, timeout=timeout
+            )
+            return response.status_code == 200
+        except requests.exceptions.RequestException as e:
+            print(f"Could not warm Ollama model {model}: {e}")
+            return False
+
+
+_ollama_client: Optional[OllamaClient] = None
+_ollama_client_lock = threading.Lock()
+
+
+def get_ollama_client() -> OllamaClient:
+    """Process-wide client configured by OLLAMA_BASE_URL, OLLAMA_KEEP_ALIVE and OLLAMA_MAX_CONCURRENCY."""
+    global _ollama_client
+    with _ollama_client_lock:
+        if _ollama_client is None:
+            _ollama_client = OllamaClient(
+                base_url=os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434"),
+                keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
+                max_concurrency=int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2")),
+                pool_size=int(os.getenv("OLLAMA_POOL_SIZE", "8")),
+            )
+        return _ollama_client
@@ -0,0 +1,262 @@
+# pipeline/profiling.py
+"""Opt-in, per-request sampling profiler.
+
+A request asks for profiling with `X-Profile: 1` (or `?profile=1`) and is profiled
+only when its client is allowlisted (PROFILE_ALLOWLIST) or carries the admin token.
+While it runs, a sampler thread reads `sys._current_frames()` every
+PROFILE_INTERVAL_MS and counts the wall-clock stacks of the request's own thread and
+of every thread currently inside one of the request's tracing spans (pool workers,
+the wiki event loop). Spans also feed a per-stage timing breakdown. Finished
+profiles are kept per process, keyed by request id, as folded stacks (flamegraph.pl,
+speedscope, inferno) plus a JSON summary.
+
+Requests without the flag pay one header lookup; spans stay no-ops.
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Mapping, Optional
+
+from tracing import reset_span_listener, set_span_listener
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+_TRUTHY = ("1", "true", "yes", "on")
+_MAX_DEPTH = 96
+
+
+def profiling_flag(headers: Mapping[str, str], args: Mapping[str, str]) -> bool:
+    """True when the request asks to be profiled (header or query flag)."""
+    value = headers.get(PROFILE_HEADER) or args.get("profile")
+    return bool(value) and value.strip().lower() in _TRUTHY
+
+
+def profile_allowed(remote_addr: Optional[str]) -> bool:
+    """Whether `remote_addr` is in PROFILE_ALLOWLIST (comma-separated addresses, or "*")."""
+    allowlist = [a.strip() for a in os.getenv("PROFILE_ALLOWLIST", "").split(",") if a.strip()]
+    return "*" in allowlist or (remote_addr or "") in allowlist
+
+
+class RequestProfile:
+    """Samples and stage timings of one profiled request."""
+
+    def __init__(self, endpoint: str, interval: float):
+        self.id = uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.interval = interval
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.status: Optional[int] = None
+        self.request_thread = threading.get_ident()
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        # stage -> [count, total seconds, max seconds, errors]
+        self.stages: Dict[str, List[float]] = {}
+        self._span_threads: Counter = Counter()
+        self._lock = threading.Lock()
+        self._token: Optional[contextvars.Token] = None
+
+    # --- span listener (see tracing.Span) -------------------------------------------
+
+    def span_started(self, stage: str) -> int:
+        ident = threading.get_ident()
+        with self._lock:
+            self._span_threads[ident] += 1
+        return ident
+
+    def span_finished(self, stage: str, seconds: float, ident: int, failed: bool) -> None:
+        with self._lock:
+            self._span_threads[ident] -= 1
+            if self._span_threads[ident] <= 0:
+                del self._span_threads[ident]
+            row = self.stages.setdefault(stage, [0, 0.0, 0.0, 0])
+            row[0] += 1
+            row[1] += seconds
+            row[2] = max(row[2], seconds)
+            if failed:
+                row[3] += 1
+
+    # --- sampling ---------------------------------------------------------------------
+
+    def threads(self) -> List[int]:
+        with self._lock:
+            return [self.request_thread] + [t for t in self._span_threads if t != self.request_thread]
+
+    def add_samples(self, stacks: List[str]) -> None:
+        with self._lock:
+            self.sample_count += 1
+            for stack in stacks:
+                self.samples[stack] += 1
+
+    # --- output -----------------------------------------------------------------------
+
+    def folded(self) -> str:
+        """Folded stacks, one `frame;frame;frame count` line each."""
+        with self._lock:
+            items = sorted(self.samples.items())
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {k: list(v) for k, v in self.stages.items()}
+            samples = list(self.samples.items())
+            sample_count = self.sample_count
+        leaf_counts: Counter = Counter()
+        for stack, count in samples:
+            leaf_counts[stack.rsplit(";", 1)[-1]] += count
+        total_samples = sum(leaf_counts.values()) or 1
+        return {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 1),
+            "interval_ms": round(self.interval * 1000, 2),
+            "ticks": sample_count,
+            "stages": [
+                {
+                    "stage": stage,
+                    "count": int(count),
+                    "total_ms": round(total * 1000, 1),
+                    "max_ms": round(worst * 1000, 1),
+                    "errors": int(errors),
+                    "share_of_request": round(total / self.duration, 3) if self.duration else None,
+                }
+                for stage, (count, total, worst, errors) in sorted(stages.items(), key=lambda kv: -kv[1][1])
+            ],
+            "top_frames": [
+                {"frame": frame, "samples": count, "share": round(count / total_samples, 3)}
+                for frame, count in leaf_counts.most_common(25)
+            ],
+        }
+
+
+class _Sampler:
+    """One daemon thread that samples every active profile; runs only while one is active."""
+
+    def __init__(self):
+        self._active: Dict[str, RequestProfile] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._labels: Dict[Any, str] = {}
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._active[profile.id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._active.pop(profile.id, None)
+
+    def _label(self, code: Any) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            if len(self._labels) < 100_000:
+                self._labels[code] = label
+        return label
+
+    def _stack(self, frame: Any, thread_name: str) -> str:
+        frames: List[str] = []
+        while frame is not None and len(frames) < _MAX_DEPTH:
+            frames.append(self._label(frame.f_code))
+            frame = frame.f_back
+        frames.append(thread_name)
+        frames.reverse()
+        # ';' separates frames in the folded format
+        return ";".join(f.replace(";", ":") for f in frames)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                profiles = list(self._active.values())
+                if not profiles:
+                    self._thread = None
+                    return
+            interval = min(p.interval for p in profiles)
+            frames = sys._current_frames()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for profile in profiles:
+                stacks = [
+                    self._stack(frames[ident], names.get(ident, f"thread-{ident}"))
+                    for ident in profile.threads()
+                    if ident in frames
+                ]
+                profile.add_samples(stacks)
+            del frames
+            time.sleep(interval)
+
+
+class ProfileStore:
+    """Finished profiles of this process, newest last, bounded by count."""
+
+    def __init__(self, max_profiles: int = 20):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, RequestProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [
+            {"id": p.id, "endpoint": p.endpoint, "status": p.status, "started_at": p.started_at,
+             "duration_ms": round(p.duration * 1000, 1), "ticks": p.sample_count}
+            for p in reversed(profiles)
+        ]
+
+
+_sampler = _Sampler()
+_store: Optional[ProfileStore] = None
+_store_lock = threading.Lock()
+
+
+def get_profile_store() -> ProfileStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ProfileStore(max_profiles=int(os.getenv("PROFILE_MAX_STORED", "20")))
+        return _store
+
+
+def start_profile(endpoint: str) -> RequestProfile:
+    """Begin profiling the current request (its thread and the spans run in its context)."""
+    interval = max(0.001, float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0)
+    profile = RequestProfile(endpoint, interval)
+    profile._token = set_span_listener(profile)
+    _sampler.add(profile)
+    return profile
+
+
+def finish_profile(profile: RequestProfile, status: Optional[int] = None) -> None:
+    """Stop sampling `profile` and keep it for the admin endpoint."""
+    _sampler.remove(profile)
+    profile.duration = time.perf_counter() - profile.started
+    if status is not None:
+        profile.status = status
+    if profile._token is not None:
+        try:
+            reset_span_listener(profile._token)
+        except ValueError:
+            # Finished from another context (e.g. a streamed response's teardown)
+            set_span_listener(None)
+        profile._token = None
+    get_profile_store().put(profile)
+    print(f"Profiled {profile.endpoint} as {profile.id}: {profile.duration * 1000:.0f}ms, {profile.sample_count} samples")
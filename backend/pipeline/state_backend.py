@@ -0,0 +1,385 @@
+# pipeline/state_backend.py
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Set
+
+try:  # Optional: better ratio/speed than zlib when installed
+    import zstandard  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+def content_hash(content: str) -> str:
+    """Content address for a file body."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def compress_text(content: str) -> bytes:
+    """Compress text, tagging the codec in the first byte so readers can pick the decoder."""
+    raw = content.encode("utf-8")
+    if zstandard is not None:
+        return b"z" + zstandard.ZstdCompressor(level=6).compress(raw)
+    return b"d" + zlib.compress(raw, 6)
+
+
+def decompress_text(blob: bytes) -> str:
+    codec, payload = blob[:1], blob[1:]
+    if codec == b"z":
+        if zstandard is None:
+            raise RuntimeError("Blob was compressed with zstd but `zstandard` is not installed.")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    return zlib.decompress(payload).decode("utf-8")
+
+
+def normalize_repo_key(repo_url: str) -> str:
+    """Canonical cache key for a repo so URL spellings share one entry.
+
+    `https://github.com/X/y.git`, `github.com/x/y/` and `git@github.com:x/y` all map to `x/y`.
+    """
+    from wiki_generator import WikiPipeline
+
+    slug = WikiPipeline._parse_repo_slug(repo_url).strip().strip("/")
+    if slug.endswith(".git"):
+        slug = slug[:-4]
+    return slug.lower()
+
+
+class CompressedBlobStore:
+    """In-memory content-addressed store of compressed file bodies with a byte-budget LRU.
+
+    Repos map paths to blob hashes; a blob is kept once no matter how many repos (forks,
+    URL spellings) reference it. When the compressed bytes exceed `max_bytes`, least
+    recently used repos are dropped and blobs nobody references any more are freed.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._blobs: Dict[str, bytes] = {}
+        self._refcounts: Dict[str, int] = {}
+        self._repos: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put_repo(self, repo_key: str, files: Dict[str, str]) -> None:
+        manifest: Dict[str, str] = {}
+        sources: Dict[str, str] = {}
+        # Compress outside the lock; only new blobs pay for it
+        fresh: Dict[str, bytes] = {}
+        for path, content in files.items():
+            if content is None:
+                continue
+            digest = content_hash(content)
+            manifest[path] = digest
+            sources[digest] = content
+            if digest not in self._blobs and digest not in fresh:
+                fresh[digest] = compress_text(content)
+
+        with self._lock:
+            for digest in manifest.values():
+                if digest not in self._blobs:
+                    # Also covers a blob seen above but released by another thread since
+                    blob = fresh.get(digest) or compress_text(sources[digest])
+                    self._blobs[digest] = blob
+                    self._refcounts[digest] = 0
+                    self.total_bytes += len(blob)
+                self._refcounts[digest] += 1
+            old = self._repos.pop(repo_key, None)
+            self._repos[repo_key] = manifest
+            if old:
+                self._release(old)
+            # Never evict the repo that was just stored
+            while self.total_bytes > self.max_bytes and len(self._repos) > 1:
+                _, evicted = self._repos.popitem(last=False)
+                self._release(evicted)
+
+    def get_repo(self, repo_key: str) -> Optional["LazyFileMap"]:
+        with self._lock:
+            manifest = self._repos.get(repo_key)
+            if manifest is None:
+                return None
+            self._repos.move_to_end(repo_key)
+            return LazyFileMap(manifest, {d: self._blobs[d] for d in manifest.values()})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "repos": len(self._repos),
+                "blobs": len(self._blobs),
+                "compressed_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _release(self, manifest: Dict[str, str]) -> None:
+        for digest in manifest.values():
+            self._refcounts[digest] -= 1
+            if self._refcounts[digest] <= 0:
+                del self._refcounts[digest]
+                self.total_bytes -= len(self._blobs.pop(digest))
+
+
+class LazyFileMap(Mapping):
+    """Read-only `{path: content}` view that decompresses each file on first access."""
+
+    def __init__(self, manifest: Dict[str, str], blobs: Dict[str, bytes]):
+        self._manifest = manifest
+        self._blobs = blobs
+        self._cache: Dict[str, str] = {}
+
+    def __getitem__(self, path: str) -> str:
+        content = self._cache.get(path)
+        if content is None:
+            content = decompress_text(self._blobs[self._manifest[path]])
+            self._cache[path] = content
+        return content
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._manifest)
+
+    def __len__(self) -> int:
+        return len(self._manifest)
+
+
+class StateBackend(ABC):
+    """Storage for state that must survive across requests: cached repo files and chat sessions.
+
+    `shared` is True when the backend is visible to every worker process on the host.
+    """
+
+    shared = False
+
+    @abstractmethod
+    def put_repo_files(self, repo_key: str, files: Dict[str, str]) -> None:
+        ...
+
+    @abstractmethod
+    def get_repo_files(self, repo_key: str) -> Optional[Mapping[str, str]]:
+        ...
+
+    @abstractmethod
+    def load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def save_session(self, session_id: str, data: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def delete_session(self, session_id: str) -> None:
+        ...
+
+
+class MemoryStateBackend(StateBackend):
+    """In-process default. Fine for the dev server or a single worker.
+
+    Repo files are kept compressed and deduplicated in a CompressedBlobStore.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.blobs = CompressedBlobStore(max_bytes=max_bytes)
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+
+    def put_repo_files(self, repo_key: str, files: Dict[str, str]) -> None:
+        self.blobs.put_repo(repo_key, files)
+
+    def get_repo_files(self, repo_key: str) -> Optional[Mapping[str, str]]:
+        return self.blobs.get_repo(repo_key)
+
+    def load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._sessions.get(session_id)
+
+    def save_session(self, session_id: str, data: Dict[str, Any]) -> None:
+        self._sessions[session_id] = data
+
+    def delete_session(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+
+class SQLiteStateBackend(StateBackend):
+    """Host-local SQLite store shared by every worker process.
+
+    File bodies are stored once per host, content-addressed by sha256 and compressed;
+    repos only hold (path -> hash) rows, so identical files across repos cost nothing.
+    Least recently used repos are dropped, together with their orphaned blobs, beyond
+    `max_repos` or while the compressed blobs exceed `max_bytes`.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, max_repos: int = 64, session_ttl: int = 3600, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_repos = max_repos
+        self.max_bytes = max_bytes
+        self.session_ttl = session_ttl
+        self._local = threading.local()
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, data BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS repos (repo_key TEXT PRIMARY KEY, last_access REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS repo_files (
+                repo_key TEXT NOT NULL,
+                path TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (repo_key, path)
+            );
+            CREATE INDEX IF NOT EXISTS repo_files_hash ON repo_files (hash);
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                last_access REAL NOT NULL
+            );
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA cache_size=-8000")  # ~8 MB page cache per connection
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self) -> "_Transaction":
+        return _Transaction(self._conn())
+
+    def put_repo_files(self, repo_key: str, files: Dict[str, str]) -> None:
+        rows = []
+        sources: Dict[str, str] = {}
+        for path, content in files.items():
+            if content is None:
+                continue
+            digest = content_hash(content)
+            rows.append((repo_key, path, digest))
+            sources[digest] = content
+
+        # Compress before taking the write lock, which blocks every other worker's writes
+        known = self._existing_blobs(self._conn(), list(sources))
+        fresh = {digest: compress_text(content) for digest, content in sources.items() if digest not in known}
+
+        with self._transaction() as conn:
+            # A blob seen above may have been pruned by another worker since; re-check under the lock
+            seen = [digest for digest in sources if digest not in fresh]
+            still_there = self._existing_blobs(conn, seen)
+            fresh.update((digest, compress_text(sources[digest])) for digest in seen if digest not in still_there)
+            conn.executemany("INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)", list(fresh.items()))
+            previous = [r[0] for r in conn.execute("SELECT DISTINCT hash FROM repo_files WHERE repo_key = ?", (repo_key,))]
+            conn.execute("DELETE FROM repo_files WHERE repo_key = ?", (repo_key,))
+            conn.executemany("INSERT OR REPLACE INTO repo_files (repo_key, path, hash) VALUES (?, ?, ?)", rows)
+            conn.execute("INSERT OR REPLACE INTO repos (repo_key, last_access) VALUES (?, ?)", (repo_key, time.time()))
+            # Blobs only the replaced version referenced
+            conn.executemany(
+                "DELETE FROM blobs WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM repo_files WHERE hash = ?)",
+                [(digest, digest) for digest in previous if digest not in sources],
+            )
+            self._prune_repos(conn, keep=repo_key)
+
+    @staticmethod
+    def _existing_blobs(conn: sqlite3.Connection, digests: List[str]) -> Set[str]:
+        if not digests:
+            return set()
+        placeholders = ",".join("?" * len(digests))
+        return {r[0] for r in conn.execute(f"SELECT hash FROM blobs WHERE hash IN ({placeholders})", digests)}
+
+    def get_repo_files(self, repo_key: str) -> Optional[Dict[str, str]]:
+        with self._transaction() as conn:
+            touched = conn.execute("UPDATE repos SET last_access = ? WHERE repo_key = ?", (time.time(), repo_key))
+            if touched.rowcount == 0:
+                return None
+            rows = conn.execute(
+                "SELECT rf.path, b.data FROM repo_files rf JOIN blobs b ON b.hash = rf.hash WHERE rf.repo_key = ?",
+                (repo_key,),
+            ).fetchall()
+        return {path: decompress_text(data) for path, data in rows}
+
+    def load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data, last_access FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if not row:
+            return None
+        if self.session_ttl and row[1] < time.time() - self.session_ttl:
+            self.delete_session(session_id)
+            return None
+        return json.loads(row[0])
+
+    def save_session(self, session_id: str, data: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, last_access) VALUES (?, ?, ?)",
+                (session_id, json.dumps(data), now),
+            )
+            if self.session_ttl:
+                conn.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.session_ttl,))
+
+    def delete_session(self, session_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def _prune_repos(self, conn: sqlite3.Connection, keep: str) -> None:
+        stale = [
+            r[0] for r in conn.execute(
+                "SELECT repo_key FROM repos ORDER BY last_access DESC LIMIT -1 OFFSET ?", (self.max_repos,)
+            )
+        ]
+        if stale:
+            self._drop_repos(conn, stale)
+        if not self.max_bytes:
+            return
+        # Byte budget on what is actually stored (compressed); the repo just written is kept
+        while conn.execute("SELECT COALESCE(SUM(length(data)), 0) FROM blobs").fetchone()[0] > self.max_bytes:
+            oldest = conn.execute(
+                "SELECT repo_key FROM repos WHERE repo_key != ? ORDER BY last_access LIMIT 1", (keep,)
+            ).fetchone()
+            if oldest is None:
+                return
+            self._drop_repos(conn, [oldest[0]])
+
+    @staticmethod
+    def _drop_repos(conn: sqlite3.Connection, repo_keys: List[str]) -> None:
+        placeholders = ",".join("?" * len(repo_keys))
+        conn.execute(f"DELETE FROM repo_files WHERE repo_key IN ({placeholders})", repo_keys)
+        conn.execute(f"DELETE FROM repos WHERE repo_key IN ({placeholders})", repo_keys)
+        conn.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT DISTINCT hash FROM repo_files)")
+
+
+class _Transaction:
+    """`with` wrapper running the block in an immediate transaction on a cached connection."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def get_state_backend() -> StateBackend:
+    """Build the backend selected by STATE_BACKEND (memory | sqlite)."""
+    kind = os.getenv("STATE_BACKEND", "memory").strip().lower()
+    max_repos = int(os.getenv("STATE_MAX_REPOS", "64"))
+    max_bytes = int(os.getenv("STATE_MAX_BYTES", str(256 * 1024 * 1024)))
+    if kind == "sqlite":
+        path = os.getenv("STATE_DB_PATH") or os.path.join(tempfile.gettempdir(), "codemesher_state.db")
+        print(f"Using SQLite state backend at {path}")
+        return SQLiteStateBackend(
+            path,
+            max_repos=max_repos,
+            session_ttl=int(os.getenv("CHAT_SESSION_TTL", "3600")),
+            max_bytes=max_bytes,
+        )
+    if kind != "memory":
+        print(f"Unknown STATE_BACKEND '{kind}', falling back to memory.")
+    return MemoryStateBackend(max_bytes=max_bytes)
@@ -6,6 +6,9 @@ import ast
 from typing import Dict, List, Tuple, Optional, Any
 from pathlib import Path
 
+from code_compress import line_locator
+
+
 class FileAnalyzer:
     def __init__(self, root_path: str):
         self.root_path = root_path
@@ -217,6 +220,7 @@ class FileAnalyzer:
     def _extract_functions(self, content: str, file_extension: str) -> List[Dict[str, Any]]:
         """Extract function definitions based on file type"""
         functions = []
+        line_of = line_locator(content)
         
         if file_extension in ['.js', '.jsx', '.ts', '.tsx']:
             # Function declarations
@@ -227,7 +231,7 @@ class FileAnalyzer:
                 functions.append({
                     "name": match.group(1),
                     "type": "declaration",
-                    "line": content[:match.start()].count('\n') + 1
+                    "line": line_of(match.start())
                 })
             
             # Arrow functions
@@ -238,21 +242,23 @@ class FileAnalyzer:
                 functions.append({
                     "name": match.group(1),
                     "type": "arrow",
-                    "line": content[:match.start()].count('\n') + 1
+                    "line": line_of(match.start())
                 })
             
             # Method definitions
             method_pattern = r'(\w+)\s*\([^)]*\)\s*{'
             method_matches = re.finditer(method_pattern, content)
+            # "after some `class` and some `{`", without re-scanning the prefix for every match
+            first_class = content.find('class')
+            first_brace = content.find('{')
             
             for match in method_matches:
                 # Check if it's inside a class
-                before_match = content[:match.start()]
-                if 'class' in before_match and '{' in before_match:
+                if 0 <= first_class and first_class + len('class') <= match.start() and 0 <= first_brace < match.start():
                     functions.append({
                         "name": match.group(1),
                         "type": "method",
-                        "line": content[:match.start()].count('\n') + 1
+                        "line": line_of(match.start())
                     })
         
         elif file_extension == '.py':
@@ -264,7 +270,7 @@ class FileAnalyzer:
                 functions.append({
                     "name": match.group(1),
                     "type": "function",
-                    "line": content[:match.start()].count('\n') + 1
+                    "line": line_of(match.start())
                 })
             
             # Lambda functions
@@ -275,7 +281,7 @@ class FileAnalyzer:
                 functions.append({
                     "name": match.group(1),
                     "type": "lambda",
-                    "line": content[:match.start()].count('\n') + 1
+                    "line": line_of(match.start())
                 })
         
         return functions
@@ -283,6 +289,7 @@ class FileAnalyzer:
     def _extract_classes(self, content: str, file_extension: str) -> List[Dict[str, Any]]:
         """Extract class definitions based on file type"""
         classes = []
+        line_of = line_locator(content)
         
         if file_extension in ['.js', '.jsx', '.ts', '.tsx']:
             class_pattern = r'class\s+(\w+)(?:\s+extends\s+(\w+))?\s*{'
@@ -292,7 +299,7 @@ class FileAnalyzer:
                 classes.append({
                     "name": match.group(1),
                     "extends": match.group(2) if match.group(2) else None,
-                    "line": content[:match.start()].count('\n') + 1
+                    "line": line_of(match.start())
                 })
         
         elif file_extension == '.py':
@@ -303,7 +310,7 @@ class FileAnalyzer:
                 classes.append({
                     "name": match.group(1),
                     "extends": None,  # Python inheritance would need more complex parsing
-                    "line": content[:match.start()].count('\n') + 1
+                    "line": line_of(match.start())
                 })
         
         return classes
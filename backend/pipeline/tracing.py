@@ -0,0 +1,226 @@
+# pipeline/tracing.py
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+_enabled = os.getenv("METRICS_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+
+# Set while a profiled request runs (see profiling.py); spans report to it even with metrics off
+_span_listener: contextvars.ContextVar[Optional[Any]] = contextvars.ContextVar("span_listener", default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def metrics_enabled() -> bool:
+    return _enabled
+
+
+def set_metrics_enabled(enabled: bool) -> None:
+    global _enabled
+    _enabled = enabled
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter per label combination."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            out.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return out
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination (Prometheus semantics)."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][idx] += 1
+            series[1][0] += value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, (list(c), s[0])) for k, (c, s) in self._series.items())
+        for key, (counts, total) in items:
+            running = 0
+            for bound, count in zip(self.buckets, counts):
+                running += count
+                le = 'le="%g"' % bound
+                out.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {running}")
+            running += counts[-1]
+            le = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {running}")
+            out.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total:.6f}")
+            out.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {running}")
+        return out
+
+
+STAGE_SECONDS = Histogram("pipeline_stage_seconds", "Wall time per pipeline stage.", ("stage",))
+STAGE_ERRORS = Counter("pipeline_stage_errors_total", "Stages that ended with an exception.", ("stage",))
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by model providers.", ("provider", "model", "kind"))
+RETRIES = Counter("pipeline_retries_total", "Retries, by stage and reason.", ("stage", "reason"))
+CACHE_EVENTS = Counter("cache_events_total", "Cache lookups, by cache and result.", ("cache", "result"))
+
+_METRICS = [STAGE_SECONDS, STAGE_ERRORS, LLM_TOKENS, RETRIES, CACHE_EVENTS]
+
+
+class _NoopSpan:
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    """Times one stage into `pipeline_stage_seconds` and counts failures.
+
+    When a span listener is active in the current context (a profiled request), the
+    listener is also told when the stage starts and how long it took.
+    """
+
+    __slots__ = ("stage", "started", "listener", "handle")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.started = 0.0
+        self.listener = _span_listener.get()
+        self.handle = None
+
+    def __enter__(self) -> "Span":
+        if self.listener is not None:
+            self.handle = self.listener.span_started(self.stage)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        elapsed = time.perf_counter() - self.started
+        if _enabled:
+            STAGE_SECONDS.observe(elapsed, stage=self.stage)
+            if exc_type is not None:
+                STAGE_ERRORS.inc(stage=self.stage)
+        if self.listener is not None:
+            self.listener.span_finished(self.stage, elapsed, self.handle, exc_type is not None)
+        return False
+
+
+def _tracing_active() -> bool:
+    return _enabled or _span_listener.get() is not None
+
+
+def span(stage: str):
+    """`with span("fetch_repo_files"): ...`; a shared no-op when metrics are disabled and nothing listens."""
+    return Span(stage) if _tracing_active() else _NOOP
+
+
+def set_span_listener(listener: Any) -> contextvars.Token:
+    """Route spans in the current context to `listener` (span_started / span_finished); returns a reset token."""
+    return _span_listener.set(listener)
+
+
+def reset_span_listener(token: contextvars.Token) -> None:
+    _span_listener.reset(token)
+
+
+def traced(stage: str) -> Callable[[Callable], Callable]:
+    """Decorator form of `span` for sync and async functions."""
+
+    def decorate(fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _tracing_active():
+                    return await fn(*args, **kwargs)
+                with Span(stage):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _tracing_active():
+                return fn(*args, **kwargs)
+            with Span(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def record_tokens(provider: str, model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> None:
+    if not _enabled:
+        return
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, provider=provider, model=model, kind="prompt")
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, provider=provider, model=model, kind="completion")
+
+
+def record_retry(stage: str, reason: str) -> None:
+    if _enabled:
+        RETRIES.inc(stage=stage, reason=reason)
+
+
+def record_cache(cache: str, result: str) -> None:
+    if _enabled:
+        CACHE_EVENTS.inc(cache=cache, result=result)
+
+
+def render_metrics() -> str:
+    """Prometheus text exposition (format 0.0.4) of every metric in this process."""
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,360 @@
+# pipeline/usage.py
+import contextvars
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from tracing import record_tokens
+
+T = TypeVar("T")
+
+# Per-request attribution ({"endpoint", "repo"}); set at request start, read by record_usage
+_scope: contextvars.ContextVar[Optional[Dict[str, str]]] = contextvars.ContextVar("usage_scope", default=None)
+# Set while one model call serves several requests (micro-batching): [(scope, weight)]
+_shares: contextvars.ContextVar[Optional[List[Tuple[Dict[str, str], float]]]] = contextvars.ContextVar("usage_shares", default=None)
+
+# USD per 1M (input, output) tokens; MODEL_PRICES='{"model": [in, out]}' adds or overrides
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+}
+
+
+def begin_request_scope(endpoint: str, repo: str = "") -> None:
+    """Start attributing model usage in this context to `endpoint` (and `repo`)."""
+    _scope.set({"endpoint": endpoint, "repo": repo})
+
+
+def tag_request(**fields: str) -> None:
+    """Add attribution (e.g. repo=...) to the current request's scope once it is known."""
+    scope = _scope.get()
+    if scope is not None:
+        scope.update({k: v for k, v in fields.items() if v})
+
+
+def current_scope() -> Optional[Dict[str, str]]:
+    return _scope.get()
+
+
+@contextmanager
+def shared_usage(shares: List[Tuple[Optional[Dict[str, str]], float]]) -> Iterator[None]:
+    """Split the usage of model calls made inside the block across several request scopes,
+    in proportion to each weight (e.g. the length of that request's part of the prompt)."""
+    total = sum(w for _, w in shares) or 1.0
+    token = _shares.set([(scope or {}, w / total) for scope, w in shares])
+    try:
+        yield
+    finally:
+        _shares.reset(token)
+
+
+async def in_context(context: contextvars.Context, coro: Awaitable[T]) -> T:
+    """Await `coro` with the variables of `context` set (usage scope, an active profile);
+    for work handed to another event loop, which does not inherit the caller's context."""
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def key_id(api_key: Optional[str]) -> str:
+    """Stable, non-reversible label for an API key (never store the key itself)."""
+    if not api_key:
+        return "local"
+    digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+    return f"...{api_key[-4:]}#{digest}"
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds from rate-limit reset headers such as `7.66s`, `2m59.56s` or `120ms`."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = _DURATION_PART.findall(value)
+    return sum(float(n) * scale[u] for n, u in parts) if parts else None
+
+
+def _prices() -> Dict[str, Tuple[float, float]]:
+    prices = dict(DEFAULT_PRICES)
+    try:
+        for model, pair in json.loads(os.getenv("MODEL_PRICES", "{}")).items():
+            prices[model] = (float(pair[0]), float(pair[1]))
+    except (ValueError, TypeError, IndexError) as e:
+        print(f"Ignoring invalid MODEL_PRICES: {e}")
+    return prices
+
+
+class UsageLedger:
+    """Token and cost totals per (endpoint, repo, key, model), plus a rolling per-key
+    token window and the last rate-limit state providers reported for each key.
+
+    Totals are per process; each gunicorn worker keeps its own ledger.
+    """
+
+    def __init__(self, window_seconds: float = 60, max_rows: int = 10000):
+        self.window = window_seconds
+        self.max_rows = max_rows
+        self.started_at = time.time()
+        self.prices = _prices()
+        self._rows: Dict[Tuple[str, str, str, str, str], Dict[str, float]] = {}
+        self._recent: Dict[str, Deque[Tuple[float, int]]] = defaultdict(deque)
+        self._limits: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        provider: str,
+        model: str,
+        api_key: Optional[str],
+        prompt_tokens: Optional[int],
+        completion_tokens: Optional[int],
+    ) -> None:
+        """Charge one call to the current request scope, or split it across `shared_usage` scopes
+        (each then counts a fraction of the call and of its tokens and cost)."""
+        prompt_tokens = int(prompt_tokens or 0)
+        completion_tokens = int(completion_tokens or 0)
+        shares = _shares.get() or [(_scope.get() or {}, 1.0)]
+        kid = key_id(api_key)
+        price = self.prices.get(model or "")
+        cost = (prompt_tokens * price[0] + completion_tokens * price[1]) / 1e6 if price else 0.0
+        now = time.time()
+        with self._lock:
+            for scope, weight in shares:
+                row_key = (scope.get("endpoint") or "unknown", scope.get("repo") or "", kid, model or "", provider)
+                row = self._rows.get(row_key)
+                if row is None:
+                    if len(self._rows) >= self.max_rows:
+                        # Bound memory: fold new combinations into a catch-all repo bucket
+                        row_key = (row_key[0], "(other)") + row_key[2:]
+                    row = self._rows.setdefault(
+                        row_key, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0, "priced": bool(price)}
+                    )
+                row["calls"] += weight
+                row["prompt_tokens"] += prompt_tokens * weight
+                row["completion_tokens"] += completion_tokens * weight
+                row["cost_usd"] += cost * weight
+            self._recent[kid].append((now, prompt_tokens + completion_tokens))
+            self._trim(kid, now)
+
+    def record_rate_limit(self, api_key: Optional[str], limit: Any, remaining: Any, reset: Any) -> None:
+        """Remember the provider's own view of a key's token budget (x-ratelimit-*-tokens)."""
+        try:
+            state = {
+                "limit": float(limit) if limit not in (None, "") else 0.0,
+                "remaining": float(remaining),
+                "reset_at": time.time() + (parse_reset(str(reset)) or 0.0),
+            }
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            self._limits[key_id(api_key)] = state
+
+    def penalize(self, api_key: Optional[str], seconds: float) -> None:
+        """Treat a key as exhausted for `seconds` (after a 429 without usable headers)."""
+        with self._lock:
+            state = self._limits.setdefault(key_id(api_key), {"limit": 0.0})
+            state["remaining"] = 0.0
+            state["reset_at"] = time.time() + seconds
+
+    def _trim(self, kid: str, now: float) -> None:
+        recent = self._recent[kid]
+        while recent and recent[0][0] < now - self.window:
+            recent.popleft()
+
+    def window_usage(self, api_key: Optional[str]) -> Tuple[int, List[Tuple[float, int]]]:
+        """(tokens used in the last window, [(timestamp, tokens)] oldest first) for a key."""
+        kid = key_id(api_key)
+        with self._lock:
+            self._trim(kid, time.time())
+            entries = list(self._recent[kid])
+        return sum(t for _, t in entries), entries
+
+    def rate_limit(self, api_key: Optional[str]) -> Optional[Dict[str, float]]:
+        with self._lock:
+            state = self._limits.get(key_id(api_key))
+            return dict(state) if state else None
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = [
+                {"endpoint": k[0], "repo": k[1], "key": k[2], "model": k[3], "provider": k[4], **v}
+                for k, v in self._rows.items()
+            ]
+            limits = {k: dict(v) for k, v in self._limits.items()}
+            recent_keys = list(self._recent)
+        now = time.time()
+
+        def rollup(field: str) -> Dict[str, Dict[str, float]]:
+            out: Dict[str, Dict[str, float]] = {}
+            for row in rows:
+                agg = out.setdefault(row[field] or "(none)", {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+                for metric in agg:
+                    agg[metric] += row[metric]
+            return out
+
+        keys = {}
+        for kid in set(recent_keys) | set(limits):
+            with self._lock:
+                self._trim(kid, now)
+                used = sum(t for _, t in self._recent.get(kid, ()))
+            entry: Dict[str, Any] = {"tokens_last_window": used}
+            if kid in limits:
+                state = limits[kid]
+                entry["rate_limit"] = {
+                    "limit": state.get("limit"),
+                    "remaining": state.get("remaining"),
+                    "resets_in": max(0.0, state.get("reset_at", now) - now),
+                }
+            keys[kid] = entry
+
+        totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+        for row in rows:
+            for metric in totals:
+                totals[metric] += row[metric]
+        return {
+            "since": self.started_at,
+            "window_seconds": self.window,
+            "totals": totals,
+            "by_endpoint": rollup("endpoint"),
+            "by_repo": rollup("repo"),
+            "by_key": rollup("key"),
+            "by_model": rollup("model"),
+            "rows": sorted(rows, key=lambda r: -(r["prompt_tokens"] + r["completion_tokens"])),
+            "keys": keys,
+        }
+
+
+class KeyScheduler:
+    """Pick the API key that can take a request soonest under tokens-per-minute limits.
+
+    A key's budget is the limit the provider last reported, else the configured
+    `set_limit` value; 0 means unknown, in which case keys are simply balanced by
+    recent usage. Planned requests reserve their estimate until `release`, so
+    concurrent callers do not all pile onto the same key.
+    """
+
+    def __init__(self, ledger: UsageLedger):
+        self.ledger = ledger
+        self._configured: Dict[str, int] = {}
+        self._reserved: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def set_limit(self, api_key: str, tokens_per_minute: int) -> None:
+        self._configured[key_id(api_key)] = int(tokens_per_minute)
+
+    def _wait(self, api_key: str, estimate: int, now: float) -> Tuple[float, int]:
+        """(seconds until `api_key` has room for `estimate` tokens, tokens in flight or used)."""
+        kid = key_id(api_key)
+        used, entries = self.ledger.window_usage(api_key)
+        committed = used + self._reserved[kid]
+        wait = 0.0
+
+        state = self.ledger.rate_limit(api_key)
+        limit = self._configured.get(kid, 0)
+        if state:
+            if state.get("limit"):
+                limit = int(state["limit"])
+            if state.get("reset_at", 0) > now and state.get("remaining", estimate) - self._reserved[kid] < estimate:
+                wait = state["reset_at"] - now
+
+        if limit and estimate <= limit and limit - committed < estimate:
+            freed = 0
+            for ts, tokens in entries:
+                freed += tokens
+                if limit - (committed - freed) >= estimate:
+                    wait = max(wait, ts + self.ledger.window - now)
+                    break
+            else:
+                wait = max(wait, self.ledger.window)  # only in-flight reservations left; retry after a window
+        return wait, committed
+
+    def plan(self, keys: List[str], estimate: int, preferred: Optional[str] = None) -> Tuple[str, float]:
+        """Choose a key for a request of ~`estimate` tokens; returns (key, seconds to wait first)."""
+        now = time.time()
+        with self._lock:
+            ordered = ([preferred] if preferred in keys else []) + [k for k in keys if k != preferred]
+            scored = [(self._wait(k, estimate, now), i, k) for i, k in enumerate(ordered)]
+            (wait, _), _, best = min(scored, key=lambda s: (s[0][0], s[0][1], s[1]))
+            self._reserved[key_id(best)] += estimate
+        return best, wait
+
+    def release(self, api_key: str, estimate: int) -> None:
+        with self._lock:
+            kid = key_id(api_key)
+            self._reserved[kid] = max(0, self._reserved[kid] - estimate)
+
+
+def estimate_tokens(text: str, max_output: int = 0) -> int:
+    """Rough prompt size (~4 chars per token) plus the expected completion."""
+    return len(text) // 4 + max_output
+
+
+_ledger: Optional[UsageLedger] = None
+_scheduler: Optional[KeyScheduler] = None
+_singleton_lock = threading.Lock()
+
+
+def get_usage_ledger() -> UsageLedger:
+    """Process-wide ledger (USAGE_WINDOW_SECONDS, USAGE_MAX_ROWS)."""
+    global _ledger
+    with _singleton_lock:
+        if _ledger is None:
+            _ledger = UsageLedger(
+                window_seconds=float(os.getenv("USAGE_WINDOW_SECONDS", "60")),
+                max_rows=int(os.getenv("USAGE_MAX_ROWS", "10000")),
+            )
+        return _ledger
+
+
+def get_key_scheduler() -> KeyScheduler:
+    global _scheduler
+    ledger = get_usage_ledger()
+    with _singleton_lock:
+        if _scheduler is None:
+            _scheduler = KeyScheduler(ledger)
+        return _scheduler
+
+
+def record_usage(
+    provider: str,
+    model: str,
+    api_key: Optional[str],
+    prompt_tokens: Optional[int],
+    completion_tokens: Optional[int],
+) -> None:
+    """Single entry point for every model call's reported usage (ledger + metrics)."""
+    if not prompt_tokens and not completion_tokens:
+        return
+    get_usage_ledger().record(provider, model, api_key, prompt_tokens, completion_tokens)
+    record_tokens(provider, model, prompt_tokens, completion_tokens)
+
+
+def record_groq_response(model: str, api_key: Optional[str], data: Dict[str, Any], headers: Any = None) -> None:
+    """Usage block and x-ratelimit-*-tokens headers of an OpenAI-compatible Groq response."""
+    usage = data.get("usage") or (data.get("x_groq") or {}).get("usage") or {}
+    record_usage("groq", model, api_key, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+    if headers is not None and headers.get("x-ratelimit-remaining-tokens") is not None:
+        get_usage_ledger().record_rate_limit(
+            api_key,
+            headers.get("x-ratelimit-limit-tokens"),
+            headers.get("x-ratelimit-remaining-tokens"),
+            headers.get("x-ratelimit-reset-tokens"),
+        )
+
+
+def record_message_usage(provider: str, model: str, api_key: Optional[str], message: Any) -> None:
+    """Usage from a LangChain message's `usage_metadata` (input/output tokens), if present."""
+    meta = getattr(message, "usage_metadata", None) or {}
+    record_usage(provider, model, api_key, meta.get("input_tokens"), meta.get("output_tokens"))
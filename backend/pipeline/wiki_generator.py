@@ -1,31 +1,122 @@
 import os
 import json
+import asyncio
+import contextvars
+import threading
 import requests
 import re
 from typing import List, Dict, Any, Tuple, Optional
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+
+from code_compress import compress_code, language_for_path
+from core_logic import CoreLogicRanker, build_ranker
+from llm_batcher import new_nonce, pack_sections, split_sections
+from llm_cache import ainvoke_cached, invoke_cached
+from module_clustering import cluster_modules, import_graph
+from model_providers import ChatModelUnavailable, get_provider_registry
+from tracing import record_retry, span, traced
+from usage import estimate_tokens, get_key_scheduler, get_usage_ledger, in_context
+
+# All wiki LLM fan-out runs on one background event loop per process, so the per-key
+# concurrency limits below are shared by every in-flight wiki instead of each request
+# spinning up its own thread pool.
+WIKI_KEY_CONCURRENCY = int(os.getenv("WIKI_KEY_CONCURRENCY", "2"))
+_wiki_loop: Optional[asyncio.AbstractEventLoop] = None
+_wiki_loop_lock = threading.Lock()
+_key_semaphores: Dict[str, asyncio.Semaphore] = {}  # only touched from the wiki loop
+
+
+def _get_wiki_loop() -> asyncio.AbstractEventLoop:
+    global _wiki_loop
+    with _wiki_loop_lock:
+        if _wiki_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="wiki-fanout", daemon=True).start()
+            _wiki_loop = loop
+        return _wiki_loop
+
+
+def _key_semaphore(api_key: str) -> asyncio.Semaphore:
+    sem = _key_semaphores.get(api_key)
+    if sem is None:
+        sem = _key_semaphores[api_key] = asyncio.Semaphore(WIKI_KEY_CONCURRENCY)
+    return sem
+
+
+MODULE_SYSTEM_PROMPT = """You are a Staff Technical Documentarian. 
+You are synthesizing logic snippets for a SINGLE module into a PREMIUM technical wiki section.
+
+STRICT OUTPUT FORMAT:
+MODULE: [Product-Oriented System Name]
+[A substantial architectural summary of this module's role.]
+
+SUBSECTION: [Specific Component/Logic]
+[Deep technical analysis. Explain HOW it works, why it's implemented this way, and its dependencies.]
+```[language]
+// Most critical code segment
+```
+
+---
+INSTRUCTIONS:
+1. BE VERBOSE. Use dense technical insight.
+2. STAFF ENGINEER LEVEL. Focus on data flow and modularity."""
+
+# Several small modules in one request (see _plan_module_units); sections are split on the markers
+PACKED_MODULES_SYSTEM_PROMPT = """You are a Staff Technical Documentarian. 
+You are synthesizing logic snippets for SEVERAL independent modules into PREMIUM technical wiki sections, one per module.
+Each module's snippets follow a `=== SECTION-<tag>: <module> ===` line.
+
+STRICT OUTPUT FORMAT, repeated for EVERY section marker in the input, in the same order:
+=== SECTION-<tag>: <module> === (the marker line copied exactly, tag included)
+MODULE: [Product-Oriented System Name]
+[A substantial architectural summary of this module's role.]
+
+SUBSECTION: [Specific Component/Logic]
+[Deep technical analysis. Explain HOW it works, why it's implemented this way, and its dependencies.]
+```[language]
+// Most critical code segment
+```
+
+---
+INSTRUCTIONS:
+1. Write exactly one MODULE block per section marker; never merge, skip or rename sections.
+2. Nothing before the first marker.
+3. STAFF ENGINEER LEVEL. Focus on data flow and modularity."""
+
 
 class WikiPipeline:
-    def __init__(self, github_token: str, google_api_key: str = None, model_name: str = None):
+    # Core-logic line ranker; rebuilt per run from the repo's files (see core_logic.py)
+    core_ranker: Optional[CoreLogicRanker] = None
+    # (files_data, path -> extracted structure) of the current run; see _file_structures
+    _structure_cache: Optional[Tuple[Dict[str, str], Dict[str, str]]] = None
+
+    def __init__(self, github_token: str, google_api_key: str = None, model_name: str = None, providers: Optional[List[Any]] = None):
         self.github_token = github_token
         self.headers = {"Accept": "application/vnd.github.v3+json"}
         if github_token and "REPLACE" not in github_token:
             self.headers["Authorization"] = f"token {github_token}"
             
         # Support for multiple keys (Parallel processing)
-        # We can take a mix of Groq and Gemini keys
-        self.groq_keys = [k.strip() for k in (os.getenv("GROQ_API_KEYS") or os.getenv("GROQ_API_KEY") or "").split(',') if k.strip()]
-        self.gemini_keys = [k.strip() for k in (os.getenv("GOOGLE_API_KEY") or "").split(',') if k.strip()]
-
-        self.all_keys = self.groq_keys + self.gemini_keys
-        self.groq_model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
-        self.gemini_model = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+        # We can take a mix of Groq and Gemini keys; each key is its own registered provider
+        # (`providers` overrides the registry, e.g. with mock providers for offline benchmarks)
+        registry = get_provider_registry()
+        if providers is None:
+            providers = registry.by_kind("groq") + registry.by_kind("gemini")
+            self._configure_key_limits(registry)
+        self.key_providers = {}
+        for provider in providers:
+            try:
+                provider.chat_model(temperature=0.2)
+            except ChatModelUnavailable as e:
+                print(f"Skipping {provider.name} for wiki generation: {e}")
+                continue
+            self.key_providers[provider.api_key] = provider
+        self.all_keys = list(self.key_providers)
+        self.rate_limit_cooldown = float(os.getenv("WIKI_RATE_LIMIT_COOLDOWN", "90"))
         
         if self.all_keys:
-            print(f"Using {len(self.all_keys)} API keys ({len(self.groq_keys)} Groq, {len(self.gemini_keys)} Gemini) for Parallel Wiki Generation!")
+            n_groq = sum(1 for p in self.key_providers.values() if p.kind == "groq")
+            print(f"Using {len(self.all_keys)} API keys ({n_groq} Groq, {len(self.all_keys) - n_groq} other) for Parallel Wiki Generation!")
             # Default LLM for non-parallel fallback
             self.llm = self._get_llm_for_key(self.all_keys[0])
         else:
@@ -36,28 +127,38 @@ class WikiPipeline:
             'dist', 'build', '.env', 'package-lock.json', 'yarn.lock'
         ]
 
+    def _configure_key_limits(self, registry) -> None:
+        """Seed the key scheduler with per-key TPM budgets (GROQ_TPM_LIMIT / GEMINI_TPM_LIMIT).
+
+        0 (the default) leaves the budget to whatever the provider's rate-limit headers report.
+        """
+        scheduler = get_key_scheduler()
+        for kind, env in (("groq", "GROQ_TPM_LIMIT"), ("gemini", "GEMINI_TPM_LIMIT")):
+            limit = int(os.getenv(env, "0") or 0)
+            if limit:
+                for provider in registry.by_kind(kind):
+                    scheduler.set_limit(provider.api_key, limit)
+
+    async def _reserve_key(self, api_key: str, estimate: int) -> str:
+        """Key with room for ~`estimate` tokens (preferring `api_key`), after waiting if none has.
+
+        The caller must `release` the reservation on the returned key.
+        """
+        scheduler = get_key_scheduler()
+        key, wait = scheduler.plan(self.all_keys, estimate, preferred=api_key)
+        if wait > 0:
+            print(f"⏳ All keys near their token budget; waiting {wait:.1f}s")
+            with span("wiki_tpm_wait"):
+                await asyncio.sleep(wait)
+        return key
+
     def _get_llm_for_key(self, api_key: str):
-        """Dynamic LLM factory based on API key type."""
-        if api_key.startswith('gsk_'):
-            return ChatGroq(model_name=self.groq_model, groq_api_key=api_key, temperature=0.2)
-        else:
-            # Assume Gemini for other keys
-            return ChatGoogleGenerativeAI(model=self.gemini_model, google_api_key=api_key, temperature=0.2)
-
-    def _compress_code(self, code: str) -> str:
-        """Strip comments and excessive whitespace to save tokens."""
-        import re
-        if not code: return ""
-        # Remove single line comments
-        code = re.sub(r'#.*$', '', code, flags=re.MULTILINE) # Python
-        code = re.sub(r'//.*$', '', code, flags=re.MULTILINE) # JS/TS
-        # Remove multi-line comments
-        code = re.sub(r'/\*(.*?)\*/', '', code, flags=re.DOTALL)
-        code = re.sub(r'\'\'\'(.*?)\'\'\'', '', code, flags=re.DOTALL)
-        code = re.sub(r'\"\"\"(.*?)\"\"\"', '', code, flags=re.DOTALL)
-        # Remove excessive blank lines
-        lines = [l for l in code.splitlines() if l.strip()]
-        return "\n".join(lines)
+        """LangChain model for the provider that owns `api_key`."""
+        return self.key_providers[api_key].chat_model(temperature=0.2)
+
+    def _compress_code(self, code: str, file_path: str = "") -> str:
+        """Strip comments and excessive whitespace to save tokens (comment syntax by extension)."""
+        return compress_code(code, language_for_path(file_path))
 
     def _should_process(self, path: str) -> bool:
         for pattern in self.ignore_patterns:
@@ -94,7 +195,16 @@ class WikiPipeline:
 
 
 
-    def _parse_repo_slug(self, repo_url: str) -> str:
+    @staticmethod
+    def _clone_url(normalized_url: str) -> str:
+        """Clone from GITHUB_CLONE_BASE instead of github.com when set (local mirrors, load-test stubs)."""
+        base = os.getenv("GITHUB_CLONE_BASE")
+        if base and normalized_url.startswith("https://github.com/"):
+            return base.rstrip("/") + normalized_url[len("https://github.com"):]
+        return normalized_url
+
+    @staticmethod
+    def _parse_repo_slug(repo_url: str) -> str:
         """Best-effort extraction of owner/repo from a repo URL."""
         u = (repo_url or "").strip()
         # Common shapes:
@@ -200,6 +310,7 @@ class WikiPipeline:
         # Always keep deterministic ordering in later steps
         return groups
 
+    @traced("fetch_repo_files")
     def fetch_repo_files(self, repo_url: str) -> Tuple[Dict[str, str], Dict[str, Any]]:
         """Fetch file contents by cloning the repo (bypasses API limits).
 
@@ -222,43 +333,20 @@ class WikiPipeline:
             print(f"Cloning {normalized_url} to {clone_dir}...")
             
             # Simple git clone - depth 1 for speed
-            result = subprocess.run(
-                ["git", "clone", "--depth", "1", normalized_url, clone_dir],
-                capture_output=True,
-                text=True,
-                timeout=120  # 2 minute timeout
-            )
+            with span("git_clone"):
+                result = subprocess.run(
+                    ["git", "clone", "--depth", "1", self._clone_url(normalized_url), clone_dir],
+                    capture_output=True,
+                    text=True,
+                    timeout=120  # 2 minute timeout
+                )
             
             if result.returncode != 0:
                 error_msg = result.stderr if result.stderr else result.stdout
                 raise Exception(f"Git clone failed: {error_msg}")
 
-            files_data = {}
-            file_count = 0
-            
-            # Walk through the directory
-            for root, _, files in os.walk(clone_dir):
-                if file_count >= 40: break # Hard limit
-                
-                for file in files:
-                    if file_count >= 40: break
-                    
-                    file_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(file_path, clone_dir)
-                    
-                    if self._should_process(rel_path):
-                        try:
-                            # Skip if file is too large (>50KB)
-                            if os.path.getsize(file_path) > 50000: continue
-                            
-                            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                                content = f.read()
-                                if content.strip(): # Skip empty files
-                                    files_data[rel_path] = content
-                                    file_count += 1
-                        except Exception as e:
-                            print(f"Skipping {rel_path}: {e}")
-            
+            files_data = self._read_repo_dir(clone_dir)
+
             if len(files_data) == 0:
                 raise Exception("No code files found in repository. Please ensure the repository contains valid code files.")
             
@@ -299,42 +387,66 @@ class WikiPipeline:
             # Cleanup with Windows-friendly retries
             self._safe_rmtree(temp_dir)
 
+    def _read_repo_dir(self, root_dir: str) -> Dict[str, str]:
+        """Code files under `root_dir` as {relative path: content} (first 40, each under 50KB)."""
+        files_data = {}
+        file_count = 0
+
+        # Walk through the directory
+        with span("repo_walk"):
+            for root, _, files in os.walk(root_dir):
+                if file_count >= 40: break # Hard limit
+
+                for file in files:
+                    if file_count >= 40: break
+
+                    file_path = os.path.join(root, file)
+                    rel_path = os.path.relpath(file_path, root_dir).replace(os.sep, "/")
+
+                    if self._should_process(rel_path):
+                        try:
+                            # Skip if file is too large (>50KB)
+                            if os.path.getsize(file_path) > 50000: continue
+
+                            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                                content = f.read()
+                                if content.strip(): # Skip empty files
+                                    files_data[rel_path] = content
+                                    file_count += 1
+                        except Exception as e:
+                            print(f"Skipping {rel_path}: {e}")
+        return files_data
+
+    def read_local_repo(self, path: str) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """fetch_repo_files for a checkout already on disk (benchmarks, fixtures); no git involved.
+
+        Not reachable from the HTTP routes, which only ever clone GitHub URLs.
+        """
+        from datetime import datetime, timezone
+
+        files_data = self._read_repo_dir(path)
+        if not files_data:
+            raise Exception(f"No code files found in {path}.")
+        meta = {
+            "repo_url": path,
+            "repo": os.path.basename(os.path.normpath(path)),
+            "commit": None,
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "file_count": len(files_data),
+        }
+        return files_data, meta
+
     def _identify_core_logic(self, code: str) -> str:
-        """Extract only the most 'logic-dense' parts of a file.
-        Uses a heuristic density scorer (ML-style ranking) to find key sections.
+        """Extract only the most 'logic-dense' parts of a file (top lines by core_logic scorers).
+
+        Uses the repo-aware ranker set up by _file_structures, or density scoring alone
+        when called outside a pipeline run.
         """
-        lines = code.split('\n')
-        scored_lines = []
-        
-        # Stop words and boilerplate to ignore
-        ignore_keywords = {'import', 'from', 'export', 'require', 'const', 'let', 'var', 'self', 'this'}
-        
-        for i, line in enumerate(lines):
-            stripped = line.strip()
-            if not stripped or stripped.startswith(('#', '//', '*', '/')):
-                continue
-            
-            # Simple ML-style heuristic: logic density
-            # More complex lines (with logic operators, assignments, function calls) get higher scores
-            score = 0
-            if any(op in stripped for op in ['if ', 'for ', 'while ', 'return ', 'await ', 'async ', '= ']):
-                score += 5
-            if any(sym in stripped for sym in ['{', '(', '[', ':']):
-                score += 2
-            
-            # Count unique meaningful words (TF-IDF inspired)
-            words = set(stripped.lower().split()) - ignore_keywords
-            score += len(words)
-            
-            scored_lines.append((score, line))
-        
-        # Sort by score and take the top N most important lines, preserving order
-        top_lines = sorted(scored_lines, key=lambda x: x[0], reverse=True)[:50]
-        # Sort back to original order
-        result_lines = [l for _, l in sorted(top_lines, key=lambda x: lines.index(x[1]))]
-        
-        return "\n".join(result_lines)
+        if self.core_ranker is None:
+            self.core_ranker = build_ranker()
+        return self.core_ranker.select(code)
 
+    @traced("extract_code_structure")
     def _extract_code_structure(self, code: str, file_path: str) -> str:
         """Smarter structural extraction with semantic filtering"""
         ext = file_path.split('.')[-1].lower() if '.' in file_path else ''
@@ -357,7 +469,7 @@ class WikiPipeline:
 
         # 2. If signature list is short, add 'Core Logic' (Selective dense lines)
         if len(structure_parts) < 10:
-            compressed = self._compress_code(code)
+            compressed = self._compress_code(code, file_path)
             core_logic = self._identify_core_logic(compressed)
             return "\n".join(structure_parts) + "\n\n--- CORE LOGIC SNIPPETS ---\n" + core_logic
         
@@ -419,9 +531,8 @@ class WikiPipeline:
             ("user", "Module: {module_name}\n\nCode Structure:\n```\n{code}\n```\n\nGenerate wiki-style documentation for this module. Start directly with the content, no headers.")
         ])
         
-        chain = prompt | self.llm | StrOutputParser()
         try:
-            return chain.invoke({"module_name": module_name, "code": combined_structure})
+            return invoke_cached(self.llm, prompt.format_messages(module_name=module_name, code=combined_structure))
         except Exception as e:
             error_msg = str(e)
             # Provide helpful error message for model not found
@@ -469,44 +580,53 @@ class WikiPipeline:
         
         return summaries
 
-    def aggregate_modules(self, files_data: Dict[str, str]) -> Dict[str, Dict[str, str]]:
-        """Group files by their top-level directory, preserving file paths.
+    def _file_structures(self, files_data: Dict[str, str]) -> Dict[str, str]:
+        """Extracted structure of every file, computed once per run.
 
-        If most files are in root, cluster them into meaningful groups.
+        Module sizing (aggregate_modules) and the module prompts (_build_module_tasks)
+        both need it; the core-logic ranker is rebuilt for the repo first, since
+        identifier rarity is measured against the whole repo, not just the module.
         """
-        modules = {}
-        for path, content in files_data.items():
-            parts = path.split('/')
-            if len(parts) > 1:
-                module = parts[0]
-            else:
-                module = "root"
-            
-            if module not in modules:
-                modules[module] = {}
-            modules[module][path] = content
-
-        # If everything ended up in root, create better sidebar groups
-        if set(modules.keys()) == {"root"}:
-            return self._cluster_root_files(files_data)
-
-        # If root is huge compared to other modules, also split it
-        if "root" in modules and len(modules["root"]) >= 15:
-            root_groups = self._cluster_root_files(modules["root"])
-            # Merge back: replace root module with split groups
-            del modules["root"]
-            for k, v in root_groups.items():
-                modules[k] = v
-
-        return modules
+        cached = self._structure_cache
+        if cached is None or cached[0] is not files_data:
+            self.core_ranker = build_ranker(files_data)
+            structures = {p: self._extract_code_structure(c, p) for p, c in files_data.items()}
+            cached = self._structure_cache = (files_data, structures)
+        return cached[1]
+
+    @traced("aggregate_modules")
+    def aggregate_modules(self, files_data: Dict[str, str]) -> Dict[str, Dict[str, str]]:
+        """Group files into modules by directory and import graph, preserving file paths.
 
-    def _generate_overview_parallel(self, repo_info: str, all_modules_text: str, api_key: str) -> str:
+        Directories over WIKI_MODULE_MAX_TOKENS (measured on the extracted structure that
+        is sent) are split along import communities; those under WIKI_MODULE_MIN_TOKENS
+        are merged into the module they import from, or their parent directory (see
+        module_clustering.py). If most files are in root, they are first bucketed into
+        meaningful groups.
+        """
+        root_files = {p: c for p, c in files_data.items() if '/' not in p}
+        labels: Dict[str, str] = {}
+        # If everything is in root, or root is huge compared to other modules, create better sidebar groups
+        if root_files and (len(root_files) == len(files_data) or len(root_files) >= 15):
+            for group, members in self._cluster_root_files(root_files).items():
+                labels.update(dict.fromkeys(members, group))
+
+        structures = self._file_structures(files_data)
+        sizes = {p: estimate_tokens(f"File: {p}\n{structures[p]}") for p in files_data}
+        max_tokens = int(os.getenv("WIKI_MODULE_MAX_TOKENS", "6000"))
+        min_tokens = int(os.getenv("WIKI_MODULE_MIN_TOKENS", str(max_tokens // 4)))
+        clusters = cluster_modules(sizes, import_graph(files_data), max_tokens=max_tokens, min_tokens=min_tokens, labels=labels)
+        return {name: {p: files_data[p] for p in paths} for name, paths in clusters.items()}
+
+    async def _generate_overview_parallel(self, repo_info: str, all_modules_text: str, api_key: str) -> str:
         """Helper to generate a high-level overview using a specific API key with retry logic."""
-        import time
         max_retries = 3
-        retry_delay = 90  # 1.5 minutes as requested
+        retry_delay = self.rate_limit_cooldown
         
+        estimate = estimate_tokens(all_modules_text, 1500)
+
         for attempt in range(max_retries):
+            api_key = await self._reserve_key(api_key, estimate)
             try:
                 llm = self._get_llm_for_key(api_key)
                 prompt = ChatPromptTemplate.from_messages([
@@ -521,150 +641,284 @@ OVERVIEW:
 """),
                     ("user", "Repository Info:\n{repo_info}\n\nModules Map:\n{all_modules_text}")
                 ])
-                chain = prompt | llm | StrOutputParser()
-                return chain.invoke({"repo_info": repo_info, "all_modules_text": all_modules_text})
+                messages = prompt.format_messages(repo_info=repo_info, all_modules_text=all_modules_text)
+                async with _key_semaphore(api_key):
+                    with span("wiki_overview_attempt"):
+                        return await ainvoke_cached(llm, messages)
             except Exception as e:
                 err_str = str(e).lower()
                 if ("rate limit" in err_str or "429" in err_str) and attempt < max_retries - 1:
-                    print(f"⚠️ Rate limit hit for Overview. Waiting {retry_delay}s... (Attempt {attempt+1}/{max_retries})")
-                    time.sleep(retry_delay)
+                    print(f"⚠️ Rate limit hit for Overview. Rescheduling (key cools down {retry_delay}s)... (Attempt {attempt+1}/{max_retries})")
+                    record_retry("wiki_overview", "rate_limit")
+                    # The next attempt goes to another key, or waits out this one
+                    get_usage_ledger().penalize(api_key, retry_delay)
                     continue
                 return f"Error generating overview: {str(e)}"
+            finally:
+                get_key_scheduler().release(api_key, estimate)
         return "Error: Maximum retries exceeded for overview."
 
-    def _summarize_module_parallel(self, module_name: str, module_text: str, api_key: str) -> str:
+    async def _summarize_module_parallel(
+        self, module_name: str, module_text: str, api_key: str, system_prompt: str = MODULE_SYSTEM_PROMPT, max_output: int = 1500
+    ) -> str:
         """Helper to summarize a single module using a specific API key with retry logic."""
-        import time
         max_retries = 3
-        retry_delay = 90  # 1.5 minutes as requested
+        retry_delay = self.rate_limit_cooldown
         
+        estimate = estimate_tokens(module_text, max_output)
+
         for attempt in range(max_retries):
+            api_key = await self._reserve_key(api_key, estimate)
             try:
                 llm = self._get_llm_for_key(api_key)
                 prompt = ChatPromptTemplate.from_messages([
-                    ("system", """You are a Staff Technical Documentarian. 
-You are synthesizing logic snippets for a SINGLE module into a PREMIUM technical wiki section.
-
-STRICT OUTPUT FORMAT:
-MODULE: [Product-Oriented System Name]
-[A substantial architectural summary of this module's role.]
-
-SUBSECTION: [Specific Component/Logic]
-[Deep technical analysis. Explain HOW it works, why it's implemented this way, and its dependencies.]
-```[language]
-// Most critical code segment
-```
-
----
-INSTRUCTIONS:
-1. BE VERBOSE. Use dense technical insight.
-2. STAFF ENGINEER LEVEL. Focus on data flow and modularity."""),
+                    ("system", system_prompt),
                     ("user", "Logic Extracts for Module: {module_name}\n\n{module_text}")
                 ])
-                chain = prompt | llm | StrOutputParser()
-                return chain.invoke({"module_name": module_name, "module_text": module_text})
+                messages = prompt.format_messages(module_name=module_name, module_text=module_text)
+                async with _key_semaphore(api_key):
+                    with span("wiki_module_attempt"):
+                        return await ainvoke_cached(llm, messages)
             except Exception as e:
                 err_str = str(e).lower()
                 if ("rate limit" in err_str or "429" in err_str) and attempt < max_retries - 1:
-                    print(f"⚠️ Rate limit hit for {module_name}. Waiting {retry_delay}s... (Attempt {attempt+1}/{max_retries})")
-                    time.sleep(retry_delay)
+                    print(f"⚠️ Rate limit hit for {module_name}. Rescheduling (key cools down {retry_delay}s)... (Attempt {attempt+1}/{max_retries})")
+                    record_retry("wiki_module", "rate_limit")
+                    get_usage_ledger().penalize(api_key, retry_delay)
                     continue
                 return f"Error generating module {module_name}: {str(e)}"
+            finally:
+                get_key_scheduler().release(api_key, estimate)
         return f"Error: Maximum retries exceeded for module {module_name}."
 
-    def generate_wiki(self, repo_url: str) -> Dict[str, Any]:
-        """Main pipeline execution with PARALLEL module processing using multiple API keys."""
-        from concurrent.futures import ThreadPoolExecutor
-        
-        print(f"1. Fetching files for {repo_url}...")
-        files_data, meta = self.fetch_repo_files(repo_url)
+    def _plan_module_units(self, module_tasks: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+        """Group small modules so several share one LLM request; large ones stay alone.
+
+        Per-minute request limits, not tokens, are what throttle wiki generation for
+        repos with many tiny modules.
+        """
+        small_chars = int(os.getenv("WIKI_BATCH_SMALL_CHARS", "3000"))
+        max_chars = int(os.getenv("WIKI_BATCH_MAX_CHARS", "12000"))
+        max_items = int(os.getenv("WIKI_BATCH_MAX_ITEMS", "4"))
+
+        units: List[List[Tuple[str, str]]] = []
+        pack: List[Tuple[str, str]] = []
+        pack_chars = 0
+        for m_name, m_text in module_tasks:
+            if len(m_text) > small_chars or max_items <= 1:
+                units.append([(m_name, m_text)])
+                continue
+            if pack and (len(pack) >= max_items or pack_chars + len(m_text) > max_chars):
+                units.append(pack)
+                pack, pack_chars = [], 0
+            pack.append((m_name, m_text))
+            pack_chars += len(m_text)
+        if pack:
+            units.append(pack)
+        return units
+
+    async def _summarize_unit(self, unit: List[Tuple[str, str]], api_key: str) -> Dict[str, str]:
+        """Summarize one module, or several small ones in a single packed request."""
+        if len(unit) == 1:
+            m_name, m_text = unit[0]
+            return {m_name: await self._summarize_module_parallel(m_name, m_text, api_key)}
+
+        names = [m_name for m_name, _ in unit]
+        nonce = new_nonce()
+        packed = pack_sections("Write a separate wiki section for each module below.", unit, label="SECTION", id_name="module", nonce=nonce)
+        raw = await self._summarize_module_parallel(
+            ", ".join(names), packed, api_key, system_prompt=PACKED_MODULES_SYSTEM_PROMPT, max_output=1500 * len(unit)
+        )
+        sections = split_sections(raw, label="SECTION", nonce=nonce)
+        results: Dict[str, str] = {}
+        dropped: List[Tuple[str, str]] = []
+        for m_name, m_text in unit:
+            if sections.get(m_name):
+                results[m_name] = sections[m_name]
+            elif raw.startswith("Error"):
+                results[m_name] = raw
+            else:
+                dropped.append((m_name, m_text))
+        if dropped:
+            # The model dropped these modules from the packed answer; ask for each alone, concurrently
+            retried = await asyncio.gather(*(self._summarize_module_parallel(m_name, m_text, api_key) for m_name, m_text in dropped))
+            results.update(zip((m_name for m_name, _ in dropped), retried))
+        return results
+
+    def _module_section(self, m_name: str, raw_summary: str) -> Dict[str, Any]:
+        """Turn a raw `MODULE:/SUBSECTION:` response into a wiki section."""
+        # Extraction logic
+        title = m_name.capitalize()
+        summary = raw_summary
+        if "MODULE:" in raw_summary:
+            parts = raw_summary.split("\n", 1)
+            title = parts[0].replace("MODULE:", "").strip()
+            summary = parts[1].strip() if len(parts) > 1 else ""
+
+        sub_parts = summary.split("SUBSECTION:")
+        main_content = sub_parts[0].strip()
+        children = []
         
+        for sub_part in sub_parts[1:]:
+            lines = sub_part.strip().split('\n', 1)
+            if not lines[0]: continue
+            sub_title = lines[0].strip()
+            sub_body = lines[1].strip() if len(lines) > 1 else ""
+            sub_paras = [p.strip() for p in sub_body.split('\n\n') if p.strip()]
+            children.append({
+                "id": f"{m_name}-{sub_title}".lower().replace(' ', '-').replace('_', '-').replace('/', '-'),
+                "title": sub_title,
+                "content": sub_paras
+            })
+
+        main_paras = [p.strip() for p in main_content.split('\n\n') if p.strip()]
+        if not main_paras and not children:
+            main_paras = ["No detailed summary available for this module."]
+
+        return {
+            "id": m_name.lower().replace(' ', '-').replace('_', '-'),
+            "title": title,
+            "content": main_paras,
+            "children": children if children else None
+        }
+
+    def _prepare_fan_out(self, files_data: Dict[str, str], meta: Dict[str, Any]) -> Tuple[List[Tuple[str, str]], str, str]:
+        """Aggregate modules and build the per-module LLM inputs."""
         print("2. Aggregating modules...")
         modules = self.aggregate_modules(files_data)
-        
-        wiki_sections: List[Dict[str, Any]] = []
+        return self._build_module_tasks(modules, files_data, meta)
 
-        # Prepare module data for parallel processing
-        print(f"3. Generating summaries in parallel using {len(self.all_keys)} keys...")
-        
+    def _build_module_tasks(
+        self, modules: Dict[str, Dict[str, str]], files_data: Dict[str, str], meta: Dict[str, Any]
+    ) -> Tuple[List[Tuple[str, str]], str, str]:
+        """Extract each module's code structure into its LLM input, plus the overview inputs."""
+        structures = self._file_structures(files_data)
         module_tasks = []
         for module_name, files_dict in modules.items():
             if not files_dict: continue
-            
-            # Increase visibility: take top 7 files
-            sorted_files = sorted(files_dict.items(), key=lambda x: len(x[1]) if x[1] else 0, reverse=True)[:7] 
-            structured_content = [f"File: {p}\n{self._extract_code_structure(c, p)}" for p, c in sorted_files]
+
+            # Modules are token-bounded by aggregate_modules, so every file goes in, largest first
+            sorted_files = sorted(files_dict.items(), key=lambda x: len(x[1]) if x[1] else 0, reverse=True)
+            structured_content = [
+                f"File: {p}\n{structures[p] if p in structures else self._extract_code_structure(c, p)}" for p, c in sorted_files
+            ]
             module_text = f"### MODULE: {module_name}\n" + "\n\n".join(structured_content)
             module_tasks.append((module_name, module_text))
 
         all_paths = sorted(files_data.keys())
         repo_info = f"Repository: {meta.get('repo') or meta.get('repo_url')}\nStructure (sample):\n" + "\n".join([f"- {p}" for p in all_paths[:20]])
         all_modules_text = "\n".join([f"- {m}" for m in modules.keys()])
+        return module_tasks, repo_info, all_modules_text
+
+    async def _fan_out(
+        self,
+        module_tasks: List[Tuple[str, str]],
+        repo_info: str,
+        all_modules_text: str,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Summarize the overview and every module concurrently on the wiki loop.
+
+        Concurrency is bounded per API key across all in-flight wikis. If `cancel_event`
+        is set (client went away), outstanding module tasks are cancelled and whatever
+        finished is returned together with the names of the cancelled modules.
+        """
+        print(f"3. Generating summaries in parallel using {len(self.all_keys)} keys...")
+        overview_task = asyncio.ensure_future(
+            self._generate_overview_parallel(repo_info, all_modules_text, self.all_keys[0])
+        )
+        # Module tasks (rotating keys); small modules share one request
+        units = self._plan_module_units(module_tasks)
+        unit_futures = [
+            asyncio.ensure_future(self._summarize_unit(unit, self.all_keys[i % len(self.all_keys)]))
+            for i, unit in enumerate(units)
+        ]
+        module_futures = {m_name: future for unit, future in zip(units, unit_futures) for m_name, _ in unit}
+        all_tasks = [overview_task] + unit_futures
 
+        async def watch_cancel() -> None:
+            while cancel_event is not None and not cancel_event.is_set():
+                await asyncio.sleep(0.5)
+            for task in all_tasks:
+                task.cancel()
+
+        watcher = asyncio.ensure_future(watch_cancel()) if cancel_event is not None else None
         try:
-            with ThreadPoolExecutor(max_workers=len(self.all_keys) or 5) as executor:
-                # 1. Overview task
-                overview_key = self.all_keys[0]
-                overview_future = executor.submit(self._generate_overview_parallel, repo_info, all_modules_text, overview_key)
-                
-                # 2. Module tasks (rotating keys)
-                module_futures = []
-                for i, (m_name, m_text) in enumerate(module_tasks):
-                    key = self.all_keys[i % len(self.all_keys)]
-                    module_futures.append(executor.submit(self._summarize_module_parallel, m_name, m_text, key))
-                
-                # Collect Overview
-                overview_text = overview_future.result()
-                overview_paras = [p.strip() for p in overview_text.split("\n\n") if p.strip()]
-                wiki_sections.append({
-                    "id": "overview",
-                    "title": "Overview",
-                    "content": overview_paras if overview_paras else [overview_text.strip()],
-                })
-
-                # Collect Modules
-                for i, (m_name, _) in enumerate(module_tasks):
-                    raw_summary = module_futures[i].result()
-                    
-                    # Extraction logic
-                    title = m_name.capitalize()
-                    summary = raw_summary
-                    if "MODULE:" in raw_summary:
-                        parts = raw_summary.split("\n", 1)
-                        title = parts[0].replace("MODULE:", "").strip()
-                        summary = parts[1].strip() if len(parts) > 1 else ""
-
-                    sub_parts = summary.split("SUBSECTION:")
-                    main_content = sub_parts[0].strip()
-                    children = []
-                    
-                    for sub_part in sub_parts[1:]:
-                        lines = sub_part.strip().split('\n', 1)
-                        if not lines[0]: continue
-                        sub_title = lines[0].strip()
-                        sub_body = lines[1].strip() if len(lines) > 1 else ""
-                        sub_paras = [p.strip() for p in sub_body.split('\n\n') if p.strip()]
-                        children.append({
-                            "id": f"{m_name}-{sub_title}".lower().replace(' ', '-').replace('_', '-').replace('/', '-'),
-                            "title": sub_title,
-                            "content": sub_paras
-                        })
-
-                    main_paras = [p.strip() for p in main_content.split('\n\n') if p.strip()]
-                    if not main_paras and not children:
-                        main_paras = ["No detailed summary available for this module."]
-
-                    wiki_sections.append({
-                        "id": m_name.lower().replace(' ', '-').replace('_', '-'),
-                        "title": title,
-                        "content": main_paras,
-                        "children": children if children else None
-                    })
+            await asyncio.gather(*all_tasks, return_exceptions=True)
+        finally:
+            if watcher:
+                watcher.cancel()
+
+        wiki_sections: List[Dict[str, Any]] = []
+        cancelled: List[str] = []
+
+        # Collect Overview
+        if overview_task.cancelled():
+            cancelled.append("Overview")
+        else:
+            overview_text = overview_task.result()
+            overview_paras = [p.strip() for p in overview_text.split("\n\n") if p.strip()]
+            wiki_sections.append({
+                "id": "overview",
+                "title": "Overview",
+                "content": overview_paras if overview_paras else [overview_text.strip()],
+            })
+
+        # Collect Modules
+        for m_name, _ in module_tasks:
+            future = module_futures[m_name]
+            if future.cancelled():
+                cancelled.append(m_name)
+                continue
+            wiki_sections.append(self._module_section(m_name, future.result()[m_name]))
+
+        return wiki_sections, cancelled
 
+    def _finish(self, meta: Dict[str, Any], files_data: Dict[str, str], wiki_sections: List[Dict[str, Any]], cancelled: List[str]) -> Dict[str, Any]:
+        if cancelled:
+            meta["partial"] = True
+            meta["cancelled_modules"] = cancelled
+            print(f"⚠️ Wiki generation cancelled; returning {len(wiki_sections)} completed sections.")
+        else:
             print(f"✅ Parallel generation complete! Speedup: ~{len(self.all_keys)}x")
-            
+        return {"meta": meta, "sections": wiki_sections, "files_data": files_data}
+
+    def generate_wiki(self, repo_url: str, cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """Main pipeline execution with PARALLEL module processing using multiple API keys."""
+        print(f"1. Fetching files for {repo_url}...")
+        files_data, meta = self.fetch_repo_files(repo_url)
+        module_tasks, repo_info, all_modules_text = self._prepare_fan_out(files_data, meta)
+
+        try:
+            future = asyncio.run_coroutine_threadsafe(
+                in_context(contextvars.copy_context(), self._fan_out(module_tasks, repo_info, all_modules_text, cancel_event)),
+                _get_wiki_loop(),
+            )
+            wiki_sections, cancelled = future.result()
         except Exception as e:
             print(f"❌ Error during parallel generation: {e}")
-            wiki_sections.append({"id": "error", "title": "Error", "content": [str(e)]})
-            
-        return {"meta": meta, "sections": wiki_sections, "files_data": files_data}
\ No newline at end of file
+            return {"meta": meta, "sections": [{"id": "error", "title": "Error", "content": [str(e)]}], "files_data": files_data}
+
+        return self._finish(meta, files_data, wiki_sections, cancelled)
+
+    async def agenerate_wiki(self, repo_url: str, cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """Async twin of generate_wiki for the ASGI app; the caller's loop is never blocked."""
+        print(f"1. Fetching files for {repo_url}...")
+        files_data, meta = await asyncio.to_thread(self.fetch_repo_files, repo_url)
+        module_tasks, repo_info, all_modules_text = await asyncio.to_thread(self._prepare_fan_out, files_data, meta)
+
+        future = asyncio.run_coroutine_threadsafe(
+            in_context(contextvars.copy_context(), self._fan_out(module_tasks, repo_info, all_modules_text, cancel_event)),
+            _get_wiki_loop(),
+        )
+        try:
+            wiki_sections, cancelled = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if cancel_event is not None:
+                cancel_event.set()
+            raise
+        except Exception as e:
+            print(f"❌ Error during parallel generation: {e}")
+            return {"meta": meta, "sections": [{"id": "error", "title": "Error", "content": [str(e)]}], "files_data": files_data}
+
+        return self._finish(meta, files_data, wiki_sections, cancelled)
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from edit_applier import LineIndex, apply_edits
+
+
+def _edit(sl, sc, el, ec, replacement):
+    return {"start_line": sl, "start_col": sc, "end_line": el, "end_col": ec, "replacement": replacement}
+
+
+def test_applies_non_overlapping_edits_in_offset_order():
+    result = apply_edits("alpha\nbeta\ngamma\n", [_edit(3, 1, 3, 6, "GAMMA"), _edit(1, 1, 1, 6, "ALPHA")])
+    assert result["patched"] == "ALPHA\nbeta\nGAMMA\n"
+    assert len(result["applied"]) == 2 and not result["rejected"]
+
+
+def test_rejects_overlap_out_of_range_and_reversed():
+    edits = [
+        _edit(1, 1, 2, 3, "X"),
+        _edit(2, 1, 2, 2, "overlaps"),
+        _edit(9, 1, 9, 1, "past the end"),
+        _edit(1, 9, 1, 9, "past the line"),
+        _edit(3, 2, 3, 1, "reversed"),
+    ]
+    result = apply_edits("abc\ndef\nghi", edits)
+    assert result["patched"] == "Xf\nghi"
+    reasons = sorted(r["reason"].split(" ")[0] for r in result["rejected"])
+    assert reasons == ["column", "end", "line", "overlaps"]
+
+
+def test_inserts_at_one_point_keep_model_order():
+    result = apply_edits("ab", [_edit(1, 2, 1, 2, "1"), _edit(1, 2, 1, 2, "2")])
+    assert result["patched"] == "a12b"
+
+
+def test_python_validation_flags_introduced_errors():
+    result = apply_edits("x = 1\n", [_edit(1, 5, 1, 6, "(")], file_path="m.py")
+    assert result["validation"]["ok"] is False and result["validation"]["introduced"] is True
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_edits_match_reference(seed):
+    rng = random.Random(seed)
+    text = "".join(rng.choice("ab\n") for _ in range(rng.randint(1, 60)))
+    index = LineIndex(text)
+    coords = [(line, col) for line in range(1, len(index.starts) + 1) for col in range(1, index.line_length(line) + 2)]
+    edits = []
+    for _ in range(rng.randint(1, 6)):
+        a, b = sorted(rng.sample(range(len(coords)), 2)) if len(coords) > 1 else (0, 0)
+        edits.append(_edit(*coords[a], *coords[b], rng.choice(["", "X", "Y\n"])))
+
+    result = apply_edits(text, edits)
+
+    # Reference: the applied edits, replayed back to front on the flat text
+    spans = sorted(((index.offset(e["start_line"], e["start_col"]), index.offset(e["end_line"], e["end_col"]), e) for e in result["applied"]), key=lambda s: s[0])
+    for (_, end, _), (start, _, _) in zip(spans, spans[1:]):
+        assert end <= start
+    expected = text
+    for start, end, e in reversed(spans):
+        expected = expected[:start] + e["replacement"] + expected[end:]
+    assert result["patched"] == expected
+    assert len(result["applied"]) + len(result["rejected"]) == len(edits)
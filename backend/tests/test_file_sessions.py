@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from edit_applier import LineIndex
+from file_sessions import FileSessionStore, PieceTable
+from state_backend import MemoryStateBackend
+
+
+def _random_text(rng: random.Random, n: int) -> str:
+    return "".join(rng.choice("ab\n") for _ in range(n))
+
+
+def _check_offsets(table: PieceTable, text: str) -> None:
+    index = LineIndex(text)
+    assert table.line_count() == len(index.starts)
+    for line in range(1, len(index.starts) + 1):
+        for col in range(1, index.line_length(line) + 2):
+            assert table.offset(line, col) == index.offset(line, col)
+        with pytest.raises(ValueError):
+            table.offset(line, index.line_length(line) + 2)
+    with pytest.raises(ValueError):
+        table.offset(len(index.starts) + 1, 1)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_piece_table_matches_flat_text(seed):
+    rng = random.Random(seed)
+    text = _random_text(rng, rng.randint(0, 40))
+    table = PieceTable(text)
+    for _ in range(60):
+        start = rng.randint(0, len(text))
+        end = rng.randint(start, len(text))
+        insert = _random_text(rng, rng.randint(0, 6))
+        table.replace(start, end, insert)
+        text = text[:start] + insert + text[end:]
+        assert table.length == len(text)
+        assert table.text() == text
+        _check_offsets(table, text)
+
+
+def test_compaction_keeps_text():
+    table = PieceTable("x\n" * 10)
+    text = table.text()
+    for i in range(PieceTable.COMPACT_PIECES + 10):
+        pos = (i * 7) % (len(text) + 1)
+        table.replace(pos, pos, "y")
+        text = text[:pos] + "y" + text[pos:]
+    assert len(table._pieces) <= PieceTable.COMPACT_PIECES
+    assert table.text() == text
+    _check_offsets(table, text)
+
+
+def test_snapshot_restore_and_bad_range():
+    table = PieceTable("one\ntwo\n")
+    state = table.snapshot()
+    table.replace(0, 3, "ONE")
+    table.restore(state)
+    assert table.text() == "one\ntwo\n"
+    with pytest.raises(ValueError):
+        table.replace(3, 100, "")
+
+
+def test_backend_round_trip_through_delta_log():
+    backend = MemoryStateBackend()
+    worker_a = FileSessionStore(backend=backend)
+    worker_b = FileSessionStore(backend=backend)
+    session = worker_a.create("a.py", "one\ntwo\n")
+    snapshot = backend.load_session(f"file:{session.session_id}")
+
+    text = "one\ntwo\n"
+    for i in range(5):
+        result = worker_a.apply_deltas(session.session_id, session.hash, [{"offset": 0, "length": 0, "text": f"{i}"}])
+        assert result["ok"]
+        text = f"{i}" + text
+    # Small edits only append to the log; the snapshot row is left alone
+    assert backend.load_session(f"file:{session.session_id}") is snapshot
+    assert len(backend.load_session(f"file:{session.session_id}:log")["deltas"]) == 5
+
+    other = worker_b.get(session.session_id)
+    assert other.text() == text
+    assert other.hash == session.hash
+
+    # A failed expected_hash check leaves the session and its hash untouched
+    before = session.hash
+    result = worker_a.apply_deltas(session.session_id, before, [{"offset": 0, "length": 1, "text": ""}], expected_hash="nope")
+    assert result["code"] == "stale_base" and result["hash"] == before
+    assert session.text() == text and session.hash == before
@@ -0,0 +1,50 @@
+import json
+import random
+
+import pytest
+
+from json_stream import IncrementalArrayParser
+
+DOCUMENT = "Here you go:\n```json\n" + json.dumps({
+    "note": "braces } and ] and \"edits\" inside strings",
+    "edits": [
+        {"start_line": 1, "replacement": "def f():\n    return {\"a\": [1, 2]}\n"},
+        {"start_line": 2, "replacement": "x = '\\\\'  # escaped backslash }"},
+        {"start_line": 3, "replacement": "", "meta": {"nested": [{"deep": "]}"}]}},
+    ],
+    "other": [{"start_line": 99}],
+}) + "\n```"
+EXPECTED = json.loads(DOCUMENT.split("```json\n")[1].rsplit("\n```")[0])["edits"]
+
+
+def _feed_all(parser: IncrementalArrayParser, chunks):
+    out = []
+    for chunk in chunks:
+        out.extend(parser.feed(chunk))
+    return out
+
+
+def test_whole_document():
+    assert _feed_all(IncrementalArrayParser(), [DOCUMENT]) == EXPECTED
+
+
+def test_one_character_at_a_time():
+    parser = IncrementalArrayParser()
+    assert _feed_all(parser, list(DOCUMENT)) == EXPECTED
+    assert parser.text == DOCUMENT and not parser.errors
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_chunk_splits(seed):
+    rng = random.Random(seed)
+    cuts = sorted(rng.sample(range(1, len(DOCUMENT)), rng.randint(1, 40)))
+    chunks = [DOCUMENT[a:b] for a, b in zip([0] + cuts, cuts + [len(DOCUMENT)])]
+    assert _feed_all(IncrementalArrayParser(), chunks) == EXPECTED
+
+
+def test_elements_arrive_as_soon_as_they_close():
+    parser = IncrementalArrayParser()
+    first = '{"edits": [{"a": 1}'
+    assert parser.feed(first) == [{"a": 1}]
+    assert parser.feed(', {"b": ') == []
+    assert parser.feed('2}]}') == [{"b": 2}]
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from module_clustering import cluster_modules, import_graph
+
+
+def _sizes(modules, sizes):
+    return {name: sum(sizes[p] for p in paths) for name, paths in modules.items()}
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_every_file_once_and_within_bound(seed):
+    rng = random.Random(seed)
+    dirs = ["", "a", "a/b", "a/b/c", "d", "d/e", "f"]
+    sizes = {f"{rng.choice(dirs)}/m{i}.py".lstrip("/"): rng.randint(10, 900) for i in range(rng.randint(1, 120))}
+    graph = {}
+    paths = sorted(sizes)
+    for _ in range(len(paths)):
+        a, b = rng.choice(paths), rng.choice(paths)
+        if a != b:
+            graph.setdefault(a, {})[b] = graph.setdefault(b, {})[a] = 1
+    modules = cluster_modules(sizes, graph, max_tokens=2000, min_tokens=500)
+
+    assigned = [p for group in modules.values() for p in group]
+    assert sorted(assigned) == paths
+    assert all(size <= 2000 for size in _sizes(modules, sizes).values())
+
+
+def test_oversized_file_stays_alone_and_is_kept():
+    sizes = {"a/huge.py": 5000, "a/small.py": 100}
+    modules = cluster_modules(sizes, {}, max_tokens=1000, min_tokens=200)
+    assert ["a/huge.py"] in modules.values()
+    assert sorted(p for g in modules.values() for p in g) == sorted(sizes)
+
+
+def test_small_directory_merges_into_import_partner():
+    sizes = {"core/x.py": 300, "core/y.py": 300, "util/z.py": 50, "other/w.py": 900}
+    graph = {"util/z.py": {"core/x.py": 1}, "core/x.py": {"util/z.py": 1}}
+    modules = cluster_modules(sizes, graph, max_tokens=2000, min_tokens=500)
+    together = next(g for g in modules.values() if "util/z.py" in g)
+    assert "core/x.py" in together and "other/w.py" not in together
+
+
+def test_split_keeps_import_communities_together():
+    sizes = {f"pkg/{side}{i}.ts": 100 for side in "ab" for i in range(5)}
+    graph = {}
+    for side in "ab":
+        for i in range(4):
+            p, q = f"pkg/{side}{i}.ts", f"pkg/{side}{i + 1}.ts"
+            graph.setdefault(p, {})[q] = graph.setdefault(q, {})[p] = 1
+    modules = cluster_modules(sizes, graph, max_tokens=500, min_tokens=100)
+    groups = [set(g) for g in modules.values()]
+    assert len(groups) == 2
+    assert {f"pkg/a{i}.ts" for i in range(5)} in groups
+
+
+def test_import_graph_resolves_languages():
+    files = {
+        "app/__init__.py": "",
+        "app/main.py": "from .db import x\nimport lib.util\n",
+        "app/db.py": "",
+        "lib/util.py": "",
+        "web/src/index.ts": "import { a } from './a';\nimport { core } from '@acme/core';\n",
+        "web/src/a.ts": "",
+        "packages/core/index.ts": "",
+        "cmd/main.go": 'import (\n\t"github.com/x/y/internal/store"\n)\n',
+        "internal/store/store.go": "",
+        "src/com/ex/A.java": "import com.ex.util.B;\n",
+        "src/com/ex/util/B.java": "",
+    }
+    graph = import_graph(files)
+    assert set(graph["app/main.py"]) == {"app/db.py", "lib/util.py"}
+    assert set(graph["web/src/index.ts"]) == {"web/src/a.ts", "packages/core/index.ts"}
+    assert set(graph["cmd/main.go"]) == {"internal/store/store.go"}
+    assert set(graph["src/com/ex/A.java"]) == {"src/com/ex/util/B.java"}